@@ -12,12 +12,15 @@
 """
 
 from random import choice, shuffle
-import numpy as np
 import multimatch_gaze as mm
 import os
+import sys
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, confusion_matrix, classification_report
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Preprocess", "Common"))
+from scanpath_store import ScanpathStore
+
 screen_size = [1920, 1080]
 TDir = 45.0
 TAmp = 100.0
@@ -31,8 +34,8 @@ too_MW = ["24K", "31M", "26K", "21H", "10H"]
 black_list = set(missing_data + too_focus + too_MW)
 print(len(black_list))
 
-def read_scanpaths(input_dir, file_list):
-    return [np.recfromcsv(os.path.join(input_dir, file), delimiter='\t', dtype=[('start_x', 'f8'), ('start_y', 'f8'), ('duration', 'f8')]) for file in file_list]
+def read_scanpaths(store, key_list):
+    return [store.get(*key) for key in key_list]
 
 def create_pairs(scanpath_list1, scanpath_list2, label, TDir, TAmp, TDur):
     pairs = []
@@ -85,15 +88,15 @@ def evaluate_parameters(TDir, TAmp, TDur, MW_training_list, Focus_training_list,
     return accuracy, precision, recall, f1, roc_auc, cm, report
 
 if __name__ == '__main__':
-    input_dir = "./Preprocess/FreeViewing/Scanpath/MultiMatch"
-    name_list = [name for name in os.listdir(input_dir) if name not in black_list and not name.startswith(".")]
+    # Written by Preprocess/FreeViewing/Code/scanpath_MM.py
+    store = ScanpathStore("./Preprocess/FreeViewing/Scanpath/MultiMatch.scanpaths")
+    name_list = [name for name in store.participants() if name not in black_list]
     name = choice(name_list)
     print("Choosing {} as the individual test".format(name))
-    input_dir = os.path.join(input_dir, name)
-    Focus_stim_list = [name for name in os.listdir(input_dir) if name.endswith("Focus.tsv")]
-    MW_stim_list = [name for name in os.listdir(input_dir) if name.endswith("MW.tsv")]
-    Focus_list = read_scanpaths(input_dir, Focus_stim_list)
-    MW_list = read_scanpaths(input_dir, MW_stim_list)
+    Focus_stim_list = store.keys(participant=name, state="Focus")
+    MW_stim_list = store.keys(participant=name, state="MW")
+    Focus_list = read_scanpaths(store, Focus_stim_list)
+    MW_list = read_scanpaths(store, MW_stim_list)
 
     print("Participant {} has {} Focus and {} MW stimuli".format(name, len(Focus_list), len(MW_list)))
     print("Choosing {} MW and {} Focus stimuli for training".format(training_num, training_num))
@@ -1,5 +1,9 @@
 import multimatch_gaze as m
-import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Preprocess", "Common"))
+from scanpath_store import ScanpathStore
 
 screen_size = [1920, 1080]
 participant = '1Y'
@@ -12,19 +16,12 @@ TDir = 45.0
 TAmp = 100.0
 TDur = 0.3
 
-# read in data
-fix_vector1 = np.recfromcsv(f'./Preprocess/FreeViewing/Scanpath/MultiMatch/{participant}/{participant}_{stimuli1}.tsv',
-delimiter='\t', dtype={'names': ('start_x', 'start_y', 'duration'),
-'formats': ('f8', 'f8', 'f8')})
-fix_vector2 = np.recfromcsv(f'./Preprocess/FreeViewing/Scanpath/MultiMatch/{participant}/{participant}_{stimuli2}.tsv',
-delimiter='\t', dtype={'names': ('start_x', 'start_y', 'duration'),
-'formats': ('f8', 'f8', 'f8')})
-fix_vector3 = np.recfromcsv(f'./Preprocess/FreeViewing/Scanpath/MultiMatch/{participant}/{participant}_{stimuli3}.tsv',
-delimiter='\t', dtype={'names': ('start_x', 'start_y', 'duration'),
-'formats': ('f8', 'f8', 'f8')})
-fix_vector4 = np.recfromcsv(f'./Preprocess/FreeViewing/Scanpath/MultiMatch/{participant}/{participant}_{stimuli4}.tsv',
-delimiter='\t', dtype={'names': ('start_x', 'start_y', 'duration'),
-'formats': ('f8', 'f8', 'f8')})
+# read in data, written by Preprocess/FreeViewing/Code/scanpath_MM.py
+store = ScanpathStore('./Preprocess/FreeViewing/Scanpath/MultiMatch.scanpaths')
+fix_vector1 = store.get(participant, *stimuli1.rsplit('_', 1), 'MultiMatch')
+fix_vector2 = store.get(participant, *stimuli2.rsplit('_', 1), 'MultiMatch')
+fix_vector3 = store.get(participant, *stimuli3.rsplit('_', 1), 'MultiMatch')
+fix_vector4 = store.get(participant, *stimuli4.rsplit('_', 1), 'MultiMatch')
 
 
 print("------Same state------")
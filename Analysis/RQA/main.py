@@ -10,11 +10,15 @@ from tqdm import tqdm
 import pandas as pd
 from collections import defaultdict
 import os
+import sys
 import numpy as np
 from scipy.spatial.distance import cdist
 from scipy.stats import entropy
 from skimage.measure import label, regionprops
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Preprocess", "Common"))
+from scanpath_store import ScanpathStore, read_scanpath
+
 # ------------Parameters of RQA------------
 linelength = 2
 radius = 64
@@ -226,7 +230,8 @@ def exract_RQA_features(filepath, participant, stimuli):
     # Example 1:
     # The input consists of a n x 3 matrix of fixations in (x,y) coordinates.
     # plus fixation durations
-    df = pd.read_csv(filepath, delimiter='\t')
+    # filepath: scanpath TSV, or its records from the scanpath store
+    df = pd.DataFrame(read_scanpath(filepath))
     df["duration"] = df["duration"] * 1000
     fixation_duration = df.values.tolist()
     
@@ -253,16 +258,10 @@ def save_RQA_features(filepath):
 # ----------------------------------------------------------------------
 
 if __name__ == "__main__":
-    input_dir = './Preprocess/FreeViewing/Scanpath/MultiMatch'
-    name_list = [name for name in os.listdir(input_dir) if not name.startswith('.')]
-    for name in tqdm(name_list):
-        name_dir = os.path.join(input_dir, name)    
-        file_list = [file for file in os.listdir(name_dir) if not file.startswith('.')]
-        for file in file_list:
-            file_path = os.path.join(name_dir, file)
-            participant = name
-            stimuli = file.split('_')[1] + '_' + file.split('_')[2]
-            exract_RQA_features(file_path, participant, stimuli)
+    # Written by Preprocess/FreeViewing/Code/scanpath_MM.py
+    with ScanpathStore('./Preprocess/FreeViewing/Scanpath/MultiMatch.scanpaths') as store:
+        for participant, stimuli, state, window in tqdm(store.keys()):
+            exract_RQA_features(store.get(participant, stimuli, state, window), participant, stimuli)
             
     
     print(result)
\ No newline at end of file
@@ -6,7 +6,7 @@ This code will add the following extra features to the summary file:
 
 Before running this code, make sure you have executed the following code:
 1. Preprocess/FreeViewing/Code/main_img.py (sync the stimuli images and EM data, and perform I-VT fixation detection)
-2. Preprocess/FreeViewing/Code/scanpath_MM.py (trunc 30 seconds of EM data and save it as tsv file for MultiMatch)
+2. Preprocess/FreeViewing/Code/scanpath_MM.py and DIFF_scanpath_MM.py (trunc the last / first 30 seconds of EM data and save them to the scanpath stores for MultiMatch)
 3. Analysis/Summary/FreeViewing/Code/create_summary.py (create summary file for step1)
 4. This code (select 30 seconds summary data and add simplified fixation features)
 
@@ -18,11 +18,15 @@ from tqdm import tqdm
 import numpy as np
 import pandas as pd
 import os
+import sys
 from collections import defaultdict
 from OOP_MM import retrieve_simplified_fixation, extract_EM_features
 from OOP_RQA import extract_RQA_features
 from OOP_CoverdArea import CalculateCoverdArea
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+from scanpath_store import ScanpathStore
+
 # Change the parameters in the original code!!!!!!!!!!!!!
 
 # ---------- Global Variables ---------- #
@@ -58,20 +62,14 @@ def save_result():
     df.to_csv(taget_file, index=False)
     
     
-def compute_features(input_dir, result_dict):
-    name_list = [name for name in os.listdir(input_dir) if not name.startswith('.')]
-    for name in tqdm(name_list):
-        name_dir = os.path.join(input_dir, name)
-        file_list = [file for file in os.listdir(name_dir) if not file.startswith('.')]
-        for file in file_list:
-            file_path = os.path.join(name_dir, file)
-            participant = name
-            stimuli = file.split('_')[1] + '_' + file.split('_')[2]
-            
-            initial_fixation, simplified_fixation = retrieve_simplified_fixation(file_path)
+def compute_features(store_path, result_dict):
+    with ScanpathStore(store_path) as store:
+        for participant, stimuli, state, window in tqdm(store.keys()):
+            fixation = store.get(participant, stimuli, state, window)
+            initial_fixation, simplified_fixation = retrieve_simplified_fixation(fixation)
             extract_EM_features(initial_fixation, simplified_fixation, participant, stimuli, result_dict)
-            extract_RQA_features(file_path, participant, stimuli, result_dict)
-            CalculateCoverdArea(file_path, participant, stimuli, result_dict)
+            extract_RQA_features(fixation, participant, stimuli, result_dict)
+            CalculateCoverdArea(fixation, participant, stimuli, result_dict)
 
 def compute_diffs(result_last, result_first, result_diff):
     columns = [
@@ -89,14 +87,15 @@ def compute_diffs(result_last, result_first, result_diff):
 def main():
     global result_last, result_first, result_diff
 
-    input_dir_last = './Preprocess/FreeViewing/Scanpath/MultiMatch/'
-    input_dir_first = './Preprocess/FreeViewing/Scanpath/Reversed/'
+    # Written by scanpath_MM.py and DIFF_scanpath_MM.py
+    store_last = './Preprocess/FreeViewing/Scanpath/MultiMatch.scanpaths'
+    store_first = './Preprocess/FreeViewing/Scanpath/Reversed.scanpaths'
 
     # Compute features for the last 30 seconds
-    compute_features(input_dir_last, result_last)
+    compute_features(store_last, result_last)
     
     # Compute features for the first 30 seconds
-    compute_features(input_dir_first, result_first)
+    compute_features(store_first, result_first)
     
     # Compute diff features
     compute_diffs(result_last, result_first, result_diff)
@@ -18,21 +18,25 @@ AvgFixDisp: float
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
 import re
 from collections import defaultdict
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+from session_format import session_sampling_rate
+
 def extract_number(filename):
     match = re.search(r'(\d+)', filename)
     return int(match.group(0)) if match else float('inf')
 
 class EMFeatureDifferences:
-    def __init__(self, data, window_frames):
+    def __init__(self, data, window_frames, time_per_frame):
         self.data = data
         self.window_frames = window_frames
-        self.time_per_frame = 1000 / 60  # ms (assuming 60Hz frequency)
+        self.time_per_frame = time_per_frame  # ms
         
     def calculate_differences(self):
         first_interval = self.data[:self.window_frames]
@@ -60,8 +64,6 @@ class EMFeatureDifferences:
 
         for idx in range(len(interval_data)):
             eye_state, gaze_point_on_display_area, fixation_centroid = interval_data[idx]
-            gaze_point_on_display_area = eval(gaze_point_on_display_area)
-            fixation_centroid = eval(fixation_centroid)
 
             if eye_state == "Fixation":
                 j = idx
@@ -133,13 +135,14 @@ class FreeViewingSummary:
         self.input_file_path = input_file_path
         self.target_file_path = target_file_path
         self.window_size = window_size
-        self.window_frames = self.window_size * 60
+        # set by read_data from the sampling rate of the session
+        self.window_frames = None
         self.fixation_classifier = fixation_classifier
         self.SCREEN_TO_EYE_DIST = 650  # mm
         self.SCREEN_SIZE_W = 596.7  # mm
         self.SCREEN_SIZE_H = 335.7  # mm
-        self.frequency = 60  # Hz
-        self.time_per_frame = 1000 / self.frequency  # ms
+        self.frequency = None  # Hz, inferred from the timestamps in read_data
+        self.time_per_frame = None  # ms
 
     def convert_to_physical_coordinate(self, p):
         return (p[0] * self.SCREEN_SIZE_W, p[1] * self.SCREEN_SIZE_H)
@@ -162,6 +165,9 @@ class FreeViewingSummary:
         self.df = pd.read_csv(self.input_file_path, low_memory=False)
         self.participant = self.input_file_path.split("/")[-1].split("_")[0]
         self.single_participant_data = defaultdict(list)
+        self.frequency = session_sampling_rate(self.df)
+        self.time_per_frame = 1000 / self.frequency
+        self.window_frames = round(self.window_size * self.frequency)
 
     def create_summary_for_each_stimuli(self):
         if len(self.data) < self.window_frames:
@@ -193,8 +199,6 @@ class FreeViewingSummary:
 
         while idx < len(self.pending_data):
             eye_state, gaze_point_on_display_area, fixation_centroid = self.pending_data[idx]
-            gaze_point_on_display_area = eval(gaze_point_on_display_area)
-            fixation_centroid = eval(fixation_centroid)
             if not pd.isna(gaze_point_on_display_area[0]) and not pd.isna(gaze_point_on_display_area[1]) and self.is_off_stimuli_coordinate(self.transform_coordinate(gaze_point_on_display_area)):
                 self.off_stimuli_frames += 1
 
@@ -265,7 +269,7 @@ class FreeViewingSummary:
         self.single_participant_data["AvgPupDia_diff"].append(self.average_pupil_diameter_last - self.average_pupil_diameter_first)
         self.single_participant_data["VarPupDia_diff"].append(self.variance_pupil_diameter_last - self.variance_pupil_diameter_first)
 
-        em_diff = EMFeatureDifferences(self.data, self.window_frames)
+        em_diff = EMFeatureDifferences(self.data, self.window_frames, self.time_per_frame)
         differences = em_diff.calculate_differences()
         for key, value in differences.items():
             self.single_participant_data[key].append(value)
@@ -288,7 +292,7 @@ class FreeViewingSummary:
                 self.MW = 1 if self.attention == 0 else 0
                 self.eye_to_use = row["eye_to_use"]
 
-            self.data.append((row[f"{self.fixation_classifier}_state"], row[f"{self.eye_to_use}_gaze_point_on_display_area"], row[f"{self.fixation_classifier}_fixation_centroid"]))
+            self.data.append((row[f"{self.fixation_classifier}_state"], (row[f"{self.eye_to_use}_gaze_point_on_display_area_x"], row[f"{self.eye_to_use}_gaze_point_on_display_area_y"]), (row[f"{self.fixation_classifier}_fixation_centroid_x"], row[f"{self.fixation_classifier}_fixation_centroid_y"])))
             self.pupil_diameter.append(row[f"{self.eye_to_use}_pupil_diameter"])
         self.create_summary_for_each_stimuli()
 
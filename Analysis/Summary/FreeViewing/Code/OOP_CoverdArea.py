@@ -8,8 +8,12 @@ from tqdm import tqdm
 import pandas as pd
 from collections import defaultdict
 import os
+import sys
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+from scanpath_store import read_scanpath
+
 # ------------Parameters of Radius------------
 radius = 73
 x_offset = 160
@@ -20,7 +24,8 @@ image_height = 900
 result = defaultdict((lambda: defaultdict(dict)))
 
 def CalculateCoverdArea(filepath, participant, stimuli, result):
-    df = pd.read_csv(filepath, delimiter='\t')
+    # filepath: scanpath TSV, or its records from the scanpath store
+    df = pd.DataFrame(read_scanpath(filepath))
     df["start_x"] = df["start_x"] - x_offset
     df["start_y"] = df["start_y"] - y_offset
     grid = [[False] * image_height for _ in range(image_width)]
@@ -3,8 +3,12 @@ import numpy as np
 import pandas as pd
 import math
 import os
+import sys
 from collections import defaultdict
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+from scanpath_store import read_scanpath
+
 #---------- Parameters of Fixation Simplification----------#
 TAmp = 100.0
 TDir = 45.0
@@ -194,8 +198,8 @@ def get_simplified_fixation_path(simplified_scanpath):
     return simplified_fixation_path
 
 def retrieve_simplified_fixation(filepath):
-    fixation = np.recfromcsv(filepath, delimiter='\t', dtype={'names': ('start_x', 'start_y', 'duration'),
-                                                          'formats': ('f8', 'f8', 'f8')})
+    # filepath: scanpath TSV, or its records from the scanpath store
+    fixation = read_scanpath(filepath)
     
     if not isinstance(fixation, np.recarray) or fixation.shape == () or fixation.shape == (0,) or len(fixation) < 3:
         return None, None
@@ -10,11 +10,15 @@ from tqdm import tqdm
 import pandas as pd
 from collections import defaultdict
 import os
+import sys
 import numpy as np
 from scipy.spatial.distance import cdist
 from scipy.stats import entropy
 from skimage.measure import label, regionprops
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+from scanpath_store import read_scanpath
+
 # ------------Parameters of RQA------------
 linelength = 2
 # radius = 64
@@ -238,7 +242,8 @@ def extract_RQA_features(filepath, participant, stimuli, result):
     # Example 1:
     # The input consists of a n x 3 matrix of fixations in (x,y) coordinates.
     # plus fixation durations
-    df = pd.read_csv(filepath, delimiter='\t')
+    # filepath: scanpath TSV, or its records from the scanpath store
+    df = pd.DataFrame(read_scanpath(filepath))
     df["duration"] = df["duration"] * 1000
     fixation_duration = df.values.tolist()
     
@@ -18,12 +18,17 @@ AvgFixDisp: float
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
 import re
 from collections import defaultdict
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+import gaze_kernels
+from session_format import session_sampling_rate, ms_to_frames
+
 def extract_number(filename):
     match = re.search(r'(\d+)', filename)  
     return int(match.group(0)) if match else float('inf')  
@@ -33,14 +38,17 @@ class FreeViewingSummary:
         self.input_file_path = input_file_path
         self.target_file_path = target_file_path
         self.window_size = window_size
-        self.window_frames = self.window_size * 60
+        # set by read_data from the sampling rate of the session
+        self.window_frames = None
         self.fixation_classifier = fixation_classifier
         # Constants
         self.SCREEN_TO_EYE_DIST = 650  # mm
         self.SCREEN_SIZE_W = 596.7  # mm
         self.SCREEN_SIZE_H = 335.7  # mm
-        self.frequency = 60  # Hz
-        self.time_per_frame = 1000 / self.frequency  # ms
+        self.BLINK_THRESHOLD_MS = 80  # same as EyeMovement.BLINK_THRESHOLD_MS
+        self.MAX_INTERPOLATED_GAP_MS = 75  # same as EyeMovement.MAX_INTERPOLATED_GAP_MS
+        self.frequency = None  # Hz, inferred from the timestamps in read_data
+        self.time_per_frame = None  # ms
         
         
     def convert_to_physical_coordinate(self,p):
@@ -66,6 +74,18 @@ class FreeViewingSummary:
         self.df = pd.read_csv(self.input_file_path, low_memory=False)
         self.participant = self.input_file_path.split("/")[-1].split("_")[0]
         self.single_participant_data = defaultdict(list)
+        self.frequency = session_sampling_rate(self.df)
+        self.time_per_frame = 1000 / self.frequency
+        self.window_frames = round(self.window_size * self.frequency)
+        # Run-length table of the blinks of the eye in use, from the validity column written by EyeMovement
+        eye_to_use = self.df["eye_to_use"].iloc[0]
+        starts, ends, codes = gaze_kernels.gap_table(
+            self.df[f"{eye_to_use}_gaze_point_validity"].to_numpy(),
+            max_interpolated_gap=ms_to_frames(self.MAX_INTERPOLATED_GAP_MS, self.frequency, at_least=False),
+            blink_threshold=ms_to_frames(self.BLINK_THRESHOLD_MS, self.frequency),
+        )
+        blink = codes == gaze_kernels.BLINK
+        self.blink_starts, self.blink_ends = starts[blink], ends[blink]
 
     def create_summary_for_each_stimuli(self):
         if len(self.data) < self.window_frames: 
@@ -87,13 +107,9 @@ class FreeViewingSummary:
         self.fixation_frames = 0
         self.fixation_frames_list = []
         self.fixation_centroid_list = []
-        self.number_of_blinks = 0
-        self.blink_frames = 0
         
         while idx < len(self.pending_data):
             eye_state, gaze_point_on_display_area, fixation_centroid = self.pending_data[idx]
-            gaze_point_on_display_area = eval(gaze_point_on_display_area)
-            fixation_centroid = eval(fixation_centroid)
             # Assume that during off-stim, we still calculate the number of fixations, etc.
             if not pd.isna(gaze_point_on_display_area[0]) and not pd.isna(gaze_point_on_display_area[1]) and self.is_off_stimuli_coordinate(self.transform_coordinate(gaze_point_on_display_area)):
                 self.off_stimuli_frames += 1
@@ -108,16 +124,13 @@ class FreeViewingSummary:
                 self.fixation_centroid_list.append(fixation_centroid)
                 idx = j
             
-            elif eye_state == "Blink":
-                j = idx
-                while j < len(self.pending_data) and self.pending_data[j][0] == "Blink":
-                    j += 1
-                self.number_of_blinks += 1
-                self.blink_frames += j - idx
-                idx = j
-            
             else:
                 idx += 1
+
+        # Blinks overlapping the pending window, from the blink table instead of the eye states
+        blink_lengths = gaze_kernels.window_gaps(self.blink_starts, self.blink_ends, self.data_end - len(self.pending_data), self.data_end)
+        self.number_of_blinks = len(blink_lengths)
+        self.blink_frames = int(blink_lengths.sum())
         
         self.average_fixation_duration = self.fixation_frames * self.time_per_frame / self.number_of_fixations if self.number_of_fixations > 0 else 0
         self.average_blink_duration = self.blink_frames * self.time_per_frame / self.number_of_blinks if self.number_of_blinks > 0 else 0
@@ -171,6 +184,7 @@ class FreeViewingSummary:
         self.data = []
         self.pupil_diameter = []
         self.stimuli = None
+        self.data_end = 0
         # Extarct the data for each stimuli
         for idx, row in self.df.iterrows():
             if pd.isna(row["stimuli"]): continue
@@ -186,8 +200,9 @@ class FreeViewingSummary:
                 self.MW = 1 if self.attention == 0 else 0
                 self.eye_to_use = row["eye_to_use"]
             
-            self.data.append((row[f"{self.fixation_classifier}_state"], row[f"{self.eye_to_use}_gaze_point_on_display_area"], row[f"{self.fixation_classifier}_fixation_centroid"]))
+            self.data.append((row[f"{self.fixation_classifier}_state"], (row[f"{self.eye_to_use}_gaze_point_on_display_area_x"], row[f"{self.eye_to_use}_gaze_point_on_display_area_y"]), (row[f"{self.fixation_classifier}_fixation_centroid_x"], row[f"{self.fixation_classifier}_fixation_centroid_y"])))
             self.pupil_diameter.append(row[f"{self.eye_to_use}_pupil_diameter"])
+            self.data_end = idx + 1
         # Process the last stimuli
         self.create_summary_for_each_stimuli()
             
@@ -7,11 +7,15 @@ import numpy as np
 import pandas as pd
 import math
 import os
+import sys
 from collections import defaultdict
 from OOP_MM import retrieve_simplified_fixation, extract_EM_features
 from OOP_RQA import extract_RQA_features
 from OOP_CoverdArea import CalculateCoverdArea
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+from scanpath_store import ScanpathStore
+
 # Change the parameters in the original code!!!!!!!!!!!!!
 
 # ---------- Global Variables ---------- #
@@ -77,26 +81,22 @@ def save_result():
     
     
 def main():
-    global result, target_file, input_dir
-    for win_size in tqdm(range(4, 61, 4)):
-        result = defaultdict((lambda: defaultdict(dict)))
-        input_dir = f'./Preprocess/SART/Scanpath/{win_size}/'
-        target_file = f'./Analysis/Summary/SART/Data/SART_Summary_{win_size}sec.csv'
-        name_list = [name for name in os.listdir(input_dir) if not name.startswith('.')]
-        for name in name_list:
-            name_dir = os.path.join(input_dir, name)
-            file_list = [file for file in os.listdir(name_dir) if not file.startswith('.')]
-            for file in file_list:
-                file_path = os.path.join(name_dir, file)
-                participant = name
-                stimuli = file.split('_')[1]
-                
-                initial_fixation, simplified_fixation = retrieve_simplified_fixation(file_path)
+    global result, target_file
+    # Written by Preprocess/SART/Code/scanpath_for_all.py
+    with ScanpathStore('./Preprocess/SART/Scanpath/windows.scanpaths') as store:
+        for win_size in tqdm(range(4, 61, 4)):
+            result = defaultdict((lambda: defaultdict(dict)))
+            target_file = f'./Analysis/Summary/SART/Data/SART_Summary_{win_size}sec.csv'
+            if not store.keys(window=win_size):
+                raise KeyError(f"No scanpath of {win_size} s in {store.path}, run scanpath_for_all.py --windows {win_size}")
+            for participant, stimuli, state, window in store.keys(window=win_size):
+                fixation = store.get(participant, stimuli, state, window)
+                initial_fixation, simplified_fixation = retrieve_simplified_fixation(fixation)
                 extract_EM_features(initial_fixation, simplified_fixation, participant, stimuli, result)
-                extract_RQA_features(file_path, participant, stimuli, result)
-                CalculateCoverdArea(file_path, participant, stimuli, result)
-        
-        save_result()
+                extract_RQA_features(fixation, participant, stimuli, result)
+                CalculateCoverdArea(fixation, participant, stimuli, result)
+
+            save_result()
 
     
 if __name__ == '__main__':
@@ -18,12 +18,18 @@ AvgFixDisp: float
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
 import re
 from collections import defaultdict
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "Preprocess", "Common"))
+import gaze_kernels
+from session_format import session_sampling_rate, ms_to_frames
+from probe_index import read_probe_index
+
 def extract_number(filename):
     # Match both participant number and experiment number
     match = re.search(r'(\d+)[A-Z]_SART_(\d+)', filename)
@@ -40,14 +46,17 @@ class SARTSummary:
         self.input_file_path = input_file_path
         self.target_file_path = target_file_path
         self.window_size = window_size
-        self.window_frames = self.window_size * 60
+        # set by read_data from the sampling rate of the session
+        self.window_frames = None
         self.fixation_classifier = fixation_classifier
         # Constants
         self.SCREEN_TO_EYE_DIST = 650  # mm
         self.SCREEN_SIZE_W = 596.7  # mm
         self.SCREEN_SIZE_H = 335.7  # mm
-        self.frequency = 60  # Hz
-        self.time_per_frame = 1000 / self.frequency  # ms
+        self.BLINK_THRESHOLD_MS = 80  # same as EyeMovement.BLINK_THRESHOLD_MS
+        self.MAX_INTERPOLATED_GAP_MS = 75  # same as EyeMovement.MAX_INTERPOLATED_GAP_MS
+        self.frequency = None  # Hz, inferred from the timestamps in read_data
+        self.time_per_frame = None  # ms
         
         
     def convert_to_physical_coordinate(self,p):
@@ -69,6 +78,18 @@ class SARTSummary:
         self.participant = self.input_file_path.split("/")[-1].split("_")[0]
         self.offset = int(self.input_file_path.split("_")[-1].split(".")[0]) - 1
         self.single_participant_data = defaultdict(list)
+        self.frequency = session_sampling_rate(self.df)
+        self.time_per_frame = 1000 / self.frequency
+        self.window_frames = round(self.window_size * self.frequency)
+        # Run-length table of the blinks of the eye in use, from the validity column written by EyeMovement
+        eye_to_use = self.df["eye_to_use"].iloc[0]
+        starts, ends, codes = gaze_kernels.gap_table(
+            self.df[f"{eye_to_use}_gaze_point_validity"].to_numpy(),
+            max_interpolated_gap=ms_to_frames(self.MAX_INTERPOLATED_GAP_MS, self.frequency, at_least=False),
+            blink_threshold=ms_to_frames(self.BLINK_THRESHOLD_MS, self.frequency),
+        )
+        blink = codes == gaze_kernels.BLINK
+        self.blink_starts, self.blink_ends = starts[blink], ends[blink]
 
     def create_summary_for_each_stimuli(self):
         if len(self.data) < self.window_frames: 
@@ -90,13 +111,9 @@ class SARTSummary:
         self.fixation_frames = 0
         self.fixation_frames_list = []
         self.fixation_centroid_list = []
-        self.number_of_blinks = 0
-        self.blink_frames = 0
         
         while idx < len(self.pending_data):
             eye_state, gaze_point_on_display_area, fixation_centroid = self.pending_data[idx]
-            gaze_point_on_display_area = eval(gaze_point_on_display_area)
-            fixation_centroid = eval(fixation_centroid)
             # Assume that during off-stim, we still calculate the number of fixations, etc.
             
             if eye_state == "Fixation":
@@ -109,16 +126,13 @@ class SARTSummary:
                 self.fixation_centroid_list.append(fixation_centroid)
                 idx = j
             
-            elif eye_state == "Blink":
-                j = idx
-                while j < len(self.pending_data) and self.pending_data[j][0] == "Blink":
-                    j += 1
-                self.number_of_blinks += 1
-                self.blink_frames += j - idx
-                idx = j
-            
             else:
                 idx += 1
+
+        # Blinks overlapping the pending window, from the blink table instead of the eye states
+        blink_lengths = gaze_kernels.window_gaps(self.blink_starts, self.blink_ends, self.data_end - len(self.pending_data), self.data_end)
+        self.number_of_blinks = len(blink_lengths)
+        self.blink_frames = int(blink_lengths.sum())
         
         self.average_fixation_duration = self.fixation_frames * self.time_per_frame / self.number_of_fixations if self.number_of_fixations > 0 else 0
         self.average_blink_duration = self.blink_frames * self.time_per_frame / self.number_of_blinks if self.number_of_blinks > 0 else 0
@@ -165,55 +179,25 @@ class SARTSummary:
         
         
     def create_summary(self):
-        partcipant_exp_num_recorder = defaultdict(int)
-        # self.recorded_stimuli = set()
         self.data = []
         self.pupil_diameter = []
-        # self.stimuli = None
-        # Extarct the data for each stimuli
-        n = self.df.shape[0]
-        i = 0
-        while i < n-1:
-            prev = self.df.iloc[i]
-            next = self.df.iloc[i+1]
-            if pd.isna(prev["state"]) and not pd.isna(next["state"]):
-                row = next
-                j = i + 1
-                partcipant_exp_num_recorder[self.participant] += 1
-                self.data = []
-                self.pupil_diameter = []
-                self.stimuli = self.offset * 5 + partcipant_exp_num_recorder[self.participant]
-                self.attention = 1 if row["state"] == "num_4" else 0
-                self.MW = 1 if self.attention == 0 else 0
-                self.eye_to_use = row["eye_to_use"]
-                while j < n and not pd.isna(self.df.iloc[j]["state"]):
-                    self.data.append((self.df.iloc[j][f"{self.fixation_classifier}_state"], self.df.iloc[j][f"{self.eye_to_use}_gaze_point_on_display_area"], self.df.iloc[j][f"{self.fixation_classifier}_fixation_centroid"]))
-                    self.pupil_diameter.append(self.df.iloc[j][f"{self.eye_to_use}_pupil_diameter"])
-                    j += 1
-                self.create_summary_for_each_stimuli()
-                i = j
-            
-            i += 1
-                
-        # for idx, row in self.df.iterrows():
-        #     if pd.isna(row["stimuli"]): continue
-        #     if row["stimuli"] not in self.recorded_stimuli: 
-        #         self.create_summary_for_each_stimuli()
-
-        #         # pending_data will record (eye_state, {eye_to_use}_gaze_point_on_display_area, {fixation_classifier}_fixation_centroid) for each stimuli
-        #         self.data = []
-        #         self.pupil_diameter = []
-        #         # self.recorded_stimuli.add(row["stimuli"])
-        #         self.stimuli = row["stimuli"]
-        #         self.attention = 1 if row["state"] == "num_4" else 0
-        #         self.MW = 1 if self.attention == 0 else 0
-        #         self.eye_to_use = row["eye_to_use"]
-            
-        #     self.data.append((row[f"{self.fixation_classifier}_state"], row[f"{self.eye_to_use}_gaze_point_on_display_area"], row[f"{self.fixation_classifier}_fixation_centroid"]))
-        #     self.pupil_diameter.append(row[f"{self.eye_to_use}_pupil_diameter"])
-        # Process the last stimuli
-        # self.create_summary_for_each_stimuli()
-            
+        fixation_state = self.df[f"{self.fixation_classifier}_state"].to_numpy(dtype=object)
+        centroid_x = self.df[f"{self.fixation_classifier}_fixation_centroid_x"].to_numpy()
+        centroid_y = self.df[f"{self.fixation_classifier}_fixation_centroid_y"].to_numpy()
+        # Extract the data for each stimuli, sliced from the probe index of the session
+        for probe in read_probe_index(self.input_file_path, self.df):
+            start, end = probe.start, probe.end
+            self.stimuli = probe.probe
+            self.attention = 1 if probe.label == "Focus" else 0
+            self.MW = 1 if self.attention == 0 else 0
+            self.eye_to_use = probe.eye_to_use
+            gaze_x = self.df[f"{self.eye_to_use}_gaze_point_on_display_area_x"].to_numpy()[start:end]
+            gaze_y = self.df[f"{self.eye_to_use}_gaze_point_on_display_area_y"].to_numpy()[start:end]
+            self.data = list(zip(fixation_state[start:end], zip(gaze_x, gaze_y), zip(centroid_x[start:end], centroid_y[start:end])))
+            self.pupil_diameter = list(self.df[f"{self.eye_to_use}_pupil_diameter"].to_numpy()[start:end])
+            # self.data holds the rows [start, end)
+            self.data_end = end
+            self.create_summary_for_each_stimuli()
 
     def save_data(self):
         self.single_participant_data = pd.DataFrame(self.single_participant_data)
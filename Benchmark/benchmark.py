@@ -0,0 +1,179 @@
+"""
+Benchmark of the pipeline stages on synthetic sessions (synthetic_session.py), no real recordings needed.
+
+Stages, for every session of the cohort:
+    sync        DataSynchronization.run (OOP_sync_sart.py / OOP_sync_img.py)
+    preprocess  EyeMovement.run (OOP_preprocess_sart.py / OOP_preprocess_img.py)
+    scanpath    extract_scanpath (scanpath_for_all.py)
+    summary     SARTSummary.run / FreeViewingSummary.run (create_summary.py)
+
+Each stage is run once for the time and once more under tracemalloc for the peak memory allocated by Python and NumPy.
+Every scale is a (sampling rate, --lengths) pair, the lengths being SART trials or FreeViewing images per session.
+All the files are written to a temporary directory.
+
+Usage:
+    python Benchmark/benchmark.py --task SART --rates 60 300 --lengths 100 400 --output bench.json
+    python Benchmark/benchmark.py --compare bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+
+from synthetic_session import write_cohort
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+STAGES = ["sync", "preprocess", "scanpath", "summary"]
+SCANPATH_WINDOW = 16  # s
+SUMMARY_WINDOW = 16  # s
+
+
+def load_module(name, *path):
+    # The SART and FreeViewing scripts share module names, so they are loaded by path under their own name
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, *path))
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, os.path.dirname(spec.origin))
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.pop(0)
+    return module
+
+
+def load_pipeline(task):
+    if task == "SART":
+        sync = load_module("bench_sync_sart", "Preprocess", "SART", "Code", "OOP_sync_sart.py")
+        preprocess = load_module("bench_preprocess_sart", "Preprocess", "SART", "Code", "OOP_preprocess_sart.py")
+        scanpath = load_module("bench_scanpath_sart", "Preprocess", "SART", "Code", "scanpath_for_all.py")
+        summary = load_module("bench_summary_sart", "Analysis", "Summary", "SART", "Code", "create_summary.py")
+        return sync.DataSynchronization, preprocess.EyeMovement, scanpath.extract_scanpath, summary.SARTSummary
+    sync = load_module("bench_sync_img", "Preprocess", "FreeViewing", "Code", "OOP_sync_img.py")
+    preprocess = load_module("bench_preprocess_img", "Preprocess", "FreeViewing", "Code", "OOP_preprocess_img.py")
+    scanpath = load_module("bench_scanpath_img", "Preprocess", "FreeViewing", "Code", "scanpath_for_all.py")
+    summary = load_module("bench_summary_img", "Analysis", "Summary", "FreeViewing", "Code", "create_summary.py")
+    return sync.DataSynchronization, preprocess.EyeMovement, scanpath.extract_scanpath, summary.FreeViewingSummary
+
+
+def measure(stage, profile_memory):
+    # (seconds, peak MB or None) of stage()
+    if not profile_memory:
+        start = time.perf_counter()
+        stage()
+        return time.perf_counter() - start, None
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return None, peak / 2 ** 20
+
+
+def run_scale(task, work_dir, sampling_rate, length, participants, sessions, seed, profile_memory=True,
+              legacy_timestamps=False):
+    """
+    Generate a cohort and run every stage on every session.
+    Return {stage: {"seconds", "peak_mb"}} with the total time and the largest peak over the sessions, and the sample count.
+    """
+    DataSynchronization, EyeMovement, extract_scanpath, Summary = load_pipeline(task)
+    raw_dir = os.path.join(work_dir, "Raw")
+    paths = write_cohort(raw_dir, task, participants, sessions, sampling_rate, seed, n_trials=length, n_images=length,
+                         legacy_timestamps=legacy_timestamps)
+    data_dir = os.path.join(work_dir, "Data")
+    os.makedirs(data_dir, exist_ok=True)
+    summary_path = os.path.join(work_dir, "Summary.csv")
+
+    results = {stage: {"seconds": 0.0, "peak_mb": 0.0 if profile_memory else None} for stage in STAGES}
+    n_samples = 0
+    # extract_scanpath writes to ./Preprocess/{task}/Scanpath
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for psychopy_path, em_path in paths:
+            target_path = os.path.join(data_dir, os.path.basename(psychopy_path))
+            synced_path = target_path + ".synced"
+
+            def sync():
+                DataSynchronization(psychopy_path, em_path, synced_path).run()
+
+            def preprocess():
+                shutil.copy(synced_path, target_path)
+                EyeMovement(target_path).run()
+
+            def scanpath():
+                extract_scanpath(target_path, [SCANPATH_WINDOW])
+
+            def summary():
+                if os.path.exists(summary_path):
+                    os.remove(summary_path)
+                Summary(target_path, summary_path, SUMMARY_WINDOW, "IVT").run()
+
+            for name, stage in zip(STAGES, [sync, preprocess, scanpath, summary]):
+                seconds, _ = measure(stage, False)
+                results[name]["seconds"] += seconds
+                if profile_memory:
+                    _, peak_mb = measure(stage, True)
+                    results[name]["peak_mb"] = max(results[name]["peak_mb"], peak_mb)
+            with open(synced_path) as f:
+                n_samples += sum(1 for _ in f) - 1
+    finally:
+        os.chdir(cwd)
+    return results, n_samples
+
+
+def print_table(rows, baseline=None):
+    baseline = {(row["task"], row["sampling_rate"], row["length"], row["stage"]): row for row in baseline or []}
+    print(f"{'task':<12}{'rate':>6}{'length':>8}{'samples':>10}  {'stage':<12}{'seconds':>9}{'ksamples/s':>12}{'peak MB':>9}"
+          + (f"{'vs base':>9}" if baseline else ""))
+    for row in rows:
+        peak = f"{row['peak_mb']:.1f}" if row["peak_mb"] is not None else "-"
+        line = (f"{row['task']:<12}{row['sampling_rate']:>6g}{row['length']:>8}{row['samples']:>10}  {row['stage']:<12}"
+                f"{row['seconds']:>9.3f}{row['samples'] / row['seconds'] / 1000:>12.1f}{peak:>9}")
+        base = baseline.get((row["task"], row["sampling_rate"], row["length"], row["stage"]))
+        if base is not None:
+            line += f"{base['seconds'] / row['seconds']:>8.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task", choices=["SART", "FreeViewing"], default="SART")
+    parser.add_argument("--rates", type=float, nargs="+", default=[60, 300], help="sampling rates, Hz")
+    parser.add_argument("--lengths", type=int, nargs="+", default=None,
+                        help="SART trials or FreeViewing images per session, default: 100 / 4")
+    parser.add_argument("--participants", type=int, default=1)
+    parser.add_argument("--sessions", type=int, default=1, help="sessions per participant")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="only time the stages, tracemalloc runs every stage again")
+    parser.add_argument("--legacy-timestamps", action="store_true",
+                        help='em csv with the "timestamp" datetime strings of the older recordings')
+    parser.add_argument("--output", default=None, help="save the results as json")
+    parser.add_argument("--compare", default=None, help="json saved by an earlier run, printed as a speedup column")
+    args = parser.parse_args()
+
+    lengths = args.lengths or ([100] if args.task == "SART" else [4])
+    rows = []
+    for sampling_rate in args.rates:
+        for length in lengths:
+            with tempfile.TemporaryDirectory() as work_dir:
+                results, n_samples = run_scale(args.task, work_dir, sampling_rate, length, args.participants,
+                                               args.sessions, args.seed, profile_memory=not args.no_memory,
+                                               legacy_timestamps=args.legacy_timestamps)
+            for stage in STAGES:
+                rows.append({"task": args.task, "sampling_rate": sampling_rate, "length": length, "samples": n_samples,
+                             "stage": stage, **results[stage]})
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(rows, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
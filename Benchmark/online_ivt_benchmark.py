@@ -0,0 +1,121 @@
+"""
+Online I-VT (Preprocess/Common/online_ivt.py) on a stream replayed by tobii_replay.py, against the offline I-VT of
+EyeMovement on the same samples.
+
+Reported: samples and events, time spent in the callback per sample, event latency (from the last sample of an event to
+its emission, on the simulated clock, and in samples), and whether the online events are the offline ones.
+
+Usage:
+    python Benchmark/online_ivt_benchmark.py --rate 600 --speed 4 --duration 120 --jitter-ms 2 --dropout-rate 0.5
+    python Benchmark/online_ivt_benchmark.py --csv ./Data_Collection/SART/Raw/S001/em/S001_202401011000.csv --speed 10
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+import tobii_replay
+from benchmark import load_module
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Preprocess", "Common"))
+from classifiers import CLASSIFIERS, GazeSession
+from online_ivt import OnlineIVT, state_events
+
+
+def offline_events(EyeMovement, samples, sampling_rate, eye):
+    # Events of the offline I-VT of EyeMovement on the samples
+    em_data = pd.DataFrame({"system_time_stamp": [sample["system_time_stamp"] for sample in samples]})
+    for side in ("left", "right"):
+        points = np.array([sample[f"{side}_gaze_point_on_display_area"] for sample in samples], dtype=np.float64)
+        em_data[f"{side}_gaze_point_on_display_area_x"] = points[:, 0].astype(np.float32)
+        em_data[f"{side}_gaze_point_on_display_area_y"] = points[:, 1].astype(np.float32)
+        em_data[f"{side}_gaze_point_validity"] = [sample[f"{side}_gaze_point_validity"] for sample in samples]
+    em = EyeMovement(None, sampling_rate=sampling_rate, data=em_data)
+    em.set_thresholds()
+    # Same eye as the online classifier
+    em.decide_eye_to_use(*((1, 0) if eye == "left" else (0, 1)))
+    em.find_gaps()
+    em.interpolate_coordinates()
+    em.identify_blink()
+    x, y = em.gaze_arrays()
+    session = GazeSession(x, y, em.blink, sampling_rate, screen_size_w=EyeMovement.SCREEN_SIZE_W,
+                          screen_size_h=EyeMovement.SCREEN_SIZE_H, screen_to_eye_dist=EyeMovement.SCREEN_TO_EYE_DIST)
+    states, centroid_x, centroid_y, _ = CLASSIFIERS["IVT"](session, **em.classifier_params["IVT"])
+    return state_events(states, centroid_x, centroid_y, em_data["system_time_stamp"].to_numpy())
+
+
+def run_online(eyetracker, duration, parameters, eye="left"):
+    """
+    Classify duration simulated seconds of the eyetracker stream online.
+    Return (samples, events, emission times on the simulated clock and samples received after the end of the events
+    emitted during the replay, callback seconds).
+    """
+    tobii_replay.install(eyetracker)
+    samples, events, emitted, emitted_after = [], [], [], []
+    callback_seconds = [0.0]
+
+    def on_event(event):
+        events.append(event)
+        emitted.append(tobii_replay.get_system_time_stamp())
+        emitted_after.append(len(samples) - event.end)
+
+    ivt = OnlineIVT.from_parameters(parameters, eyetracker.get_gaze_output_frequency(), eye, on_event)
+
+    def callback(gaze_data):
+        samples.append(gaze_data)
+        start = time.perf_counter()
+        ivt.gaze_data_callback(gaze_data)
+        callback_seconds[0] += time.perf_counter() - start
+
+    eyetracker.subscribe_to(tobii_replay.EYETRACKER_GAZE_DATA, callback, as_dictionary=True)
+    time.sleep(duration / eyetracker.speed)
+    eyetracker.unsubscribe_from(tobii_replay.EYETRACKER_GAZE_DATA, callback)
+    n_emitted = len(emitted)
+    ivt.finish()
+    return samples, events, emitted[:n_emitted], emitted_after[:n_emitted], callback_seconds[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default=None, help="em csv to replay, default: a synthetic session")
+    parser.add_argument("--rate", type=float, default=None, help="Hz of the replay, default: rate of the csv, or 120")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per second")
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds classified")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="sd of the delivery delay")
+    parser.add_argument("--dropout-rate", type=float, default=0.0, help="injected dropouts per second")
+    parser.add_argument("--eye", choices=["left", "right"], default="left")
+    parser.add_argument("--task", choices=["SART", "FreeViewing"], default="SART", help="EyeMovement copy to compare with")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.csv:
+        samples, rate = tobii_replay.csv_samples(args.csv)
+        rate = args.rate or rate
+    else:
+        rate = args.rate or 120
+        samples = tobii_replay.synthetic_samples(min(args.duration, 300), rate, args.seed)
+    if args.task == "SART":
+        EyeMovement = load_module("bench_preprocess_sart", "Preprocess", "SART", "Code", "OOP_preprocess_sart.py").EyeMovement
+    else:
+        EyeMovement = load_module("bench_preprocess_img", "Preprocess", "FreeViewing", "Code", "OOP_preprocess_img.py").EyeMovement
+    eyetracker = tobii_replay.ReplayEyeTracker(samples, rate, speed=args.speed, jitter_ms=args.jitter_ms,
+                                               dropout_rate=args.dropout_rate, seed=args.seed)
+    samples, events, emitted, emitted_after, callback_seconds = run_online(eyetracker, args.duration, EyeMovement.parameters(), args.eye)
+    latency_us = np.array(emitted) - np.array([event.last_time_stamp for event in events[:len(emitted)]])
+    expected = offline_events(EyeMovement, samples, rate, args.eye)
+    same = pd.DataFrame(events).equals(pd.DataFrame(expected))
+
+    print("==========================================================")
+    print(f"replay      {rate:g} Hz x{args.speed:g}, {eyetracker.delivered} delivered, {eyetracker.dropped} dropped")
+    print(f"online      {len(samples)} samples, {len(events)} events, "
+          f"{callback_seconds / max(len(samples), 1) * 1e6:.1f} us per sample in the callback")
+    if len(latency_us):
+        print(f"latency     mean {latency_us.mean() / 1000:.1f} ms, p99 {np.percentile(latency_us, 99) / 1000:.1f} ms, "
+              f"max {latency_us.max() / 1000:.1f} ms (simulated clock), max {max(emitted_after)} samples")
+    print(f"offline     {len(expected)} events, {'same' if same else 'DIFFERENT'} events")
+    print("==========================================================")
+    if not same:
+        sys.exit(1)
@@ -0,0 +1,90 @@
+"""
+Load test of Data_Collection/*/TobiiRecorder.py without an eye tracker: the recorder records a stream replayed by
+tobii_replay.py (a synthetic session or an em csv) into a temporary directory.
+
+Reported: samples delivered / dropped by the replay, samples written and dropped according to the recorder telemetry,
+callback time, delivery latency and writer buffer depth (capture_telemetry.py), and the size of the recording.
+
+Usage:
+    python Benchmark/recorder_benchmark.py --rate 600 --speed 4 --duration 120 --jitter-ms 2 --dropout-rate 0.1
+    python Benchmark/recorder_benchmark.py --csv ./Data_Collection/SART/Raw/S001/em/S001_202401011000.csv --speed 10
+"""
+
+import os
+import sys
+import json
+import time
+import builtins
+import argparse
+import tempfile
+
+import tobii_replay
+from benchmark import load_module
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Preprocess", "Common"))
+from segments import recording_files
+
+
+def run_recorder(eyetracker, duration, task="SART", recording_format="gaze", segment_seconds=None):
+    """
+    Record duration simulated seconds of the eyetracker stream with TobiiRecorder.py.
+    Return (telemetry summary, recording size in bytes, wall-clock seconds).
+    """
+    tobii_replay.install(eyetracker)
+    recorder = load_module(f"bench_recorder_{task.lower()}", "Data_Collection", task, "TobiiRecorder.py")
+    cwd = os.getcwd()
+    prompt = builtins.input
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        builtins.input = lambda *args: "bench"
+        try:
+            # The file name depends on the format
+            recorder.EyeTrackerDataCollector.RECORDING_FORMAT = recording_format
+            recorder.EyeTrackerDataCollector.SEGMENT_SECONDS = segment_seconds
+            collector = recorder.EyeTrackerDataCollector()
+            collector.recording_duration = duration / eyetracker.speed
+            start = time.perf_counter()
+            collector.start_collecting()
+            seconds = time.perf_counter() - start
+            with open(collector.telemetry_file_path) as f:
+                summary = json.load(f)
+            size = sum(os.path.getsize(path) for path in recording_files(collector.file_path))
+        finally:
+            builtins.input = prompt
+            os.chdir(cwd)
+    return summary, size, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default=None, help="em csv to replay, default: a synthetic session")
+    parser.add_argument("--rate", type=float, default=None, help="Hz of the replay, default: rate of the csv, or 120")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per second")
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds recorded")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="sd of the delivery delay")
+    parser.add_argument("--dropout-rate", type=float, default=0.0, help="injected dropouts per second")
+    parser.add_argument("--format", choices=["gaze", "csv"], default="gaze", help="RECORDING_FORMAT of the recorder")
+    parser.add_argument("--segment-seconds", type=float, default=None, help="segment rotation of the recorder, default: one file")
+    parser.add_argument("--task", choices=["SART", "FreeViewing"], default="SART", help="TobiiRecorder.py copy to load")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.csv:
+        samples, rate = tobii_replay.csv_samples(args.csv)
+        rate = args.rate or rate
+    else:
+        rate = args.rate or 120
+        samples = tobii_replay.synthetic_samples(min(args.duration, 300), rate, args.seed)
+    eyetracker = tobii_replay.ReplayEyeTracker(samples, rate, speed=args.speed, jitter_ms=args.jitter_ms,
+                                               dropout_rate=args.dropout_rate, seed=args.seed)
+    summary, size, seconds = run_recorder(eyetracker, args.duration, args.task, args.format, args.segment_seconds)
+
+    print("==========================================================")
+    print(f"replay      {rate:g} Hz x{args.speed:g}, {eyetracker.delivered} delivered, {eyetracker.dropped} dropped")
+    print(f"recorder    {summary['n_samples']} written in {seconds:.1f} s ({summary['n_samples'] / seconds:.0f} samples/s), "
+          f"{summary['dropped_samples']} dropped, {summary['late_samples']} late")
+    print(f"latency     max {summary['max_latency_us']} us (simulated clock)")
+    print(f"callback    {summary['callback_us']}")
+    print(f"buffer      max {summary['queue_depth']['max']} samples")
+    print(f"recording   {size / 2 ** 20:.2f} MB, {size / max(summary['n_samples'], 1):.1f} bytes/sample")
+    print("==========================================================")
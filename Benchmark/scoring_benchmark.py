@@ -0,0 +1,113 @@
+"""
+Latency and throughput of the real-time scoring service (Preprocess/Common/mw_scoring.py) on a stream replayed by
+tobii_replay.py, with a client reading the scores from the local socket.
+
+Reported: time spent in the callback per sample, scores produced against the schedule, time per score, delay of the
+window end when scored (simulated clock) and of the scores at the client (wall clock).
+
+Usage:
+    python Benchmark/scoring_benchmark.py --rate 600 --speed 4 --duration 120 --window 32 --interval-ms 250
+    python Benchmark/scoring_benchmark.py --model mw_model_32sec.pkl --rate 120 --duration 300
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import numpy as np
+
+import tobii_replay
+from benchmark import load_module
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Preprocess", "Common"))
+from mw_scoring import ScoringService, load_model
+
+
+def read_scores(port, received):
+    # Client of the service: (wall-clock time, result) of every JSON line
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        for line in client.makefile():
+            received.append((time.perf_counter(), json.loads(line)))
+
+
+def run_service(eyetracker, duration, parameters, window_size, interval_ms, model=None, eye="left"):
+    """
+    Score duration simulated seconds of the eyetracker stream.
+    Return ((wall-clock time, result) of the scores, (wall-clock time, result) received by the client, samples,
+    callback seconds).
+    """
+    tobii_replay.install(eyetracker)
+    service = ScoringService(parameters, eyetracker.get_gaze_output_frequency(), window_size, model,
+                             interval_ms / eyetracker.speed, eye, clock=tobii_replay.get_system_time_stamp)
+    results = []
+    service.listeners.append(lambda result: results.append((time.perf_counter(), result)))
+    received = []
+    client = threading.Thread(target=read_scores, args=(service.serve(), received), daemon=True)
+    client.start()
+    n_samples = [0]
+    callback_seconds = [0.0]
+
+    def callback(gaze_data):
+        start = time.perf_counter()
+        service.gaze_data_callback(gaze_data)
+        callback_seconds[0] += time.perf_counter() - start
+        n_samples[0] += 1
+
+    eyetracker.subscribe_to(tobii_replay.EYETRACKER_GAZE_DATA, callback, as_dictionary=True)
+    service.start()
+    time.sleep(duration / eyetracker.speed)
+    eyetracker.unsubscribe_from(tobii_replay.EYETRACKER_GAZE_DATA, callback)
+    service.stop()
+    client.join()
+    return results, received, n_samples[0], callback_seconds[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default=None, help="em csv to replay, default: a synthetic session")
+    parser.add_argument("--rate", type=float, default=None, help="Hz of the replay, default: rate of the csv, or 120")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per second")
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds scored")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="sd of the delivery delay")
+    parser.add_argument("--dropout-rate", type=float, default=0.0, help="injected dropouts per second")
+    parser.add_argument("--window", type=float, default=32, help="s of gaze scored")
+    parser.add_argument("--interval-ms", type=float, default=1000, help="simulated ms between two scores")
+    parser.add_argument("--model", default=None, help="pickled model (mw_scoring.train_model), default: features only")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.csv:
+        samples, rate = tobii_replay.csv_samples(args.csv)
+        rate = args.rate or rate
+    else:
+        rate = args.rate or 120
+        samples = tobii_replay.synthetic_samples(min(args.duration, 300), rate, args.seed)
+    EyeMovement = load_module("bench_preprocess_sart", "Preprocess", "SART", "Code", "OOP_preprocess_sart.py").EyeMovement
+    model = load_model(args.model) if args.model else None
+    eyetracker = tobii_replay.ReplayEyeTracker(samples, rate, speed=args.speed, jitter_ms=args.jitter_ms,
+                                               dropout_rate=args.dropout_rate, seed=args.seed)
+    results, received, n_samples, callback_seconds = run_service(
+        eyetracker, args.duration, EyeMovement.parameters(), args.window, args.interval_ms, model)
+
+    scheduled = int((args.duration - args.window) * 1000 / args.interval_ms)
+    score_ms = np.array([result["seconds"] for _, result in results]) * 1000
+    delay_ms = np.array([result["delay_us"] for _, result in results]) / 1000
+    # The client connects before the first score and receives them all, in order
+    client_ms = np.array([(received_time - sent_time) * 1000
+                          for (sent_time, _), (received_time, _) in zip(results, received)])
+
+    print("==========================================================")
+    print(f"replay      {rate:g} Hz x{args.speed:g}, {eyetracker.delivered} delivered, {eyetracker.dropped} dropped")
+    print(f"callback    {callback_seconds / max(n_samples, 1) * 1e6:.1f} us per sample")
+    print(f"scores      {len(results)} of about {max(scheduled, 0)} scheduled, {len(received)} received by the client, "
+          f"{sum(result['score'] is not None for _, result in results)} with a score")
+    if len(results):
+        print(f"scoring     mean {score_ms.mean():.2f} ms, max {score_ms.max():.2f} ms per score")
+        print(f"delay       mean {delay_ms.mean():.1f} ms, p99 {np.percentile(delay_ms, 99):.1f} ms, "
+              f"max {delay_ms.max():.1f} ms from the window end (simulated clock)")
+    if len(client_ms):
+        print(f"socket      mean {client_ms.mean():.2f} ms, max {client_ms.max():.2f} ms to the client (wall clock)")
+    print("==========================================================")
@@ -0,0 +1,261 @@
+"""
+Synthetic sessions in the raw format of Data_Collection, for benchmarks and for checking the pipeline without real recordings.
+
+em csv: the columns written by TobiiRecorder.py, gaze points as "(x, y)" strings, "(nan, nan)" when invalid,
+Tobii's device_time_stamp / system_time_stamp in microseconds and the .clock.json clock file next to the csv.
+With legacy_timestamps, the "timestamp" datetime strings of the older recordings, taken "on arrival" with a small jitter.
+psychopy csv: the columns read by OOP_sync_sart.py (SART) or OOP_sync_img.py (FreeViewing).
+
+The gaze trace is a sequence of fixations (log-normal durations, jitter and drift) and saccades (main-sequence
+durations, smooth velocity profile), with blinks on both eyes and short dropouts on each eye.
+Durations are in ms, so the same session can be generated at any sampling rate.
+
+Usage:
+    python Benchmark/synthetic_session.py --task SART --participants 4 --sessions 3 --sampling-rate 60 --raw-dir ./Data_Collection/SART/Raw
+"""
+
+import os
+import json
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+SCREEN_SIZE_W = 596.7  # mm
+SCREEN_SIZE_H = 335.7  # mm
+SCREEN_TO_EYE_DIST = 650  # mm
+
+FIXATION_DURATION_MS = 250  # median
+FIXATION_JITTER = 0.0015  # sd of the gaze noise, normalized display coordinates
+BLINK_INTERVAL_MS = 4000  # mean time between blinks
+BLINK_DURATION_MS = (100, 300)
+DROPOUT_INTERVAL_MS = 2000  # mean time between dropouts of one eye
+DROPOUT_DURATION_MS = (10, 50)
+RIGHT_EYE_OFFSET = 0.005
+SART_STIMULUS_DURATION = 2.0  # s
+SART_PROBE_DURATION = (3.0, 6.0)  # s
+FREEVIEWING_IMAGE_DURATION = (45, 75)  # s, whole seconds like free_viewing_lastrun.py
+CLOCK_UNCERTAINTY_US = 40  # bracket of the clock pairs of TobiiRecorder.record_clock_offset
+
+
+def gaze_trace(n_samples, sampling_rate, rng):
+    # (x, y) of one eye, normalized display coordinates, no missing samples
+    x = np.empty(n_samples)
+    y = np.empty(n_samples)
+    ms_per_sample = 1000 / sampling_rate
+    cx, cy = rng.uniform(0.2, 0.8, 2)
+    i = 0
+    while i < n_samples:
+        # Fixation with jitter and a slow drift
+        length = max(1, round(rng.lognormal(np.log(FIXATION_DURATION_MS), 0.4) / ms_per_sample))
+        end = min(n_samples, i + length)
+        drift = np.cumsum(rng.normal(0, FIXATION_JITTER / 10, (2, end - i)), axis=1)
+        x[i:end] = cx + drift[0] + rng.normal(0, FIXATION_JITTER, end - i)
+        y[i:end] = cy + drift[1] + rng.normal(0, FIXATION_JITTER, end - i)
+        i = end
+        # Saccade to the next fixation, duration from the main sequence (21 ms + 2.2 ms per degree)
+        nx, ny = rng.uniform(0.05, 0.95, 2)
+        distance = np.hypot((nx - cx) * SCREEN_SIZE_W, (ny - cy) * SCREEN_SIZE_H)
+        amplitude = np.rad2deg(np.arctan(distance / SCREEN_TO_EYE_DIST))
+        length = max(1, round((21 + 2.2 * amplitude) / ms_per_sample))
+        end = min(n_samples, i + length)
+        progress = (1 - np.cos(np.pi * np.arange(1, end - i + 1) / (length + 1))) / 2
+        x[i:end] = cx + (nx - cx) * progress
+        y[i:end] = cy + (ny - cy) * progress
+        i = end
+        cx, cy = nx, ny
+    return x, y
+
+
+def missing_mask(n_samples, sampling_rate, interval_ms, duration_ms, rng):
+    # Random stretches of missing samples, mean interval_ms apart
+    missing = np.zeros(n_samples, dtype=bool)
+    ms_per_sample = 1000 / sampling_rate
+    i = 0
+    while True:
+        i += max(1, round(rng.exponential(interval_ms) / ms_per_sample))
+        if i >= n_samples:
+            return missing
+        length = max(1, round(rng.uniform(*duration_ms) / ms_per_sample))
+        missing[i:i + length] = True
+        i += length
+
+
+def format_points(x, y, valid):
+    # Tobii reports float32 coordinates, written like TobiiRecorder does
+    x, y = x.astype(np.float32).tolist(), y.astype(np.float32).tolist()
+    return [f"({a}, {b})" if ok else "(nan, nan)" for a, b, ok in zip(x, y, valid)]
+
+
+def em_frame(start, n_samples, sampling_rate, rng, system_start=None):
+    """
+    One recording in the format of TobiiRecorder.py, starting at start (datetime).
+    system_start: system_time_stamp of the first sample (us), None for the "timestamp" strings of the older recordings.
+    """
+    x, y = gaze_trace(n_samples, sampling_rate, rng)
+    blink = missing_mask(n_samples, sampling_rate, BLINK_INTERVAL_MS, BLINK_DURATION_MS, rng)
+    valid = {
+        'left': ~(blink | missing_mask(n_samples, sampling_rate, DROPOUT_INTERVAL_MS, DROPOUT_DURATION_MS, rng)),
+        'right': ~(blink | missing_mask(n_samples, sampling_rate, DROPOUT_INTERVAL_MS, DROPOUT_DURATION_MS, rng)),
+    }
+    points = {
+        'left': (x, y),
+        'right': (x + RIGHT_EYE_OFFSET + rng.normal(0, FIXATION_JITTER / 2, n_samples),
+                  y + rng.normal(0, FIXATION_JITTER / 2, n_samples)),
+    }
+    pupil = 3.0 + 0.3 * np.sin(np.arange(n_samples) / (sampling_rate * 20))
+
+    if system_start is None:
+        # Arrival time on the recording computer, jitter below half a sample so that the timestamps stay ordered
+        offsets_us = np.arange(n_samples) * 1e6 / sampling_rate + rng.uniform(0, 5e5 / sampling_rate, n_samples)
+        timestamps = np.datetime64(start, 'us') + offsets_us.astype('timedelta64[us]')
+        data = {"timestamp": np.char.replace(np.datetime_as_string(timestamps, unit='us'), 'T', ' ')}
+    else:
+        # Stamped by the tracker, the device clock has its own origin
+        offsets_us = np.round(np.arange(n_samples) * 1e6 / sampling_rate).astype(np.int64)
+        device_start = int(rng.integers(10 ** 9, 10 ** 10))
+        data = {"device_time_stamp": device_start + offsets_us, "system_time_stamp": system_start + offsets_us}
+    for eye in ('left', 'right'):
+        data[f"{eye}_gaze_point_on_display_area"] = format_points(*points[eye], valid[eye])
+        data[f"{eye}_gaze_point_validity"] = valid[eye].astype(int)
+    for eye in ('left', 'right'):
+        data[f"{eye}_pupil_diameter"] = np.where(valid[eye], pupil + rng.normal(0, 0.05, n_samples), np.nan)
+        data[f"{eye}_pupil_validity"] = valid[eye].astype(int)
+    return pd.DataFrame(data)
+
+
+def sart_random_sequence(rng):
+    # Trial numbers followed by a probe, same constraints as sart_lastrun.py
+    while True:
+        e1 = rng.integers(-5, 6)
+        e2 = rng.integers(-5 + e1, 6 + e1)
+        e4 = rng.integers(-5, 6)
+        e3 = rng.integers(-5 + e4, 6 + e4)
+        if -5 + e2 <= e3 <= 5 + e2:
+            return [int(20 + e1), int(40 + e2), int(60 + e3), int(80 + e4), 100]
+
+
+def sart_psychopy(date, n_trials, rng):
+    """
+    psychopy csv of a SART session started at date, probes after the trials of randomSequence
+    (scaled to n_trials when it is not 100). Return (dataframe, duration in s).
+    """
+    sequence = [max(1, round(trial * n_trials / 100)) for trial in sart_random_sequence(rng)]
+    rows = [{"date": str(date), "randomSequence": str(sequence)}]
+    t = rng.uniform(1.0, 3.0)
+    for k in range(n_trials):
+        stimulus = int(rng.integers(1, 10))
+        # 3 is the no-go digit
+        responded = rng.random() < (0.95 if stimulus != 3 else 0.3)
+        probe = k + 1 in sequence
+        rows.append({
+            "stimulus": stimulus,
+            "stimulus_resp.corr": int(responded == (stimulus != 3)),
+            "stimulus_resp.rt": t + rng.uniform(0.2, 0.8) if responded else np.nan,
+            "text_2.started": t,
+            "prob_resp.keys": ("num_4" if rng.random() < 0.5 else "num_6") if probe else np.nan,
+        })
+        t += SART_STIMULUS_DURATION + rng.uniform(0.0, 0.05)
+        if probe:
+            t += rng.uniform(*SART_PROBE_DURATION)
+    return pd.DataFrame(rows), t
+
+
+def freeviewing_psychopy(date, n_images, rng):
+    """
+    psychopy csv of a FreeViewing session started at date, one probe after each image.
+    Return (dataframe, duration in s).
+    """
+    rows = [{"date": str(date)}]
+    t = rng.uniform(1.0, 3.0)
+    for k in range(n_images):
+        duration = int(rng.integers(FREEVIEWING_IMAGE_DURATION[0], FREEVIEWING_IMAGE_DURATION[1] + 1))
+        rows.append({
+            "imagepath": f"Training\\City_{k + 1}.jpg",
+            "image.started": t,
+            "image.rt": duration,
+            "probe_resp.keys": "num_4" if rng.random() < 0.5 else "num_6",
+        })
+        t += duration + rng.uniform(*SART_PROBE_DURATION)
+    return pd.DataFrame(rows), t
+
+
+def clock_pairs(start, system_start, duration, rng):
+    # TobiiRecorder.record_clock_offset reads the clocks when the recording starts and when it stops
+    pairs = []
+    for elapsed in (0.0, duration):
+        uncertainty = int(rng.integers(CLOCK_UNCERTAINTY_US // 2, CLOCK_UNCERTAINTY_US + 1))
+        pairs.append({"system_time_stamp": system_start + round(elapsed * 1e6),
+                      "datetime": str(start + timedelta(seconds=elapsed)), "uncertainty_us": uncertainty})
+    return pairs
+
+
+def write_session(raw_dir, task, name, session, start, sampling_rate, rng, n_trials=100, n_images=8,
+                  legacy_timestamps=False):
+    """
+    Write the psychopy and em csv of one session under raw_dir/name/data and raw_dir/name/em, like the lab computer does.
+    The eye tracker starts a few seconds before psychopy and stops a few seconds after.
+    Return (psychopy csv path, em csv path).
+    """
+    lead = rng.uniform(2.0, 5.0)
+    date = start + timedelta(seconds=lead)
+    if task == "SART":
+        psychopy, duration = sart_psychopy(date, n_trials, rng)
+        psychopy_name = f"{name}_SART_{session}.csv"
+    else:
+        psychopy, duration = freeviewing_psychopy(date, n_images, rng)
+        psychopy_name = f"{name}_IMG_{session}.csv"
+    n_samples = int((lead + duration + rng.uniform(2.0, 5.0)) * sampling_rate)
+    # system_time_stamp is a monotonic clock of the recording computer, its origin is unrelated to the date
+    system_start = None if legacy_timestamps else int(rng.integers(10 ** 10, 10 ** 12))
+    em = em_frame(start, n_samples, sampling_rate, rng, system_start)
+
+    psychopy_dir = os.path.join(raw_dir, name, "data")
+    em_dir = os.path.join(raw_dir, name, "em")
+    os.makedirs(psychopy_dir, exist_ok=True)
+    os.makedirs(em_dir, exist_ok=True)
+    psychopy_path = os.path.join(psychopy_dir, psychopy_name)
+    em_path = os.path.join(em_dir, start.strftime(f"{name}_%Y%m%d%H%M.csv"))
+    psychopy.to_csv(psychopy_path, index=False)
+    em.to_csv(em_path, index=False, lineterminator='\n')
+    if system_start is not None:
+        with open(em_path[:-len('.csv')] + '.clock.json', 'w') as file:
+            json.dump({"pairs": clock_pairs(start, system_start, n_samples / sampling_rate, rng)}, file, indent=2)
+    return psychopy_path, em_path
+
+
+def write_cohort(raw_dir, task="SART", participants=1, sessions=3, sampling_rate=60, seed=0, n_trials=100, n_images=8,
+                 legacy_timestamps=False):
+    # Sessions of the same participant are an hour apart, return the (psychopy csv, em csv) paths
+    rng = np.random.default_rng(seed)
+    paths = []
+    for participant in range(participants):
+        name = f"S{participant + 1:03d}"
+        start = datetime(2024, 1, 1, 10, 0) + timedelta(days=participant)
+        for session in range(1, sessions + 1):
+            session_start = start + timedelta(hours=session - 1, seconds=float(rng.uniform(0, 30)))
+            paths.append(write_session(raw_dir, task, name, session, session_start, sampling_rate, rng,
+                                       n_trials=n_trials, n_images=n_images, legacy_timestamps=legacy_timestamps))
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task", choices=["SART", "FreeViewing"], default="SART")
+    parser.add_argument("--raw-dir", default=None, help="default: ./Benchmark/Raw/{task}")
+    parser.add_argument("--participants", type=int, default=1)
+    parser.add_argument("--sessions", type=int, default=3, help="sessions per participant")
+    parser.add_argument("--sampling-rate", type=float, default=60, help="Hz")
+    parser.add_argument("--trials", type=int, default=100, help="SART trials per session")
+    parser.add_argument("--images", type=int, default=8, help="FreeViewing images per session")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy-timestamps", action="store_true",
+                        help='"timestamp" datetime strings of the recordings made before system_time_stamp')
+    args = parser.parse_args()
+
+    raw_dir = args.raw_dir or os.path.join("./Benchmark/Raw", args.task)
+    paths = write_cohort(raw_dir, args.task, args.participants, args.sessions, args.sampling_rate, args.seed,
+                         n_trials=args.trials, n_images=args.images, legacy_timestamps=args.legacy_timestamps)
+    for psychopy_path, em_path in paths:
+        print(f"{psychopy_path}  {em_path}")
+    print(f"{len(paths)} sessions written to {raw_dir}")
@@ -0,0 +1,173 @@
+"""
+Stand-in for the tobii_research module: an eye tracker that replays em csv recordings or synthetic sessions
+(synthetic_session.py) through subscribe_to(EYETRACKER_GAZE_DATA, callback, as_dictionary=True), no hardware needed.
+
+The samples are emitted by a thread like the SDK does, at the sampling rate of the recording or any other rate,
+in real time or speed times faster. system_time_stamp / device_time_stamp are the capture times on the simulated clock
+(get_system_time_stamp), which runs speed times faster than the wall clock, so a replay at 4x looks like a real-time
+recording to the recorder. Injected delivery jitter delays the callbacks but keeps them in order,
+injected dropouts drop stretches of samples before they reach the callback.
+
+Usage, before the recorder imports tobii_research:
+    import tobii_replay
+    tobii_replay.install(tobii_replay.ReplayEyeTracker(tobii_replay.synthetic_samples(60, 120), 120, speed=4))
+"""
+
+import os
+import sys
+import time
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Preprocess", "Common"))
+from session_format import GAZE_POINT_COLUMNS, xy_columns, split_point_columns, session_sampling_rate
+from synthetic_session import em_frame
+
+EYETRACKER_GAZE_DATA = "gaze_data"
+SAMPLE_COLUMNS = ["left_gaze_point_validity", "right_gaze_point_validity", "left_pupil_diameter", "left_pupil_validity",
+                  "right_pupil_diameter", "right_pupil_validity"]
+
+_clock_origin = time.monotonic()
+_clock_speed = 1.0
+_eyetrackers = []
+
+
+def get_system_time_stamp():
+    # us on the simulated clock
+    return int((time.monotonic() - _clock_origin) * _clock_speed * 1e6)
+
+
+def find_all_eyetrackers():
+    return list(_eyetrackers)
+
+
+def frame_samples(em_data):
+    """
+    Gaze data dicts (without the time stamps) of an em dataframe in the csv format,
+    "(x, y)" gaze points or *_x / *_y columns.
+    """
+    em_data = em_data.copy()
+    split_point_columns(em_data)
+    columns = {column: em_data[column].to_numpy(dtype=np.float64).tolist() for column in SAMPLE_COLUMNS}
+    points = {}
+    for name in GAZE_POINT_COLUMNS:
+        x_column, y_column = xy_columns(name)
+        points[name] = list(zip(em_data[x_column].to_numpy(dtype=np.float64).tolist(),
+                                em_data[y_column].to_numpy(dtype=np.float64).tolist()))
+    samples = []
+    for i in range(len(em_data)):
+        sample = {column: values[i] for column, values in columns.items()}
+        for name in GAZE_POINT_COLUMNS:
+            sample[name] = points[name][i]
+        for column in ("left_gaze_point_validity", "right_gaze_point_validity", "left_pupil_validity", "right_pupil_validity"):
+            sample[column] = int(sample[column])
+        samples.append(sample)
+    return samples
+
+
+def csv_samples(em_data_path):
+    # (samples, sampling rate) of a recorded em csv
+    em_data = pd.read_csv(em_data_path)
+    return frame_samples(em_data), session_sampling_rate(em_data)
+
+
+def synthetic_samples(duration, sampling_rate, seed=0):
+    rng = np.random.default_rng(seed)
+    return frame_samples(em_frame(datetime.now(), int(duration * sampling_rate), sampling_rate, rng, system_start=0))
+
+
+class ReplayEyeTracker:
+    """
+    samples: gaze data dicts, replayed in a loop when loop is True
+    sampling_rate: Hz of the replay, whatever the rate of the recording
+    speed: simulated seconds per wall-clock second
+    jitter_ms: sd of the delivery delay after the capture (half-normal)
+    dropout_rate: dropouts per second, dropout_ms: (min, max) duration of a dropout
+    """
+    address = "replay://"
+    model = "Replay"
+    serial_number = "replay"
+
+    def __init__(self, samples, sampling_rate, speed=1.0, jitter_ms=0.0, dropout_rate=0.0, dropout_ms=(10, 50),
+                 loop=True, seed=0):
+        self.samples = samples
+        self.sampling_rate = sampling_rate
+        self.speed = speed
+        self.jitter_ms = jitter_ms
+        self.dropout_rate = dropout_rate
+        self.dropout_ms = dropout_ms
+        self.loop = loop
+        self.rng = np.random.default_rng(seed)
+        self.device_origin = int(self.rng.integers(10 ** 9, 10 ** 10))
+        self.callbacks = []
+        self.thread = None
+        self.stop = threading.Event()
+        self.delivered = 0
+        self.dropped = 0
+
+    def get_gaze_output_frequency(self):
+        return self.sampling_rate
+
+    def subscribe_to(self, stream, callback, as_dictionary=True):
+        if stream != EYETRACKER_GAZE_DATA or not as_dictionary:
+            raise ValueError("Only the gaze data stream as dictionaries is replayed")
+        self.callbacks.append(callback)
+        if self.thread is None:
+            self.stop.clear()
+            self.thread = threading.Thread(target=self._replay, daemon=True)
+            self.thread.start()
+
+    def unsubscribe_from(self, stream, callback=None):
+        self.callbacks = [other for other in self.callbacks if callback is not None and other != callback]
+        if not self.callbacks and self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self.thread = None
+
+    def _replay(self):
+        interval_us = 1e6 / self.sampling_rate
+        start = get_system_time_stamp()
+        last_delivery = start
+        dropout_end = -1
+        i = 0
+        while not self.stop.is_set():
+            if i >= len(self.samples) and not self.loop:
+                return
+            capture = start + round(i * interval_us)
+            if self.dropout_rate and i > dropout_end and self.rng.random() < self.dropout_rate / self.sampling_rate:
+                dropout_end = i + round(self.rng.uniform(*self.dropout_ms) * self.sampling_rate / 1000)
+            if i <= dropout_end:
+                self.dropped += 1
+                i += 1
+                continue
+            delay = abs(self.rng.normal(0, self.jitter_ms * 1000)) if self.jitter_ms else 0
+            last_delivery = max(last_delivery, capture + delay)
+            wait = (last_delivery - get_system_time_stamp()) / 1e6 / _clock_speed
+            if wait > 0:
+                time.sleep(wait)
+            # Unsubscribed during the sleep, the sample is not delivered
+            callbacks = self.callbacks
+            if self.stop.is_set() or not callbacks:
+                return
+            sample = dict(self.samples[i % len(self.samples)])
+            sample["device_time_stamp"] = self.device_origin + capture
+            sample["system_time_stamp"] = capture
+            for callback in callbacks:
+                callback(sample)
+            self.delivered += 1
+            i += 1
+
+
+def install(*eyetrackers):
+    """
+    Register this module as tobii_research with the given trackers.
+    The clock restarts at 0 and runs at the speed of the first tracker.
+    """
+    global _clock_origin, _clock_speed
+    _eyetrackers[:] = eyetrackers
+    if eyetrackers:
+        _clock_origin = time.monotonic()
+        _clock_speed = eyetrackers[0].speed
+    sys.modules["tobii_research"] = sys.modules[__name__]
@@ -1,10 +1,13 @@
 import os
+import sys
 import pandas as pd
 import re
-from datetime import datetime, timedelta    
+from functools import partial
 
-psychopy_to_datetime = lambda s: datetime.strptime(s, '%Y-%m-%d_%Hh%M.%S.%f')
-str_to_datetime = lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Preprocess", "Common"))
+from alignment import FREEVIEWING_TRIALS, align, align_segments, load_clock_offset, str_to_datetime
+from gaze_recording import convert_recordings
+from segments import is_segment_index, segment_frames, session_recordings
 
 class DataSynchronization:
     def __init__(self, psychopy_data_path, em_data_path, target_file_path):
@@ -15,65 +18,25 @@ class DataSynchronization:
             os.makedirs(self.target_dir)
         self.target_file_path = target_file_path
         self.psychopy_data = pd.read_csv(self.psychopy_data_path)
-        self.em_data = pd.read_csv(self.em_data_path)
+        # Recorded in segments (segments.py): synced one segment at a time by synced_segments, joined by sync_data
+        self.em_data = None if is_segment_index(self.em_data_path) else pd.read_csv(self.em_data_path)
         self.ExpTime = self.psychopy_data["date"].iloc[0]
         self.ExpTime = str_to_datetime(self.ExpTime)
+        # system_time_stamp -> psychopy's clock, None for the recordings with "timestamp" strings
+        self.clock_offset = load_clock_offset(self.em_data_path)
 
     def sync_data(self):
-        self.pending_data = []
-        # This will iterate over the psychopy data once
-        for idx, row in self.psychopy_data.iterrows():
-            if pd.isna(row["imagepath"]): continue
-            image_path = row["imagepath"]
-            image_name = image_path.split("\\")[-1].split(".")[0]
-            image_started_time = self.ExpTime + timedelta(seconds=row["image.started"])
-            image_duration = row["image.rt"]
-            image_stopped_time = image_started_time + timedelta(seconds=image_duration)
-            state = row["probe_resp.keys"]
-            self.pending_data.append((image_name, state, image_started_time, image_stopped_time))
-        
-        # Then iterate over the eye-tracking data once
-        self.started_time = []
-        self.stopped_time = []
-        self.stimuli_data = []
-        self.state = []
-        img_idx = 0
-        for _, row in self.em_data.iterrows():
-            timestamp = str_to_datetime(row["timestamp"])
-            image_name, state, image_started_time, image_stopped_time = self.pending_data[img_idx]
-            if timestamp < image_started_time:
-                self.stimuli_data.append(None)
-                self.state.append(None)
-                self.started_time.append(None)
-                self.stopped_time.append(None)
-            elif image_started_time <= timestamp <= image_stopped_time:
-                self.stimuli_data.append(image_name)
-                self.state.append(state)
-                self.started_time.append(image_started_time)
-                self.stopped_time.append(image_stopped_time)
-            else:
-                img_idx += 1
-                if img_idx >= len(self.pending_data):
-                    break
-                self.stimuli_data.append(None)
-                self.state.append(None)
-                self.started_time.append(None)
-                self.stopped_time.append(None)             
-                
-                
-        # 残りをNoneで埋める
-        for _ in range(max(0, self.em_data.shape[0] - len(self.stimuli_data))):
-            self.stimuli_data.append(None)
-            self.state.append(None)
-            self.started_time.append(None)
-            self.stopped_time.append(None)
-        
-        self.em_data["stimuli"] = self.stimuli_data
-        self.em_data["state"] = self.state
-        self.em_data["started_time"] = self.started_time
-        self.em_data["stopped_time"] = self.stopped_time
-            
-            
+        if self.em_data is None:
+            self.em_data = pd.concat(list(self.synced_segments()), ignore_index=True)
+            return
+        # Trials, probes and sync columns are described by alignment.FREEVIEWING_TRIALS
+        align(self.em_data, self.psychopy_data, FREEVIEWING_TRIALS, self.ExpTime, self.clock_offset)
+
+    def synced_segments(self):
+        # Synced em data of a session recorded in segments, one dataframe per segment
+        read_segments = partial(segment_frames, self.em_data_path)
+        yield from align_segments(read_segments, self.psychopy_data, FREEVIEWING_TRIALS, self.ExpTime, self.clock_offset)
+
     def save_data(self):
         self.em_data.to_csv(self.target_file_path, index=False)
     
@@ -83,7 +46,9 @@ class DataSynchronization:
 
 if __name__ == "__main__":
     data_list = [file_name for file_name in os.listdir("./data") if file_name.endswith(".csv")]
-    em_list = [file_name for file_name in os.listdir("./em") if file_name.endswith(".csv")]
+    # .gaze binary recordings -> em csv
+    convert_recordings("./em")
+    em_list = session_recordings("./em")  # em csv files and segment indexes
     sorted_data_list = sorted(data_list, key=lambda x: int(re.search(r'(\d+)\.csv$', x).group(1)))
     sorted_em_list = sorted(em_list, key=lambda x: re.search(r'(\d{12})', x).group())
     for psychopy_data_name, em_data_name in zip(sorted_data_list, sorted_em_list):
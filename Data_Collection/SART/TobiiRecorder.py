@@ -4,20 +4,62 @@ This class is used to collect eye tracking data using Tobii Pro SDK.
 """
 import tobii_research as tr
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import time
 import threading
 import os
+import sys
+import json
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Preprocess", "Common"))
+from gaze_recording import GAZE_COLUMNS, RecordingWriter, gaze_records
+from capture_telemetry import CaptureTelemetry, telemetry_path
+from session_format import SEGMENT_INDEX_SUFFIX
+from segments import SegmentIndex
 
 class EyeTrackerDataCollector:
+    # "gaze": memory-mapped binary records (Preprocess/Common/gaze_recording.py, converted to the em csv before sync),
+    # "csv": the em csv directly
+    RECORDING_FORMAT = "gaze"
+    FLUSH_INTERVAL = 0.2  # s between two writes of the buffered samples, at most this much is lost when killed
+    STATUS_INTERVAL = 5.0  # s between two status lines and telemetry saves
+    # A new segment file every SEGMENT_SECONDS of recording or SEGMENT_SAMPLES samples (Preprocess/Common/segments.py),
+    # so that the finished segments are classified while the recording continues (Preprocess/SART/Code/main_sart.py --watch).
+    # Both None: one file per session
+    SEGMENT_SECONDS = 5 * 60
+    SEGMENT_SAMPLES = None
+
     def __init__(self):
         now = datetime.now()
         if not os.path.exists('./em'): os.makedirs('./em')
         self.name = input("Please enter your exp number (number_initial)\n")
-        self.file_path = now.strftime('./em/{}_%Y%m%d%H%M.csv'.format(self.name))
+        stem = now.strftime('./em/{}_%Y%m%d%H%M'.format(self.name))
+        if self.SEGMENT_SECONDS or self.SEGMENT_SAMPLES:
+            # The index lists the segment files, it stands for the em csv of the session
+            self.file_path = stem + SEGMENT_INDEX_SUFFIX
+            self.segment_index = SegmentIndex(self.file_path, self.RECORDING_FORMAT, self.SEGMENT_SECONDS, self.SEGMENT_SAMPLES)
+        else:
+            self.file_path = stem + '.' + self.RECORDING_FORMAT
+            self.segment_index = None
+        # Clock-offset record of the session, maps system_time_stamp to the datetime.now() clock of psychopy's "date"
+        self.clock_file_path = stem + '.clock.json'
+        self.clock_pairs = []
         self.start_time = None  # Initialize start_time
         self.recording_duration = 60*120  # 2 hours
         self.my_eyetracker = self.initialize_eye_tracker()
+        # Callback time, sample intervals, dropped and late samples and buffer depth, saved to the .telemetry.json sidecar
+        self.telemetry = CaptureTelemetry(self.my_eyetracker.get_gaze_output_frequency())
+        self.telemetry_file_path = telemetry_path(self.file_path)
+        # The SDK callback only appends to the buffer (deque.append is thread safe), the writer thread writes the batches
+        self.buffer = deque()
+        self.n_written = 0
+        # File or segment being written, only used by the writer thread
+        self.recording = None
+        self.recording_path = None
+        self.stop_writing = threading.Event()
+        self.writer = threading.Thread(target=self.write_buffer, daemon=True)
 
     def initialize_eye_tracker(self):
         found_eyetrackers = tr.find_all_eyetrackers()
@@ -26,39 +68,115 @@ class EyeTrackerDataCollector:
         else:
             raise Exception("No eye trackers found.")
 
+    def record_clock_offset(self, n_reads=20):
+        """
+        Pair Tobii's system clock (microseconds) with datetime.now(), the clock psychopy writes to "date".
+        datetime.now() is read between two system clock reads, the pair with the shortest bracket is kept.
+        The pairs are saved to the .clock.json file next to the em csv, sync uses them to place the samples on psychopy's clock.
+        """
+        best = None
+        for _ in range(n_reads):
+            before = tr.get_system_time_stamp()
+            now = datetime.now()
+            after = tr.get_system_time_stamp()
+            if best is None or after - before < best["uncertainty_us"]:
+                best = {"system_time_stamp": (before + after) // 2, "datetime": str(now), "uncertainty_us": after - before}
+        self.clock_pairs.append(best)
+        with open(self.clock_file_path, 'w') as file:
+            json.dump({"pairs": self.clock_pairs}, file, indent=2)
+
     def start_collecting(self):
+        self.record_clock_offset()
+        self.writer.start()
         self.my_eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback, as_dictionary=True)
         self.start_time = datetime.now() 
-        time.sleep(self.recording_duration)
+        try:
+            time.sleep(self.recording_duration)
+        finally:
+            # Also on Ctrl+C: the samples still in the buffer are written before the script exits
+            self.my_eyetracker.unsubscribe_from(tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback)
+            self.stop_writing.set()
+            self.writer.join()
+            self.record_clock_offset()
 
     def gaze_data_callback(self, gaze_data):
-        gaze_dict = {
-            "timestamp": datetime.now(),
-            "left_gaze_point_on_display_area": gaze_data["left_gaze_point_on_display_area"],
-            "left_gaze_point_validity": gaze_data["left_gaze_point_validity"],
-            "right_gaze_point_on_display_area": gaze_data["right_gaze_point_on_display_area"],
-            "right_gaze_point_validity": gaze_data["right_gaze_point_validity"],
-            "left_pupil_diameter": gaze_data["left_pupil_diameter"],
-            "left_pupil_validity": gaze_data["left_pupil_validity"],
-            "right_pupil_diameter": gaze_data["right_pupil_diameter"],
-            "right_pupil_validity": gaze_data["right_pupil_validity"]
-        }
-        self.append_data_to_file(gaze_dict)
-        self.print_duration()
+        # Runs on the SDK thread: no formatting, file access or printing here
+        start = time.perf_counter()
+        gaze_data["arrival_time_stamp"] = tr.get_system_time_stamp()
+        self.buffer.append(gaze_data)
+        self.telemetry.record_callback(time.perf_counter() - start)
 
-    def append_data_to_file(self, data):
-        df = pd.DataFrame([data])
-        # Check if the file exists
-        file_exists = os.path.exists(self.file_path)
+    def write_buffer(self):
+        # Writer thread: every FLUSH_INTERVAL, write the buffered samples to the recording in one batch
+        last_status = time.monotonic()
+        try:
+            while True:
+                stopping = self.stop_writing.wait(self.FLUSH_INTERVAL)
+                self.append_data_to_file()
+                if time.monotonic() - last_status >= self.STATUS_INTERVAL:
+                    self.print_duration()
+                    self.telemetry.save(self.telemetry_file_path)
+                    last_status = time.monotonic()
+                if stopping:
+                    self.print_duration()
+                    self.telemetry.save(self.telemetry_file_path)
+                    return
+        finally:
+            self.close_recording()
+            if self.segment_index is not None:
+                self.segment_index.close()
 
-        # Open the file in append mode and write the DataFrame
-        with open(self.file_path, 'a') as file:
-            df.to_csv(file, header=not file_exists, index=False, lineterminator='\n')
+    def open_recording(self, path):
+        self.close_recording()
+        if self.RECORDING_FORMAT == "gaze":
+            self.recording = RecordingWriter(path)
+        else:
+            self.recording = open(path, 'a')
+            if self.recording.tell() == 0:
+                self.recording.write(",".join(GAZE_COLUMNS) + "\n")
+        self.recording_path = path
+
+    def close_recording(self):
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+
+    def append_data_to_file(self):
+        batch = []
+        while self.buffer:
+            batch.append(self.buffer.popleft())
+        if batch:
+            system_time_stamps = np.array([sample["system_time_stamp"] for sample in batch], dtype=np.int64)
+            arrival_time_stamps = np.array([sample["arrival_time_stamp"] for sample in batch], dtype=np.int64)
+            self.telemetry.add_batch(system_time_stamps, arrival_time_stamps - system_time_stamps, len(batch))
+            # (file, start, end) of the parts of the batch, cut at the segment boundaries
+            if self.segment_index is None:
+                parts = [(self.file_path, 0, len(batch))]
+            else:
+                parts = self.segment_index.split(system_time_stamps)
+            for path, start, end in parts:
+                if path != self.recording_path:
+                    self.open_recording(path)
+                self.write_batch(batch[start:end])
+            if self.segment_index is not None:
+                # Saved after the samples are written, the index never lists samples the segments do not have
+                self.segment_index.save()
+            self.n_written += len(batch)
+
+    def write_batch(self, batch):
+        if self.RECORDING_FORMAT == "gaze":
+            self.recording.append(gaze_records(batch))
+            self.recording.commit()
+        else:
+            df = pd.DataFrame(batch, columns=GAZE_COLUMNS)
+            df.to_csv(self.recording, header=False, index=False, lineterminator='\n')
+            self.recording.flush()
 
     def print_duration(self):
         if self.start_time:
             duration = (datetime.now() - self.start_time).total_seconds()
-            print(f"Eye tracker has been working for {duration:.2f} seconds.")
+            print(f"Eye tracker has been working for {duration:.2f} seconds, {self.n_written} samples written, "
+                  f"{len(self.buffer)} buffered, {self.telemetry.dropped_samples} dropped.")
         else:
             print("Eye tracker has not started.")
 
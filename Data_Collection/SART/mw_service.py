@@ -0,0 +1,56 @@
+"""
+Real-time mind-wandering scoring of the SART session (Preprocess/Common/mw_scoring.py), run next to TobiiRecorder.py.
+Subscribes to the gaze data of the eye tracker, scores the last --window seconds every --interval-ms with the model
+and sends every score as a JSON line to the clients of 127.0.0.1:--port.
+
+Usage:
+    python mw_service.py --model mw_model_32sec.pkl --window 32 --interval-ms 1000 --port 5678
+"""
+import tobii_research as tr
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Preprocess", "Common"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Preprocess", "SART", "Code"))
+from mw_scoring import ScoringService, load_model
+from OOP_preprocess_sart import EyeMovement
+
+STATUS_INTERVAL = 5.0  # s between two status lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=None, help="pickled model (mw_scoring.train_model), default: features only")
+    parser.add_argument("--window", type=float, default=32, help="s of gaze scored, the window size of the model")
+    parser.add_argument("--interval-ms", type=float, default=1000, help="ms between two scores")
+    parser.add_argument("--eye", choices=["left", "right"], default="left")
+    parser.add_argument("--port", type=int, default=5678)
+    args = parser.parse_args()
+
+    found_eyetrackers = tr.find_all_eyetrackers()
+    if not found_eyetrackers:
+        raise Exception("No eye trackers found.")
+    eyetracker = found_eyetrackers[0]
+    model = load_model(args.model) if args.model else None
+    service = ScoringService(EyeMovement.parameters(), eyetracker.get_gaze_output_frequency(), args.window, model,
+                             args.interval_ms, args.eye, clock=tr.get_system_time_stamp)
+    port = service.serve(args.port)
+    eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, service.gaze_data_callback, as_dictionary=True)
+    service.start()
+    print(f"Scoring the last {args.window:g} s every {args.interval_ms:g} ms on 127.0.0.1:{port}")
+    try:
+        while True:
+            time.sleep(STATUS_INTERVAL)
+            result = service.latest
+            if result is None:
+                print("Waiting for a full window")
+            else:
+                print(f"score {result['score']}, NumFix {result['features']['NumFix']}, "
+                      f"delay {result['delay_us'] / 1000:.0f} ms, {len(service.clients)} clients")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        eyetracker.unsubscribe_from(tr.EYETRACKER_GAZE_DATA, service.gaze_data_callback)
+        service.stop()
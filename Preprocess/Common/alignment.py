@@ -0,0 +1,234 @@
+"""
+Alignment engine of the sync step, shared by the SART and FreeViewing DataSynchronization
+(Preprocess/*/Code/OOP_sync_*.py and their Data_Collection copies sync_sart.py / sync_img.py).
+
+A paradigm is described by a TrialDescription: which psychopy columns give the trials, their onset and duration,
+the labels copied to the samples, and the probe answers. align() adds the sync columns to the em data:
+the em timestamps are turned once into int64 nanoseconds on psychopy's clock, every sample gets the index of its trial (and probe block)
+from a search over the sorted timestamps, and the columns are filled in bulk from the per-trial values.
+
+Em timestamps: recordings by the current TobiiRecorder.py have Tobii's system_time_stamp (int64 microseconds) and a
+{em csv name}.clock.json next to the csv pairing that clock with datetime.now(), the clock of psychopy's "date".
+Older recordings have "timestamp" datetime strings taken when the samples arrived.
+"""
+
+import os
+import json
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+from session_format import recording_stem
+
+psychopy_to_datetime = lambda s: datetime.strptime(s, '%Y-%m-%d_%Hh%M.%S.%f')
+def str_to_datetime(s):
+    try: return datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError: return datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+
+
+class TrialDescription:
+    """
+    trial_column: the rows with a value in this column are the trials
+    onset_column: onset of the trial, seconds from the psychopy "date"
+    duration: seconds, or the column holding the duration of each trial
+    labels: {sync column: (psychopy column, converter or None)}, copied to the samples of the trial
+    response_times: {sync column: psychopy column}, seconds from the psychopy "date", written relative to the onset
+    probe_column: answer to the probe, written to the "state" column
+    probe_sequence_column: None when the probe labels its own trial. Otherwise the column (first row) listing the
+        trial numbers followed by a probe, and each probe labels the block of trials up to it (SART randomSequence)
+    """
+    def __init__(self, trial_column, onset_column, duration, labels, probe_column,
+                 response_times=None, probe_sequence_column=None):
+        self.trial_column = trial_column
+        self.onset_column = onset_column
+        self.duration = duration
+        self.labels = labels
+        self.probe_column = probe_column
+        self.response_times = response_times or {}
+        self.probe_sequence_column = probe_sequence_column
+
+
+SART_TRIALS = TrialDescription(
+    trial_column="stimulus",
+    onset_column="text_2.started",
+    duration=2.0,
+    labels={"stimuli": ("stimulus", None), "stimuli_resp_corr": ("stimulus_resp.corr", int)},
+    response_times={"stimuli_resp_rt": "stimulus_resp.rt"},
+    probe_column="prob_resp.keys",
+    probe_sequence_column="randomSequence",
+)
+
+FREEVIEWING_TRIALS = TrialDescription(
+    trial_column="imagepath",
+    onset_column="image.started",
+    duration="image.rt",
+    # Training\\Brazil_1.jpg -> Brazil_1
+    labels={"stimuli": ("imagepath", lambda image_path: image_path.split("\\")[-1].split(".")[0])},
+    probe_column="probe_resp.keys",
+)
+
+
+def parse_timestamps(values):
+    # "%Y-%m-%d %H:%M:%S.%f" / "%Y-%m-%d %H:%M:%S" strings written by TobiiRecorder -> int64 ns
+    return pd.to_datetime(pd.Series(values), format='ISO8601').to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def clock_file_path(em_data_path):
+    return recording_stem(em_data_path) + '.clock.json'
+
+
+def load_clock_offset(em_data_path):
+    """
+    ns to add to system_time_stamp * 1000 to get the datetime.now() clock in ns, from the clock file of the recording.
+    The pair read with the shortest bracket is used. None when the recording has no clock file.
+    """
+    path = clock_file_path(em_data_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        pairs = json.load(file)["pairs"]
+    best = min(pairs, key=lambda pair: pair["uncertainty_us"])
+    return pd.Timestamp(best["datetime"]).value - best["system_time_stamp"] * 1000
+
+
+def em_timestamps(em_data, clock_offset=None):
+    # int64 ns on psychopy's clock of every em sample
+    if "system_time_stamp" in em_data.columns:
+        if clock_offset is None:
+            raise ValueError("system_time_stamp recording without its .clock.json clock file")
+        return em_data["system_time_stamp"].to_numpy(dtype=np.int64) * 1000 + clock_offset
+    return parse_timestamps(em_data["timestamp"])
+
+
+def datetimes_to_ns(datetimes):
+    return np.array([pd.Timestamp(value).value for value in datetimes], dtype=np.int64)
+
+
+def assign_intervals(timestamps, starts, stops):
+    """
+    Index of the interval [start, stop] of every sample, -1 for the samples outside the intervals.
+    Same rule as the sample-by-sample walk the sync used to do: the samples are read in order with a pointer to
+    the current interval, the first sample after its stop moves the pointer to the next interval and is left out,
+    and the samples after the stop of the last interval are left out.
+    With sorted timestamps that first sample is found by binary search, otherwise by a scan from the pointer.
+    """
+    n = len(timestamps)
+    index = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return index
+    ordered = bool(np.all(timestamps[1:] >= timestamps[:-1]))
+    if ordered:
+        after_stops = np.searchsorted(timestamps, stops, side='right')
+    lo = 0
+    for interval, (start, stop) in enumerate(zip(starts, stops)):
+        if ordered:
+            hi = max(lo, after_stops[interval])
+        else:
+            after = np.flatnonzero(timestamps[lo:] > stop)
+            hi = lo + after[0] if len(after) else n
+        inside = np.flatnonzero(timestamps[lo:hi] >= start) + lo
+        index[inside] = interval
+        lo = hi + 1
+        if lo >= n:
+            break
+    return index
+
+
+def take(values, index):
+    # Per-sample column from the per-interval values, missing (None / NaN / NaT) where index is -1
+    return pd.Series(values).reindex(index).reset_index(drop=True)
+
+
+def probe_blocks(trials, description, exp_time, started, sequence):
+    """
+    (answer, start, end) of every probe block of a paradigm with probe_sequence_column.
+    sequence [19, 42, 61, 81, 100] -> blocks of trials 0-18, 19-41, 42-60, 61-80, 81-99
+    """
+    start_idx = {0, *sequence[:-1]}
+    end_idx = {trial - 1 for trial in sequence}
+    answers = [answer for answer in trials[description.probe_column] if answer and not pd.isna(answer)]
+    onsets = trials[description.onset_column].tolist()
+    durations = trial_durations(trials, description)
+    starts = [started[i] for i in range(len(trials)) if i in start_idx]
+    ends = [exp_time + timedelta(seconds=onsets[i] + durations[i]) for i in range(len(trials)) if i in end_idx]
+    return list(zip(answers, starts, ends))
+
+
+def trial_durations(trials, description):
+    if isinstance(description.duration, str):
+        return trials[description.duration].tolist()
+    return [description.duration] * len(trials)
+
+
+class Alignment:
+    """
+    Trial and probe block of every em sample of a session, from the psychopy data and the em timestamps (em_timestamps)
+    of the whole session. fill() writes the sync columns of the samples, the whole session at once or one segment
+    at a time.
+    """
+    def __init__(self, psychopy_data, description, exp_time, timestamps):
+        keep = [bool(value) and not pd.isna(value) for value in psychopy_data[description.trial_column]]
+        trials = psychopy_data[keep].reset_index(drop=True)
+        started = [exp_time + timedelta(seconds=onset) for onset in trials[description.onset_column]]
+        stopped = [start + timedelta(seconds=duration) for start, duration in zip(started, trial_durations(trials, description))]
+
+        self.trial_index = assign_intervals(timestamps, datetimes_to_ns(started), datetimes_to_ns(stopped))
+        # {sync column: per-trial values}
+        self.trial_values = {}
+        for column, (source, converter) in description.labels.items():
+            values = trials[source].tolist()
+            self.trial_values[column] = [converter(value) for value in values] if converter else values
+        for column, source in description.response_times.items():
+            # only the trials with a response have a response time
+            self.trial_values[column] = [None if pd.isna(rt) else (exp_time + timedelta(seconds=rt) - start).total_seconds()
+                                         for rt, start in zip(trials[source], started)]
+
+        if description.probe_sequence_column is None:
+            self.state_values = trials[description.probe_column].tolist()
+            self.state_index = self.trial_index
+        else:
+            sequence = eval(psychopy_data[description.probe_sequence_column].iloc[0])
+            blocks = probe_blocks(trials, description, exp_time, started, sequence)
+            self.state_values = [answer for answer, _, _ in blocks]
+            self.state_index = assign_intervals(
+                timestamps,
+                datetimes_to_ns([start for _, start, _ in blocks]),
+                datetimes_to_ns([end for _, _, end in blocks]),
+            )
+        self.started = started
+        self.stopped = stopped
+
+    def fill(self, em_data, start=0):
+        # Sync columns of the samples start .. start + len(em_data) of the session, in place
+        rows = slice(start, start + len(em_data))
+        trial_index = self.trial_index[rows]
+        for column, values in self.trial_values.items():
+            em_data[column] = take(values, trial_index)
+        em_data["state"] = take(self.state_values, self.state_index[rows])
+        em_data["started_time"] = take(self.started, trial_index)
+        em_data["stopped_time"] = take(self.stopped, trial_index)
+
+
+def align(em_data, psychopy_data, description, exp_time, clock_offset=None):
+    """
+    Add the sync columns to em_data in place: the labels, the response times, state, started_time and stopped_time.
+    A sample between the onset and the end of a trial gets the values of the trial, the other samples are left empty.
+    clock_offset: load_clock_offset of the recording, needed for system_time_stamp recordings.
+    """
+    Alignment(psychopy_data, description, exp_time, em_timestamps(em_data, clock_offset)).fill(em_data)
+
+
+def align_segments(read_segments, psychopy_data, description, exp_time, clock_offset=None):
+    """
+    Synced em data of a session recorded in segments, one dataframe per segment, the same rows as align() on the
+    whole session. read_segments(columns=None) returns the em dataframes of the segments in order, it is called once
+    for the timestamps only and once more for the segments yielded.
+    """
+    timestamps = np.concatenate([em_timestamps(segment, clock_offset)
+                                 for segment in read_segments(columns=["system_time_stamp", "timestamp"])] or [[]])
+    alignment = Alignment(psychopy_data, description, exp_time, timestamps.astype(np.int64))
+    start = 0
+    for segment in read_segments():
+        alignment.fill(segment, start)
+        start += len(segment)
+        yield segment
@@ -0,0 +1,50 @@
+"""
+Process-pool runner for the per-session preprocessing of main_sart.py / main_img.py.
+
+Every session is an independent (psychopy csv, em csv, target csv) triple, so sessions are spread over worker processes.
+A failing session does not stop the others, its traceback is kept for the final report.
+Results are returned in the order of the sessions, whatever order the workers finish in.
+"""
+
+import os
+import time
+import traceback
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _run_session(job, session):
+    start = time.time()
+    try:
+        job(*session)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return session, error, time.time() - start
+
+
+def run_sessions(job, sessions, workers=None):
+    """
+    Call job(*session) for every session, in worker processes when workers > 1 (default: all cores).
+    job must be a module-level function so that it can be sent to the workers.
+    Return a list of (session, error traceback or None, seconds), in the order of sessions.
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(sessions)))
+    run = partial(_run_session, job)
+    if workers == 1:
+        return [run(session) for session in sessions]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, sessions))
+
+
+def print_report(results):
+    failed = [(session, error) for session, error, _ in results if error is not None]
+    total = sum(seconds for _, _, seconds in results)
+    print("==========================================================")
+    print(f"{len(results) - len(failed)} / {len(results)} sessions preprocessed ({total:.1f} s of work)")
+    for session, error in failed:
+        print(f"FAILED {session[0]}")
+        print(error.rstrip().splitlines()[-1])
+    print("==========================================================")
+    return len(failed) == 0
@@ -0,0 +1,170 @@
+"""
+Capture telemetry of TobiiRecorder.py and the capture checks of main_sart.py / main_img.py.
+
+The recorder keeps a CaptureTelemetry and writes its summary to {em name}.telemetry.json next to the recording
+every status interval, and when it stops:
+    callback_us         histogram of the execution time of the SDK callback
+    intervals           statistics of the intervals between consecutive system_time_stamp, against the nominal rate
+    dropped_samples     samples missing from the intervals longer than DROPPED_INTERVAL nominal intervals
+    late_samples        samples handed to the callback more than LATE_US after they were captured
+    queue_depth         samples waiting in the writer buffer at a flush
+
+check_capture turns the summary (or, for recordings without a sidecar, the system_time_stamp of the em data)
+into warnings about sessions with degraded capture.
+"""
+
+import os
+import json
+from datetime import datetime
+import numpy as np
+
+from session_format import recording_stem, session_sampling_rate
+
+DROPPED_INTERVAL = 1.5  # nominal intervals
+LATE_US = 50000
+# Interval / nominal interval bins of the interval histogram
+INTERVAL_BINS = (0.5, 0.9, 1.1, 1.5, 2.5, 5, 10)
+CALLBACK_BINS = 18  # bin k: [2 ** (k - 1), 2 ** k) us, the last bin is open
+
+# Warning thresholds of check_capture
+MAX_DROPPED_FRACTION = 0.01
+MAX_LATE_FRACTION = 0.01
+MAX_RATE_ERROR = 0.05  # measured rate against the nominal rate
+MAX_QUEUE_SECONDS = 1.0  # buffered samples at a flush, in seconds of recording
+
+
+class CaptureTelemetry:
+    def __init__(self, nominal_rate):
+        self.nominal_rate = nominal_rate
+        self.callback_counts = [0] * CALLBACK_BINS
+        self.n_samples = 0
+        self.first_time_stamp = None
+        self.last_time_stamp = None
+        self.n_intervals = 0
+        self.interval_sum = 0.0
+        self.interval_square_sum = 0.0
+        self.interval_min = None
+        self.interval_max = None
+        self.interval_counts = np.zeros(len(INTERVAL_BINS) + 1, dtype=np.int64)
+        self.dropped_samples = 0
+        self.late_samples = 0
+        self.max_latency_us = None
+        self.max_queue_depth = 0
+        self.queue_depth = 0
+
+    def record_callback(self, seconds):
+        # Called on the SDK thread, kept to one bin increment
+        self.callback_counts[min(int(seconds * 1e6).bit_length(), CALLBACK_BINS - 1)] += 1
+
+    def add_batch(self, system_time_stamps, latencies_us=None, queue_depth=None):
+        """
+        system_time_stamps: int64 us of the samples, in order
+        latencies_us: time from capture to the callback of every sample, None when unknown
+        queue_depth: samples waiting in the writer buffer, None when unknown
+        """
+        if len(system_time_stamps) == 0:
+            return
+        if self.first_time_stamp is None:
+            self.first_time_stamp = int(system_time_stamps[0])
+            previous = system_time_stamps[:0]
+        else:
+            previous = np.array([self.last_time_stamp], dtype=np.int64)
+        intervals = np.diff(np.concatenate((previous, system_time_stamps))).astype(np.float64)
+        self.n_samples += len(system_time_stamps)
+        self.last_time_stamp = int(system_time_stamps[-1])
+        if len(intervals):
+            self.n_intervals += len(intervals)
+            self.interval_sum += intervals.sum()
+            self.interval_square_sum += (intervals ** 2).sum()
+            self.interval_min = min(intervals.min(), self.interval_min if self.interval_min is not None else np.inf)
+            self.interval_max = max(intervals.max(), self.interval_max if self.interval_max is not None else -np.inf)
+            ratios = intervals * self.nominal_rate / 1e6
+            self.interval_counts += np.bincount(np.searchsorted(INTERVAL_BINS, ratios, side='right'),
+                                                minlength=len(INTERVAL_BINS) + 1)
+            gaps = ratios[ratios > DROPPED_INTERVAL]
+            self.dropped_samples += int((np.round(gaps) - 1).clip(min=1).sum())
+        if latencies_us is not None and len(latencies_us):
+            self.late_samples += int((latencies_us > LATE_US).sum())
+            self.max_latency_us = max(int(latencies_us.max()), self.max_latency_us or 0)
+        if queue_depth is not None:
+            self.queue_depth = queue_depth
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def summary(self):
+        elapsed = (self.last_time_stamp - self.first_time_stamp) / 1e6 if self.n_samples > 1 else 0.0
+        expected = self.n_samples + self.dropped_samples
+        mean = self.interval_sum / self.n_intervals if self.n_intervals else None
+        sd = np.sqrt(max(self.interval_square_sum / self.n_intervals - mean ** 2, 0.0)) if self.n_intervals else None
+        edges = ("0",) + tuple(str(edge) for edge in INTERVAL_BINS) + ("inf",)
+        return {
+            "updated": str(datetime.now()),
+            "nominal_rate": self.nominal_rate,
+            "n_samples": self.n_samples,
+            "measured_rate": (self.n_samples - 1) / elapsed if elapsed > 0 else None,
+            "intervals": {
+                "nominal_us": 1e6 / self.nominal_rate,
+                "mean_us": mean,
+                "sd_us": sd,
+                "min_us": self.interval_min,
+                "max_us": self.interval_max,
+                # interval / nominal interval
+                "histogram": {f"{lo}-{hi}": int(count) for lo, hi, count in zip(edges, edges[1:], self.interval_counts)},
+            },
+            "dropped_samples": self.dropped_samples,
+            "dropped_fraction": self.dropped_samples / expected if expected else 0.0,
+            "late_samples": self.late_samples,
+            "late_fraction": self.late_samples / self.n_samples if self.n_samples else 0.0,
+            "max_latency_us": self.max_latency_us,
+            "callback_us": {(f"<{2 ** k}" if k < CALLBACK_BINS - 1 else f">={2 ** (k - 1)}"): count
+                            for k, count in enumerate(self.callback_counts) if count},
+            "queue_depth": {"last": self.queue_depth, "max": self.max_queue_depth},
+        }
+
+    def save(self, path):
+        # Written to a temporary file and renamed, a killed recorder leaves the previous summary
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+        os.replace(temporary_path, path)
+
+
+def telemetry_path(em_data_path):
+    return recording_stem(em_data_path) + ".telemetry.json"
+
+
+def load_telemetry(em_data_path):
+    path = telemetry_path(em_data_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def capture_warnings(summary):
+    warnings = []
+    if summary["dropped_fraction"] > MAX_DROPPED_FRACTION:
+        warnings.append(f"{summary['dropped_samples']} dropped samples ({summary['dropped_fraction']:.1%})")
+    if summary["late_fraction"] > MAX_LATE_FRACTION:
+        warnings.append(f"{summary['late_samples']} samples reached the recorder more than {LATE_US / 1000:g} ms late "
+                        f"({summary['late_fraction']:.1%})")
+    if summary["measured_rate"] is not None and \
+            abs(summary["measured_rate"] - summary["nominal_rate"]) > MAX_RATE_ERROR * summary["nominal_rate"]:
+        warnings.append(f"{summary['measured_rate']:.1f} Hz recorded, {summary['nominal_rate']:g} Hz nominal")
+    if summary["queue_depth"]["max"] > MAX_QUEUE_SECONDS * summary["nominal_rate"]:
+        warnings.append(f"up to {summary['queue_depth']['max']} samples waiting for the writer")
+    return warnings
+
+
+def check_capture(em_data_path, em_data=None):
+    """
+    Warnings about the capture of a session, from the telemetry sidecar of the recording,
+    else from the system_time_stamp column of em_data. Recordings with neither are not checked.
+    """
+    summary = load_telemetry(em_data_path)
+    if summary is None:
+        if em_data is None or "system_time_stamp" not in em_data.columns:
+            return []
+        telemetry = CaptureTelemetry(session_sampling_rate(em_data))
+        telemetry.add_batch(em_data["system_time_stamp"].to_numpy(dtype=np.int64))
+        summary = telemetry.summary()
+    return capture_warnings(summary)
@@ -0,0 +1,94 @@
+"""
+Registry of the fixation classifiers run by EyeMovement (OOP_preprocess_sart.py / OOP_preprocess_img.py).
+
+Every classifier is called with a GazeSession and its parameters, and returns (states, centroid_x, centroid_y, has_centroid).
+EyeMovement writes them to the {name}_state and {name}_fixation_centroid_x / _y columns.
+The velocities and window dispersions are computed once per session by GazeSession and shared by all the classifiers.
+
+The parameters are the EyeMovement class constants starting with {name}_, lower-cased without the prefix,
+durations (*_MS) are converted to frames, e.g. IDT_WINDOW_SIZE_MS -> window_size.
+To add a classifier, register it here, add its constants to EyeMovement and its name to EyeMovement.FIXATION_CLASSIFIERS.
+"""
+
+import gaze_kernels
+
+CLASSIFIERS = {}
+# Classifiers that depend on the whole session (AIVT: thresholds from its displacement histogram), the others only on
+# the samples around each one, so segment_cache.py runs them while the session is recorded
+SESSION_CLASSIFIERS = ('AIVT',)
+
+
+def register(name):
+    def decorator(classify):
+        CLASSIFIERS[name] = classify
+        return classify
+    return decorator
+
+
+class GazeSession:
+    """
+    Gaze points of the eye in use (interpolated, NaN where missing) and blink codes of a session or streaming segment.
+    displacement_histogram is the histogram of the recorded (not interpolated) displacements of the whole session,
+    used by the adaptive classifier, when None it is built from x and y.
+    """
+    def __init__(self, x, y, blink, sampling_rate, screen_size_w, screen_size_h, screen_to_eye_dist,
+                 displacement_histogram=None):
+        self.x = x
+        self.y = y
+        self.blink = blink
+        self.sampling_rate = sampling_rate
+        self.screen_size_w = screen_size_w
+        self.screen_size_h = screen_size_h
+        self.screen_to_eye_dist = screen_to_eye_dist
+        self._displacement_histogram = displacement_histogram
+        self._velocity = None
+        self._dispersion = {}
+
+    @property
+    def velocity(self):
+        # degree per second from every sample to the next one
+        if self._velocity is None:
+            self._velocity = gaze_kernels.displacements(
+                self.x, self.y, self.screen_size_w, self.screen_size_h, self.screen_to_eye_dist) * self.sampling_rate
+        return self._velocity
+
+    @property
+    def displacement_histogram(self):
+        if self._displacement_histogram is None:
+            self._displacement_histogram = gaze_kernels.displacement_histogram(self.velocity / self.sampling_rate)
+        return self._displacement_histogram
+
+    def dispersion(self, window_size):
+        if window_size not in self._dispersion:
+            self._dispersion[window_size] = gaze_kernels.window_dispersion(self.x, self.y, window_size)
+        return self._dispersion[window_size]
+
+
+@register('IVT')
+def classify_ivt(session, saccade_threshold, fixation_threshold):
+    return gaze_kernels.ivt(session.x, session.y, session.blink, session.velocity, saccade_threshold, fixation_threshold)
+
+
+@register('IDT')
+def classify_idt(session, dispersion_threshold, window_size, fixation_threshold):
+    return gaze_kernels.idt(
+        session.x, session.y, session.blink, session.dispersion(window_size),
+        window_size=window_size,
+        dispersion_threshold=dispersion_threshold,
+        fixation_threshold=fixation_threshold,
+        screen_to_eye_dist=session.screen_to_eye_dist,
+    )
+
+
+@register('IVVT')
+def classify_ivvt(session, saccade_threshold, pursuit_threshold, fixation_threshold):
+    return gaze_kernels.ivvt(session.x, session.y, session.blink, session.velocity,
+                             saccade_threshold, pursuit_threshold, fixation_threshold)
+
+
+@register('AIVT')
+def classify_aivt(session, initial_threshold, peak_sd, onset_sd, convergence, fixation_threshold):
+    peak_threshold, onset_threshold = gaze_kernels.adaptive_velocity_threshold(
+        session.displacement_histogram, session.sampling_rate, initial_threshold, peak_sd, onset_sd, convergence)
+    return gaze_kernels.aivt(session.x, session.y, session.blink, session.velocity,
+                             peak_threshold, onset_threshold, fixation_threshold)
@@ -0,0 +1,371 @@
+"""
+Vectorized eye-movement kernels shared by the SART and FreeViewing preprocessing.
+
+Every function works on whole-session NumPy arrays instead of walking the dataframe row by row.
+Gaze coordinates are float arrays with NaN for missing samples, and eye states are int8 codes
+(see STATE_LABELS) so that run-length and masking operations stay in NumPy.
+"""
+
+import numpy as np
+
+# Eye state codes, STATE_LABELS[code] gives the label written to the csv
+UNLABELLED = 0
+FIXATION = 1
+SACCADE = 2
+BLINK = 3
+ERROR = 4
+SMOOTH_PURSUIT = 5
+STATE_LABELS = np.array([None, 'Fixation', 'Saccade', 'Blink', 'Error', 'SmoothPursuit'], dtype=object)
+STATE_CODES = {label: code for code, label in enumerate(STATE_LABELS) if label is not None}
+
+
+def encode_states(labels):
+    # ['Blink', None, 'Error', ...] -> int8 codes
+    labels = np.asarray(labels, dtype=object)
+    codes = np.zeros(len(labels), dtype=np.int8)
+    for label, code in STATE_CODES.items():
+        codes[labels == label] = code
+    return codes
+
+
+def decode_states(codes):
+    return STATE_LABELS[codes]
+
+
+def true_runs(mask):
+    """
+    Return the (start, end) indices of every run of consecutive True values, end is exclusive.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends
+
+
+def run_rows(starts, ends):
+    # Row indices covered by the runs, concatenated
+    lengths = ends - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+def segment_sums(values, starts, ends):
+    """
+    Sum values[start:end] for every segment.
+    Segments of the same length are gathered into one 2-D block and summed along the rows, so each
+    sum uses NumPy's pairwise summation exactly like Series.mean() did and the centroids stay bit-identical.
+    """
+    sums = np.zeros(len(starts), dtype=np.float64)
+    lengths = ends - starts
+    for length in np.unique(lengths):
+        segment = np.flatnonzero(lengths == length)
+        rows = starts[segment][:, None] + np.arange(length)
+        sums[segment] = values[rows].sum(axis=1)
+    return sums
+
+
+def gap_table(validity, max_interpolated_gap, blink_threshold):
+    """
+    Run-length encode the missing samples (validity == 0) once.
+    Return (starts, ends, codes), one entry per gap, end is exclusive:
+    gaps of at most max_interpolated_gap samples with a valid point on both sides are UNLABELLED (to be interpolated),
+    the other gaps are BLINK if they last at least blink_threshold samples and ERROR otherwise.
+    """
+    validity = np.asarray(validity)
+    starts, ends = true_runs(validity == 0)
+    lengths = ends - starts
+    codes = np.where(lengths >= blink_threshold, BLINK, ERROR).astype(np.int8)
+    interpolated = (lengths <= max_interpolated_gap) & (starts > 0) & (ends < len(validity))
+    codes[interpolated] = UNLABELLED
+    return starts, ends, codes
+
+
+def interpolate_gaps(values, starts, ends):
+    # Linear interpolation, in place, between the valid points at start - 1 and end of every gap
+    lengths = ends - starts
+    rows = run_rows(starts, ends)
+    gap_start = np.repeat(starts, lengths)
+    gap_end = np.repeat(ends, lengths)
+    alpha = (rows - gap_start + 1) / (gap_end - gap_start + 1)
+    before, after = values[gap_start - 1], values[gap_end]
+    values[rows] = before + alpha * (after - before)
+
+
+def gap_states(n, starts, ends, codes):
+    # Per-sample codes of the gap table, UNLABELLED outside the gaps
+    states = np.zeros(n, dtype=np.int8)
+    states[run_rows(starts, ends)] = np.repeat(codes, ends - starts)
+    return states
+
+
+def window_gaps(starts, ends, lo, hi):
+    # Lengths of the gaps clipped to the window [lo, hi), only the gaps overlapping the window
+    lengths = np.minimum(ends, hi) - np.maximum(starts, lo)
+    return lengths[lengths > 0]
+
+
+def cut_gaps(validity, x, y, min_length):
+    """
+    Return the (start, end) of the gaps (validity == 0) lasting at least min_length samples, where every gaze point
+    is missing and which are followed by a valid sample.
+    With min_length >= 2 * IDT window size - 1 the gap is a Blink, and blink detection, I-VT and I-DT give the same
+    result on both sides whether the session is classified as a whole or split inside the gap.
+    """
+    validity = np.asarray(validity)
+    starts, ends = true_runs(validity == 0)
+    missing = np.concatenate(([0], np.cumsum(np.isnan(x) | np.isnan(y))))
+    keep = (ends < len(validity)) & (ends - starts >= min_length) & (missing[ends] - missing[starts] == ends - starts)
+    return starts[keep], ends[keep]
+
+
+def visual_angle(x1, y1, x2, y2, screen_size_w, screen_size_h, screen_to_eye_dist):
+    """
+    Visual angle in degrees between two arrays of normalized display-area points.
+    """
+    dx = x2 * screen_size_w - x1 * screen_size_w
+    dy = y2 * screen_size_h - y1 * screen_size_h
+    d = np.sqrt(dx ** 2 + dy ** 2)
+    return np.rad2deg(np.arctan(d / screen_to_eye_dist))
+
+
+def fixation_centroids(states, x, y, min_frames):
+    """
+    Compute the centroid of every run of Fixation samples lasting at least min_frames.
+    Shorter runs are relabelled as Error in place.
+    Return (centroid_x, centroid_y, has_centroid), centroids are NaN where has_centroid is False.
+    """
+    starts, ends = true_runs(states == FIXATION)
+    lengths = ends - starts
+    long_run = lengths >= min_frames
+
+    # Fixation is too short, it is an error state
+    states[run_rows(starts[~long_run], ends[~long_run])] = ERROR
+
+    starts, ends = starts[long_run], ends[long_run]
+    valid = ~(np.isnan(x) | np.isnan(y))
+    # Missing points are skipped in the mean, same as pandas
+    counts = segment_sums(valid.astype(np.float64), starts, ends)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_center = segment_sums(np.where(valid, x, 0.0), starts, ends) / counts
+        y_center = segment_sums(np.where(valid, y, 0.0), starts, ends) / counts
+
+    n = len(states)
+    has_centroid = np.zeros(n, dtype=bool)
+    centroid_x = np.full(n, np.nan)
+    centroid_y = np.full(n, np.nan)
+    run_index = np.repeat(np.arange(len(starts)), ends - starts)
+    rows = run_rows(starts, ends)
+    has_centroid[rows] = True
+    centroid_x[rows] = x_center[run_index]
+    centroid_y[rows] = y_center[run_index]
+    return centroid_x, centroid_y, has_centroid
+
+
+def bridge_saccade_errors(states):
+    # For 3 consecutive eye states, change [Saccade, Error, Saccade] to [Saccade, Saccade, Saccade]
+    if len(states) < 3:
+        return
+    bridge = (states[:-2] == SACCADE) & (states[1:-1] == ERROR) & (states[2:] == SACCADE)
+    states[1:-1][bridge] = SACCADE
+
+
+def displacements(x, y, screen_size_w, screen_size_h, screen_to_eye_dist):
+    # Visual angle in degrees from every sample to the next one, NaN where either point is missing, length n - 1
+    return visual_angle(x[:-1], y[:-1], x[1:], y[1:], screen_size_w, screen_size_h, screen_to_eye_dist)
+
+
+def velocity_states(x, y, blink, saccade, fixation_threshold, pursuit=None):
+    """
+    Label every sample from the velocity to the next sample, shared by the velocity-based classifiers.
+    blink holds the codes from the blink detection (Blink / Error / UNLABELLED).
+    saccade (and pursuit) are masks over the n - 1 velocities, the remaining samples are fixations.
+    identify saccade -> identify fixation -> compute center point -> add error state -> bridge [Saccade, Error, Saccade]
+    Return (states, centroid_x, centroid_y, has_centroid).
+    """
+    states = blink.copy()
+    unlabelled = states[:-1] == UNLABELLED
+    states[:-1][unlabelled & saccade] = SACCADE
+    if pursuit is not None:
+        states[:-1][unlabelled & pursuit & ~saccade] = SMOOTH_PURSUIT
+    states[states == UNLABELLED] = FIXATION
+
+    centroid_x, centroid_y, has_centroid = fixation_centroids(states, x, y, fixation_threshold)
+    bridge_saccade_errors(states)
+    return states, centroid_x, centroid_y, has_centroid
+
+
+def ivt(x, y, blink, velocity, saccade_threshold, fixation_threshold):
+    """
+    I-VT over a whole session, velocity in degree per second (displacements * sampling rate).
+    A sample is a saccade if the velocity to the next sample is at least saccade_threshold.
+    """
+    # NaN velocities (missing points) never pass the threshold
+    with np.errstate(invalid='ignore'):
+        saccade = velocity >= saccade_threshold
+    return velocity_states(x, y, blink, saccade, fixation_threshold)
+
+
+def ivvt(x, y, blink, velocity, saccade_threshold, pursuit_threshold, fixation_threshold):
+    """
+    I-VVT over a whole session: saccade from saccade_threshold, smooth pursuit from pursuit_threshold
+    up to saccade_threshold, fixation below pursuit_threshold.
+    """
+    with np.errstate(invalid='ignore'):
+        saccade = velocity >= saccade_threshold
+        pursuit = velocity >= pursuit_threshold
+    return velocity_states(x, y, blink, saccade, fixation_threshold, pursuit=pursuit)
+
+
+def aivt(x, y, blink, velocity, peak_threshold, onset_threshold, fixation_threshold):
+    """
+    I-VT with adaptive thresholds (see adaptive_velocity_threshold) over a whole session.
+    A saccade is a run of velocities of at least onset_threshold that reaches peak_threshold,
+    runs that never reach the peak are noise and stay fixations.
+    """
+    with np.errstate(invalid='ignore'):
+        starts, ends = true_runs(velocity >= onset_threshold)
+        peaks = np.concatenate(([0], np.cumsum(velocity >= peak_threshold)))
+    peaked = peaks[ends] - peaks[starts] > 0
+    saccade = np.zeros(len(velocity), dtype=bool)
+    saccade[run_rows(starts[peaked], ends[peaked])] = True
+    return velocity_states(x, y, blink, saccade, fixation_threshold)
+
+
+# Log-spaced bins of the displacement histogram, in degrees
+HISTOGRAM_MIN = 1e-6
+HISTOGRAM_BINS_PER_DECADE = 1000
+HISTOGRAM_BINS = 9 * HISTOGRAM_BINS_PER_DECADE
+
+
+def displacement_histogram(angles):
+    """
+    Counts of the sample-to-sample displacements (visual angle, degrees) in log-spaced bins, missing points skipped.
+    Integer counts add up exactly, so the histogram of a session is the same whether it is built at once or chunk by chunk.
+    """
+    angles = angles[~np.isnan(angles)]
+    with np.errstate(divide='ignore'):
+        bins = np.floor(np.log10(np.maximum(angles, HISTOGRAM_MIN) / HISTOGRAM_MIN) * HISTOGRAM_BINS_PER_DECADE)
+    bins = np.minimum(bins, HISTOGRAM_BINS - 1).astype(np.int64)
+    return np.bincount(bins, minlength=HISTOGRAM_BINS)
+
+
+def adaptive_velocity_threshold(histogram, sampling_rate, initial_threshold, peak_sd, onset_sd, convergence,
+                                max_iterations=100):
+    """
+    Noise-based velocity thresholds (Nystrom & Holmqvist 2010), degree per second.
+    Starting from initial_threshold, the peak threshold is set to mean + peak_sd * sd of the velocities below it
+    until it moves by less than convergence. The onset threshold is mean + onset_sd * sd of the same velocities.
+    Return (peak_threshold, onset_threshold).
+    """
+    centers = HISTOGRAM_MIN * 10 ** ((np.arange(HISTOGRAM_BINS) + 0.5) / HISTOGRAM_BINS_PER_DECADE) * sampling_rate
+    peak_threshold, onset_threshold = initial_threshold, initial_threshold
+    for _ in range(max_iterations):
+        below = centers < peak_threshold
+        count = histogram[below].sum()
+        if count == 0:
+            break
+        mean = (histogram[below] * centers[below]).sum() / count
+        sd = np.sqrt((histogram[below] * (centers[below] - mean) ** 2).sum() / count)
+        new_threshold = mean + peak_sd * sd
+        onset_threshold = mean + onset_sd * sd
+        converged = abs(new_threshold - peak_threshold) < convergence
+        peak_threshold = new_threshold
+        if converged:
+            break
+    return float(peak_threshold), float(onset_threshold)
+
+
+def window_reduce(values, window_size, op):
+    """
+    op (np.fmax or np.fmin) over every window values[i:i + window_size], NaN are skipped.
+    Runs of 1, 2, 4, ... samples are combined by doubling, then every window is covered by two overlapping runs,
+    which is O(n log window_size) instead of O(n * window_size) for the rolling view at high sampling rates.
+    """
+    n_windows = len(values) - window_size + 1
+    reduced = values
+    span = 1
+    while span * 2 <= window_size:
+        reduced = op(reduced[:len(reduced) - span], reduced[span:])
+        span *= 2
+    # reduced[i] = op over values[i:i + span]
+    return op(reduced[:n_windows], reduced[window_size - span:window_size - span + n_windows])
+
+
+def window_dispersion(x, y, window_size):
+    # x_max - x_min + y_max - y_min of every window [i, i + window_size), NaN for a window without a valid point
+    if len(x) < window_size:
+        return np.empty(0)
+    return (window_reduce(x, window_size, np.fmax) - window_reduce(x, window_size, np.fmin)) \
+        + (window_reduce(y, window_size, np.fmax) - window_reduce(y, window_size, np.fmin))
+
+
+def _grow_window(x, y, l, r, dispersion_threshold, screen_to_eye_dist, chunk):
+    """
+    Grow the fixation window [l, r) one point at a time until the dispersion exceeds the threshold,
+    a missing point is met or the session ends, and return the new exclusive end.
+    Running extrema are carried over chunks of growing size with fmin/fmax.accumulate.
+    """
+    n = len(x)
+    x_min, x_max = np.fmin.reduce(x[l:r]), np.fmax.reduce(x[l:r])
+    y_min, y_max = np.fmin.reduce(y[l:r]), np.fmax.reduce(y[l:r])
+    # NOTE: the first point read is r + 1, the point at r is only covered by the fixation label
+    pos = r + 1
+    while pos < n:
+        end = min(n, pos + chunk)
+        seg_x, seg_y = x[pos:end], y[pos:end]
+        run_x_min = np.fmin(x_min, np.fmin.accumulate(seg_x))
+        run_x_max = np.fmax(x_max, np.fmax.accumulate(seg_x))
+        run_y_min = np.fmin(y_min, np.fmin.accumulate(seg_y))
+        run_y_max = np.fmax(y_max, np.fmax.accumulate(seg_y))
+        dispersion = (run_x_max - run_x_min) + (run_y_max - run_y_min)
+        with np.errstate(invalid='ignore'):
+            within = np.arctan(dispersion / screen_to_eye_dist) <= dispersion_threshold
+        stop = np.flatnonzero(np.isnan(seg_x) | np.isnan(seg_y) | ~within)
+        if len(stop):
+            return pos + stop[0]
+        x_min, x_max, y_min, y_max = run_x_min[-1], run_x_max[-1], run_y_min[-1], run_y_max[-1]
+        pos = end
+        chunk *= 2
+    return max(r, n - 1)
+
+
+def idt(x, y, blink, dispersion, window_size, dispersion_threshold, fixation_threshold, screen_to_eye_dist):
+    """
+    I-DT over a whole session.
+    Dispersion = x_max - x_min + y_max - y_min, compared as arctan(dispersion / screen_to_eye_dist) to the threshold.
+    dispersion holds window_dispersion(x, y, window_size) for every window position, so the scan only stops
+    at window positions that start a fixation and then grows that fixation with running extrema.
+    identify fixation -> identify saccade -> compute center point -> add error state
+    Return (states, centroid_x, centroid_y, has_centroid).
+    """
+    n = len(x)
+    states = blink.copy()
+    fixation = np.zeros(n, dtype=bool)
+
+    last_start = n - window_size - 1
+    if last_start >= 0:
+        # Missing points are skipped by fmin/fmax, a window with no valid point has NaN dispersion
+        with np.errstate(invalid='ignore'):
+            ok = np.arctan(dispersion[:last_start + 1] / screen_to_eye_dist) <= dispersion_threshold
+        ok_starts = np.flatnonzero(ok)
+
+        l = 0
+        while True:
+            # slide the window to the next position whose dispersion is within the threshold
+            k = np.searchsorted(ok_starts, l)
+            if k == len(ok_starts):
+                break
+            l = ok_starts[k]
+            r = _grow_window(x, y, l, l + window_size, dispersion_threshold, screen_to_eye_dist, 4 * window_size)
+            fixation[l:r] = True
+            l = r
+            if l > last_start:
+                break
+
+    # DO NOT overwrite the state if it is already identified as Blink
+    states[fixation & (states == UNLABELLED)] = FIXATION
+    states[states == UNLABELLED] = SACCADE
+
+    centroid_x, centroid_y, has_centroid = fixation_centroids(states, x, y, fixation_threshold)
+    return states, centroid_x, centroid_y, has_centroid
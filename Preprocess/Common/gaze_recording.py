@@ -0,0 +1,174 @@
+"""
+Binary recording format of TobiiRecorder.py (.gaze) and its converter to the em csv.
+
+A .gaze file is a 4096-byte header followed by fixed-size records (RECORD_DTYPE, one per gaze sample).
+The recorder maps the file in memory, appends the records and grows the file GROW_RECORDS at a time.
+Every flush it commits: the records are flushed to the file, then the record count in the header.
+Readers only trust the committed count, so a recorder killed by taskkill /F (run.bat) leaves a valid file
+that loses at most the samples of its last flush interval, and never a half-written row.
+
+Gaze points and pupil diameters are float32 like Tobii reports them, so the csv written by recording_to_csv
+is the same as the one TobiiRecorder used to write.
+
+Usage:
+    python Preprocess/Common/gaze_recording.py ./Data_Collection/SART/Raw/S001/em
+"""
+
+import os
+import mmap
+import argparse
+import numpy as np
+import pandas as pd
+
+# Columns of the em csv, in order
+GAZE_COLUMNS = [
+    "device_time_stamp", "system_time_stamp",
+    "left_gaze_point_on_display_area", "left_gaze_point_validity",
+    "right_gaze_point_on_display_area", "right_gaze_point_validity",
+    "left_pupil_diameter", "left_pupil_validity",
+    "right_pupil_diameter", "right_pupil_validity",
+]
+RECORD_DTYPE = np.dtype([
+    ("device_time_stamp", "<i8"), ("system_time_stamp", "<i8"),
+    ("left_gaze_point_x", "<f4"), ("left_gaze_point_y", "<f4"), ("left_gaze_point_validity", "i1"),
+    ("right_gaze_point_x", "<f4"), ("right_gaze_point_y", "<f4"), ("right_gaze_point_validity", "i1"),
+    ("left_pupil_diameter", "<f4"), ("left_pupil_validity", "i1"),
+    ("right_pupil_diameter", "<f4"), ("right_pupil_validity", "i1"),
+])
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("record_size", "<u4"), ("n_records", "<u8")])
+HEADER_SIZE = 4096  # one page, the records start page-aligned
+MAGIC = b"MWGAZE01"
+VERSION = 1
+GROW_RECORDS = 1 << 16  # about 9 minutes at 120 Hz
+
+
+def gaze_records(samples):
+    # Gaze data dicts of the Tobii SDK -> RECORD_DTYPE array
+    records = np.empty(len(samples), dtype=RECORD_DTYPE)
+    for column in ("device_time_stamp", "system_time_stamp", "left_gaze_point_validity", "right_gaze_point_validity",
+                   "left_pupil_diameter", "left_pupil_validity", "right_pupil_diameter", "right_pupil_validity"):
+        records[column] = [sample[column] for sample in samples]
+    for eye in ("left", "right"):
+        points = np.array([sample[f"{eye}_gaze_point_on_display_area"] for sample in samples], dtype=np.float64)
+        records[f"{eye}_gaze_point_x"] = points[:, 0]
+        records[f"{eye}_gaze_point_y"] = points[:, 1]
+    return records
+
+
+class RecordingWriter:
+    """
+    Append-only writer of a new .gaze file.
+    append() copies the records into the mapped file, commit() makes them visible to the readers.
+    """
+    def __init__(self, path, grow_records=GROW_RECORDS):
+        self.path = path
+        self.grow_records = grow_records
+        self.file = open(path, "xb+")
+        self.mmap = None
+        self.n_records = 0
+        self._map(grow_records)
+        self.header["magic"] = MAGIC
+        self.header["version"] = VERSION
+        self.header["record_size"] = RECORD_DTYPE.itemsize
+        self.commit()
+
+    def _map(self, capacity):
+        # The file can only be resized while it is not mapped (Windows)
+        self._unmap()
+        self.file.truncate(HEADER_SIZE + capacity * RECORD_DTYPE.itemsize)
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.mmap)
+        self.records = np.ndarray((capacity,), dtype=RECORD_DTYPE, buffer=self.mmap, offset=HEADER_SIZE)
+
+    def _unmap(self):
+        if self.mmap is not None:
+            # numpy views keep the mmap buffer exported, release them before closing it
+            del self.header, self.records
+            self.mmap.close()
+            self.mmap = None
+
+    def append(self, records):
+        end = self.n_records + len(records)
+        if end > len(self.records):
+            self._map(max(end, len(self.records) + self.grow_records))
+        self.records[self.n_records:end] = records
+        self.n_records = end
+
+    def commit(self):
+        # Records first, then the count that makes them visible
+        self.mmap.flush()
+        self.header["n_records"] = self.n_records
+        self.mmap.flush(0, HEADER_SIZE)
+
+    def close(self):
+        if self.mmap is None:
+            return
+        self.commit()
+        self._unmap()
+        self.file.truncate(HEADER_SIZE + self.n_records * RECORD_DTYPE.itemsize)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_recording(path):
+    # Committed records of a .gaze file
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]["magic"] != MAGIC:
+        raise ValueError(f"{path} is not a .gaze recording")
+    if header[0]["record_size"] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path}: records of {header[0]['record_size']} bytes, expected {RECORD_DTYPE.itemsize}")
+    return np.fromfile(path, dtype=RECORD_DTYPE, count=int(header[0]["n_records"]), offset=HEADER_SIZE)
+
+
+def format_points(x, y):
+    # "(x, y)" strings of the csv, the float32 values printed as the Python floats the SDK returns
+    return [f"({a}, {b})" for a, b in zip(x.astype(np.float64).tolist(), y.astype(np.float64).tolist())]
+
+
+def recording_frame(records, columns=None):
+    # em csv dataframe (GAZE_COLUMNS, or the ones of columns) of the records
+    columns = [column for column in GAZE_COLUMNS if columns is None or column in columns]
+    data = {}
+    for column in columns:
+        if column.endswith("_gaze_point_on_display_area"):
+            eye = column.split("_")[0]
+            data[column] = format_points(records[f"{eye}_gaze_point_x"], records[f"{eye}_gaze_point_y"])
+        elif column.endswith("_validity"):
+            data[column] = records[column].astype(np.int64)
+        else:
+            data[column] = records[column].astype(np.float64 if records[column].dtype.kind == "f" else np.int64)
+    return pd.DataFrame(data, columns=columns)
+
+
+def csv_path_of(path):
+    return os.path.splitext(path)[0] + ".csv"
+
+
+def recording_to_csv(path, csv_path=None):
+    csv_path = csv_path or csv_path_of(path)
+    recording_frame(read_recording(path)).to_csv(csv_path, index=False, lineterminator="\n")
+    return csv_path
+
+
+def convert_recordings(em_dir):
+    # Write the csv of every .gaze recording of em_dir that has none yet, return the csv paths
+    converted = []
+    for file_name in sorted(os.listdir(em_dir)):
+        path = os.path.join(em_dir, file_name)
+        if file_name.endswith(".gaze") and not os.path.exists(csv_path_of(path)):
+            converted.append(recording_to_csv(path))
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help=".gaze recordings, or em directories to convert")
+    args = parser.parse_args()
+    for path in args.paths:
+        for csv_path in convert_recordings(path) if os.path.isdir(path) else [recording_to_csv(path)]:
+            print(f"Converted {csv_path}")
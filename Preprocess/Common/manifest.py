@@ -0,0 +1,82 @@
+"""
+Manifest of the preprocessed session files, saved as .manifest.json next to them in Preprocess/*/Data.
+
+For every output file it records the sha256 of the input files (psychopy csv, em csv) and the processing parameters.
+A session is only processed again when its output is missing, an input changed or the parameters changed.
+The size and modification time of each input are kept too, so an unchanged input is not hashed again.
+"""
+
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class Manifest:
+    def __init__(self, target_file_dir):
+        self.path = os.path.join(target_file_dir, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        # Last recorded description of every input file
+        self._recorded = {}
+        for entry in self.entries.values():
+            for recorded in entry["inputs"].values():
+                self._recorded[recorded["path"]] = recorded
+        self._digests = {}
+
+    def _key(self, target_file_path):
+        return os.path.basename(target_file_path)
+
+    def describe_input(self, path):
+        # {"path", "sha256", "size", "mtime_ns"} of an input file, reusing the recorded hash while size and mtime are unchanged
+        if path in self._digests:
+            return self._digests[path]
+        stat = os.stat(path)
+        description = {"path": path, "sha256": None, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        recorded = self._recorded.get(path)
+        if recorded is not None and recorded["size"] == stat.st_size and recorded["mtime_ns"] == stat.st_mtime_ns:
+            description["sha256"] = recorded["sha256"]
+        else:
+            description["sha256"] = file_digest(path)
+        self._digests[path] = description
+        return description
+
+    def is_current(self, target_file_path, input_paths, params):
+        entry = self.entries.get(self._key(target_file_path))
+        if entry is None or not os.path.exists(target_file_path):
+            return False
+        if entry["params"] != params or set(entry["inputs"]) != {os.path.basename(p) for p in input_paths}:
+            return False
+        for path in input_paths:
+            if entry["inputs"][os.path.basename(path)]["sha256"] != self.describe_input(path)["sha256"]:
+                return False
+        # Same content, keep the new size and mtime so that the file is not hashed again next time
+        entry["inputs"] = {os.path.basename(path): self.describe_input(path) for path in input_paths}
+        return True
+
+    def record(self, target_file_path, input_paths, params):
+        self.entries[self._key(target_file_path)] = {
+            "inputs": {os.path.basename(path): self.describe_input(path) for path in input_paths},
+            "params": params,
+        }
+
+    def forget(self, target_file_path):
+        self.entries.pop(self._key(target_file_path), None)
+
+    def save(self):
+        # Write to a temporary file first so that an interrupted run never leaves a broken manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,292 @@
+"""
+Real-time mind-wandering scoring: the SARTSummary features (Analysis/Summary/SART/Code/create_summary.py) over the last
+window_size seconds of the gaze stream classified by OnlineIVT, scored by a saved model every interval_ms.
+
+RollingFeatures keeps the window: the OnlineIVT events overlapping it and the pupil diameters of its samples.
+Each event does its part of the work when it arrives (saccade amplitude to the previous fixation, expiry of the events
+that left the window), so a score only sums over the events of the window. The window ends at the last classified
+sample, which trails the newest sample by the latency of OnlineIVT.
+
+The features are computed like SARTSummary.create_summary_for_each_stimuli on the same window:
+NumFix, AvgFixDur, NumBlink, ClosedEyeDur, AvgPupDia, VarPupDia, AvgSacAmp, AvgFixDisp, LastFixDur.
+The model is any pickled estimator with predict_proba fit on MODEL_FEATURES, e.g. the StandardScaler +
+RandomForestClassifier pipeline of SART_analysis.ipynb fit on the SART_Summary csv of the same window size (train_model).
+
+ScoringService hands every result to its listeners and to the clients of a local socket, one JSON line per score:
+    {"time_stamp": ..., "end": ..., "features": {...}, "score": 0.42, "delay_us": ..., "seconds": ...}
+time_stamp: system_time_stamp of the last sample of the window, end: number of samples classified,
+features: NaN values (AvgPupDia, VarPupDia without a valid pupil sample) are null on the socket,
+features: null for a value that is NaN (e.g. AvgPupDia without a valid pupil sample) on the socket,
+delay_us: age of the window end when scored, on the clock of the service, seconds: time spent scoring.
+
+Usage:
+    python Preprocess/Common/mw_scoring.py ./Analysis/Summary/SART/Data/SART_Summary_32sec.csv mw_model_32sec.pkl
+"""
+
+import json
+import math
+import time
+import pickle
+import socket
+import argparse
+import threading
+from collections import deque, namedtuple
+import numpy as np
+import pandas as pd
+
+import gaze_kernels
+from online_ivt import OnlineIVT
+
+FEATURES = ["NumFix", "AvgFixDur", "NumBlink", "ClosedEyeDur", "AvgPupDia", "VarPupDia", "AvgSacAmp", "AvgFixDisp",
+            "LastFixDur"]
+# global_features of SART_analysis.ipynb
+MODEL_FEATURES = FEATURES[:8]
+
+# start / end: sample indices, amplitude: visual angle from the centroid of the previous fixation, None for the first one
+Fixation = namedtuple('Fixation', ['start', 'end', 'x', 'y', 'amplitude'])
+
+
+class RollingFeatures:
+    """
+    SARTSummary features of the last window_size seconds (round(window_size * sampling_rate) samples) of classified gaze.
+    add_sample for every sample, add_event for every OnlineIVT event of the same eye.
+    """
+    def __init__(self, window_size, sampling_rate, screen_size_w, screen_size_h, screen_to_eye_dist):
+        self.window_frames = round(window_size * sampling_rate)
+        self.time_per_frame = 1000 / sampling_rate
+        self.screen_size_w = screen_size_w
+        self.screen_size_h = screen_size_h
+        self.screen_to_eye_dist = screen_to_eye_dist
+        self.fixations = deque()
+        self.blinks = deque()
+        self.last_fixation = None
+        # Pupil diameters of the samples from pupil_start on, the newest ones are not classified yet
+        self.pupils = deque()
+        self.pupil_start = 0
+        # End of the last event and system_time_stamp of its last sample
+        self.end = 0
+        self.last_time_stamp = None
+
+    def add_sample(self, pupil_diameter):
+        self.pupils.append(pupil_diameter)
+
+    def add_event(self, event):
+        if event.state == 'Fixation':
+            amplitude = None
+            if self.last_fixation is not None:
+                amplitude = gaze_kernels.visual_angle(self.last_fixation.x, self.last_fixation.y, event.centroid_x,
+                                                      event.centroid_y, self.screen_size_w, self.screen_size_h,
+                                                      self.screen_to_eye_dist)
+            self.last_fixation = Fixation(event.start, event.end, event.centroid_x, event.centroid_y, amplitude)
+            self.fixations.append(self.last_fixation)
+        elif event.state == 'Blink':
+            self.blinks.append((event.start, event.end))
+        self.end = event.end
+        self.last_time_stamp = event.last_time_stamp
+        # Drop what left the window
+        start = self.end - self.window_frames
+        while self.fixations and self.fixations[0].end <= start:
+            self.fixations.popleft()
+        while self.blinks and self.blinks[0][1] <= start:
+            self.blinks.popleft()
+        while self.pupils and self.pupil_start < start:
+            self.pupils.popleft()
+            self.pupil_start += 1
+
+    def features(self):
+        # {feature: value} of the window, None until window_size seconds are classified
+        start = self.end - self.window_frames
+        if start < 0:
+            return None
+        fixations = list(self.fixations)
+        number_of_fixations = len(fixations)
+        # Only the first fixation and blink can start before the window, the window ends with an event
+        fixation_frames = [fixation.end - max(fixation.start, start) for fixation in fixations]
+        blink_frames = sum(end - max(blink_start, start) for blink_start, end in self.blinks)
+        number_of_blinks = len(self.blinks)
+
+        pupils = np.fromiter(self.pupils, dtype=np.float64, count=self.end - self.pupil_start)
+        pupils = pupils[~np.isnan(pupils)]
+        average_pupil_diameter = pupils.mean() if len(pupils) else math.nan
+        variance_pupil_diameter = pupils.var(ddof=1) if len(pupils) > 1 else math.nan
+
+        # Sums in the order of SARTSummary
+        saccade_amplitude = 0
+        if number_of_fixations > 1:
+            for fixation in fixations[1:]:
+                saccade_amplitude += fixation.amplitude
+            saccade_amplitude /= number_of_fixations - 1
+        average_fixation_dispersion = 0
+        if number_of_fixations > 0:
+            x_sum, y_sum = 0, 0
+            for fixation in fixations:
+                x_sum += fixation.x; y_sum += fixation.y
+            x_mean, y_mean = x_sum / number_of_fixations, y_sum / number_of_fixations
+            for fixation in fixations:
+                average_fixation_dispersion += np.sqrt((fixation.x - x_mean) ** 2 + (fixation.y - y_mean) ** 2)
+            average_fixation_dispersion /= number_of_fixations
+
+        return {
+            "NumFix": number_of_fixations,
+            "AvgFixDur": sum(fixation_frames) * self.time_per_frame / number_of_fixations if number_of_fixations > 0 else 0,
+            "NumBlink": number_of_blinks,
+            "ClosedEyeDur": blink_frames * self.time_per_frame / number_of_blinks if number_of_blinks > 0 else 0,
+            "AvgPupDia": float(average_pupil_diameter),
+            "VarPupDia": float(variance_pupil_diameter),
+            "AvgSacAmp": float(saccade_amplitude),
+            "AvgFixDisp": float(average_fixation_dispersion),
+            "LastFixDur": fixation_frames[-1] * self.time_per_frame if fixation_frames else 0,
+        }
+
+
+class ScoringService:
+    """
+    OnlineIVT + RollingFeatures + model, fed by gaze_data_callback and scored every interval_ms by start().
+    parameters: EyeMovement.parameters(), for the I-VT thresholds and the screen geometry.
+    model: estimator with predict_proba (load_model), None to only compute the features.
+    clock: us clock of the system_time_stamp of the samples (tobii_research.get_system_time_stamp), for delay_us.
+    """
+    def __init__(self, parameters, sampling_rate, window_size, model=None, interval_ms=1000, eye='left', clock=None):
+        self.eye = eye
+        self.model = model
+        self.interval_ms = interval_ms
+        self.clock = clock
+        self.features = RollingFeatures(window_size, sampling_rate, parameters['SCREEN_SIZE_W'],
+                                        parameters['SCREEN_SIZE_H'], parameters['SCREEN_TO_EYE_DIST'])
+        self.ivt = OnlineIVT.from_parameters(parameters, sampling_rate, eye, on_event=self.features.add_event)
+        self.model_features = list(getattr(model, 'feature_names_in_', MODEL_FEATURES))
+        # Held by the callback and by score() while it reads the window
+        self.lock = threading.Lock()
+        self.latest = None
+        self.listeners = []
+        self.clients = []
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def gaze_data_callback(self, gaze_data):
+        # Callback of subscribe_to(EYETRACKER_GAZE_DATA, ..., as_dictionary=True)
+        with self.lock:
+            self.features.add_sample(gaze_data[f'{self.eye}_pupil_diameter'])
+            self.ivt.gaze_data_callback(gaze_data)
+
+    def score(self):
+        # Score the current window, hand the result to the listeners and the clients and return it, None before the window is full
+        start = time.perf_counter()
+        with self.lock:
+            features = self.features.features()
+            end, time_stamp = self.features.end, self.features.last_time_stamp
+        if features is None:
+            return None
+        score = None
+        values = [features[name] for name in self.model_features]
+        if self.model is not None and all(np.isfinite(values)):
+            score = float(self.model.predict_proba(pd.DataFrame([values], columns=self.model_features))[0, 1])
+        result = {
+            "time_stamp": int(time_stamp),
+            "end": end,
+            "features": features,
+            "score": score,
+            "delay_us": self.clock() - int(time_stamp) if self.clock is not None else None,
+            "seconds": time.perf_counter() - start,
+        }
+        self.latest = result
+        for listener in self.listeners:
+            listener(result)
+        self._send(result)
+        return result
+
+    def _send(self, result):
+        # NaN / inf are not JSON, a feature without a value (no valid pupil sample) is sent as null
+        features = {name: value if value is None or math.isfinite(value) else None
+                    for name, value in result["features"].items()}
+        line = (json.dumps(dict(result, features=features), allow_nan=False) + "\n").encode()
+        for client in list(self.clients):
+            try:
+                client.sendall(line)
+            except OSError:
+                self.clients.remove(client)
+                client.close()
+
+    def _score_loop(self):
+        # Every interval_ms on the monotonic clock, a slow score delays the next ones but does not shift the schedule
+        interval = self.interval_ms / 1000
+        next_time = time.monotonic() + interval
+        while not self.stop_event.wait(max(next_time - time.monotonic(), 0)):
+            self.score()
+            next_time = max(next_time + interval, time.monotonic())
+
+    def _accept_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            self.clients.append(client)
+
+    def serve(self, port=0, host='127.0.0.1'):
+        # Send every result to the clients connecting to host:port, return the port
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self._start_thread(self._accept_loop)
+        return self.server.getsockname()[1]
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def start(self):
+        self._start_thread(self._score_loop)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server is not None:
+            # shutdown wakes the accept of the other thread
+            try:
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+        for thread in self.threads:
+            thread.join()
+        for client in self.clients:
+            client.close()
+        self.clients = []
+
+
+def load_model(path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def train_model(summary_path, model_path, exclude=(), seed=0):
+    """
+    Fit the StandardScaler + RandomForestClassifier pipeline of SART_analysis.ipynb on MODEL_FEATURES of a SART_Summary csv
+    and pickle it. exclude: participants left out (the blacklist of the notebook).
+    """
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.ensemble import RandomForestClassifier
+
+    df = pd.read_csv(summary_path)
+    df = df[~df['Participant'].isin(exclude)]
+    X = df[MODEL_FEATURES].replace([np.inf, -np.inf], np.nan).dropna()
+    y = df.loc[X.index, 'MW']
+    model = Pipeline([('scaler', StandardScaler()), ('classifier', RandomForestClassifier(random_state=seed))])
+    model.fit(X, y)
+    with open(model_path, 'wb') as file:
+        pickle.dump(model, file)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("summary", help="SART_Summary csv of the window size the service will use")
+    parser.add_argument("model", help="pickle file to write")
+    parser.add_argument("--exclude", nargs="*", default=[], help="participants left out")
+    args = parser.parse_args()
+    model = train_model(args.summary, args.model, args.exclude)
+    print(f"Saved {args.model}, fit on {model.n_features_in_} features")
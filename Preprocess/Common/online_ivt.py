@@ -0,0 +1,269 @@
+"""
+Online I-VT: the I-VT of EyeMovement (gaze_kernels.ivt) run on the gaze samples as they arrive,
+from the gaze_data_callback of the Tobii SDK or of tobii_replay.py.
+
+The steps and thresholds of the offline classifier, sample by sample:
+    gaps        missing samples (validity 0) of the eye in use: interpolated when the gap lasts at most
+                max_interpolated_gap samples between two valid ones, Blink when it lasts at least blink_threshold
+                samples, Error otherwise
+    velocity    Saccade when the velocity to the next sample is at least saccade_threshold, Fixation otherwise
+    fixations   runs of Fixation shorter than fixation_threshold samples are Error, the others get their centroid
+    bridge      [Saccade, Error, Saccade] -> [Saccade, Saccade, Saccade]
+The events are the runs of samples of the same state, emitted when they end, at most
+fixation_threshold + max(blink_threshold, max_interpolated_gap + 1) + 2 samples after their last sample.
+Memory does not grow with the session: only the gap and the fixation in progress are kept, the points of the fixation
+for its centroid, which is summed like the offline one.
+The events of a session are state_events of the offline I-VT of the same samples, centroids included.
+
+The offline classifier uses the eye with the most valid samples of the session, the online one the eye it is given.
+
+Usage, next to the recorder:
+    ivt = OnlineIVT.from_parameters(EyeMovement.parameters(), eyetracker.get_gaze_output_frequency(), on_event=print)
+    eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, ivt.gaze_data_callback, as_dictionary=True)
+"""
+
+from collections import deque, namedtuple
+import numpy as np
+
+import gaze_kernels
+from gaze_kernels import UNLABELLED, FIXATION, SACCADE, BLINK, ERROR, STATE_LABELS
+from session_format import POINT_DTYPE, ms_to_frames
+
+# state: label of gaze_kernels.STATE_LABELS, start / end: sample indices of the session (end exclusive),
+# first / last_time_stamp: system_time_stamp of the first and last samples, centroid: Fixation events only, else None
+GazeEvent = namedtuple('GazeEvent', ['state', 'start', 'end', 'first_time_stamp', 'last_time_stamp',
+                                     'centroid_x', 'centroid_y'])
+
+
+class OnlineIVT:
+    """
+    Thresholds in frames like the classifier parameters of EyeMovement, see from_parameters.
+    eye: 'left' or 'right', the eye classified.
+    on_event: called with every GazeEvent when it ends, on the thread feeding the samples.
+    """
+    def __init__(self, sampling_rate, saccade_threshold, fixation_threshold, blink_threshold, max_interpolated_gap,
+                 screen_size_w, screen_size_h, screen_to_eye_dist, eye='left', on_event=None):
+        self.sampling_rate = sampling_rate
+        self.saccade_threshold = saccade_threshold
+        self.fixation_threshold = fixation_threshold
+        self.blink_threshold = blink_threshold
+        self.max_interpolated_gap = max_interpolated_gap
+        self.screen_size_w = screen_size_w
+        self.screen_size_h = screen_size_h
+        self.screen_to_eye_dist = screen_to_eye_dist
+        self.eye = eye
+        self.on_event = on_event
+        self.n_samples = 0
+        # Gap in progress: its length, its samples while they wait for the end of the gap, Blink once it is known
+        self.gap_length = 0
+        self.gap = []
+        self.gap_state = None
+        # (x, y) of the last valid sample, None before the first one
+        self.last_valid = None
+        # Last sample, labelled by the velocity to the next one
+        self.last = None
+        # Fixation in progress: its points, and its samples until it lasts fixation_threshold samples
+        self.fixation_x = []
+        self.fixation_y = []
+        self.fixation_held = []
+        self.centroids = deque()
+        # Last sample before the bridge and the state of the one before it
+        self.pending = None
+        self.pending_before = None
+        # Event in progress: [state, start, end, first_time_stamp, last_time_stamp]
+        self.event = None
+        self.events = []
+
+    @classmethod
+    def from_parameters(cls, parameters, sampling_rate, eye='left', on_event=None):
+        # parameters: EyeMovement.parameters(), the durations in ms are converted like EyeMovement.set_thresholds
+        return cls(
+            sampling_rate,
+            saccade_threshold=parameters['IVT_SACCADE_THRESHOLD'],
+            fixation_threshold=ms_to_frames(parameters['IVT_FIXATION_THRESHOLD_MS'], sampling_rate),
+            blink_threshold=ms_to_frames(parameters['BLINK_THRESHOLD_MS'], sampling_rate),
+            max_interpolated_gap=ms_to_frames(parameters['MAX_INTERPOLATED_GAP_MS'], sampling_rate, at_least=False),
+            screen_size_w=parameters['SCREEN_SIZE_W'],
+            screen_size_h=parameters['SCREEN_SIZE_H'],
+            screen_to_eye_dist=parameters['SCREEN_TO_EYE_DIST'],
+            eye=eye,
+            on_event=on_event,
+        )
+
+    def gaze_data_callback(self, gaze_data):
+        # Callback of subscribe_to(EYETRACKER_GAZE_DATA, ..., as_dictionary=True)
+        x, y = gaze_data[f'{self.eye}_gaze_point_on_display_area']
+        self.add(gaze_data['system_time_stamp'], gaze_data[f'{self.eye}_gaze_point_validity'], x, y)
+
+    def add(self, time_stamp, validity, x, y):
+        """
+        Classify the next sample. Return the events that ended with it.
+        The points are processed as the float32 values recorded in the em csv, like the offline classifier.
+        """
+        x, y = float(POINT_DTYPE(x)), float(POINT_DTYPE(y))
+        index = self.n_samples
+        self.n_samples += 1
+        if validity == 0:
+            self.gap_length += 1
+            if self.gap_state is not None:
+                self._label(index, time_stamp, x, y, self.gap_state)
+            else:
+                self.gap.append((index, time_stamp, x, y))
+                # Too long to be interpolated (or at the start of the session) and long enough to be a blink
+                interpolated = self.last_valid is not None and self.gap_length <= self.max_interpolated_gap
+                if not interpolated and self.gap_length >= self.blink_threshold:
+                    self.gap_state = BLINK
+                    self._release_gap(BLINK)
+        else:
+            if self.gap_length:
+                self._end_gap((x, y))
+            self._label(index, time_stamp, x, y, UNLABELLED)
+            self.last_valid = (x, y)
+        return self._take_events()
+
+    def finish(self):
+        # End of the session, return the last events. No sample can be added afterwards.
+        if self.gap_length:
+            self._end_gap(None)
+        if self.last is not None:
+            self._velocity(self.last, None)
+            self.last = None
+        if self.fixation_x:
+            self._end_fixation()
+        if self.pending is not None:
+            self._emit(*self.pending)
+            self.pending = None
+        if self.event is not None:
+            self._close_event()
+        return self._take_events()
+
+    def _take_events(self):
+        events, self.events = self.events, []
+        return events
+
+    # gaps
+
+    def _end_gap(self, after):
+        # after: (x, y) of the valid sample ending the gap, None at the end of the session
+        if self.gap_state is None:
+            length = self.gap_length
+            if after is not None and self.last_valid is not None and length <= self.max_interpolated_gap:
+                # Same arithmetic as gaze_kernels.interpolate_gaps
+                (before_x, before_y), (after_x, after_y) = self.last_valid, after
+                for k, (index, time_stamp, _, _) in enumerate(self.gap, 1):
+                    alpha = k / (length + 1)
+                    self._label(index, time_stamp, before_x + alpha * (after_x - before_x),
+                                before_y + alpha * (after_y - before_y), UNLABELLED)
+                self.gap = []
+            else:
+                self._release_gap(BLINK if length >= self.blink_threshold else ERROR)
+        self.gap_length = 0
+        self.gap_state = None
+
+    def _release_gap(self, state):
+        for index, time_stamp, x, y in self.gap:
+            self._label(index, time_stamp, x, y, state)
+        self.gap = []
+
+    # velocity
+
+    def _label(self, index, time_stamp, x, y, state):
+        if self.last is not None:
+            self._velocity(self.last, (x, y))
+        self.last = (index, time_stamp, x, y, state)
+
+    def _velocity(self, sample, next_point):
+        # The last sample of the session has no velocity and stays a fixation
+        index, time_stamp, x, y, state = sample
+        if state == UNLABELLED:
+            state = FIXATION
+            if next_point is not None:
+                angle = gaze_kernels.visual_angle(np.float64(x), np.float64(y), np.float64(next_point[0]),
+                                                  np.float64(next_point[1]), self.screen_size_w, self.screen_size_h,
+                                                  self.screen_to_eye_dist)
+                # NaN velocities (missing points) never pass the threshold
+                if angle * self.sampling_rate >= self.saccade_threshold:
+                    state = SACCADE
+        self._fixation(index, time_stamp, x, y, state)
+
+    # fixations
+
+    def _fixation(self, index, time_stamp, x, y, state):
+        if state != FIXATION:
+            if self.fixation_x:
+                self._end_fixation()
+            self._bridge(index, time_stamp, state)
+            return
+        self.fixation_x.append(x)
+        self.fixation_y.append(y)
+        self.fixation_held.append((index, time_stamp))
+        if len(self.fixation_x) >= self.fixation_threshold:
+            for held_index, held_time_stamp in self.fixation_held:
+                self._bridge(held_index, held_time_stamp, FIXATION)
+            self.fixation_held = []
+
+    def _end_fixation(self):
+        if len(self.fixation_x) < self.fixation_threshold:
+            # Fixation is too short, it is an error state
+            for held_index, held_time_stamp in self.fixation_held:
+                self._bridge(held_index, held_time_stamp, ERROR)
+        else:
+            # Same sums as gaze_kernels.fixation_centroids
+            x, y = np.array(self.fixation_x), np.array(self.fixation_y)
+            valid = ~(np.isnan(x) | np.isnan(y))
+            starts, ends = np.array([0]), np.array([len(x)])
+            counts = gaze_kernels.segment_sums(valid.astype(np.float64), starts, ends)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                x_center = gaze_kernels.segment_sums(np.where(valid, x, 0.0), starts, ends) / counts
+                y_center = gaze_kernels.segment_sums(np.where(valid, y, 0.0), starts, ends) / counts
+            self.centroids.append((float(x_center[0]), float(y_center[0])))
+        self.fixation_x, self.fixation_y, self.fixation_held = [], [], []
+
+    # bridge
+
+    def _bridge(self, index, time_stamp, state):
+        if self.pending is not None:
+            pending_index, pending_time_stamp, pending_state = self.pending
+            final_state = pending_state
+            if pending_state == ERROR and self.pending_before == SACCADE and state == SACCADE:
+                final_state = SACCADE
+            self.pending_before = pending_state
+            self._emit(pending_index, pending_time_stamp, final_state)
+        self.pending = (index, time_stamp, state)
+
+    # events
+
+    def _emit(self, index, time_stamp, state):
+        if self.event is not None and self.event[0] == state:
+            self.event[2] = index + 1
+            self.event[4] = time_stamp
+            return
+        if self.event is not None:
+            self._close_event()
+        self.event = [state, index, index + 1, time_stamp, time_stamp]
+
+    def _close_event(self):
+        state, start, end, first_time_stamp, last_time_stamp = self.event
+        centroid_x, centroid_y = self.centroids.popleft() if state == FIXATION else (None, None)
+        event = GazeEvent(STATE_LABELS[state], start, end, first_time_stamp, last_time_stamp, centroid_x, centroid_y)
+        self.event = None
+        self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+
+
+def state_events(states, centroid_x, centroid_y, time_stamps):
+    """
+    Events of the state codes and centroids of an offline classifier (gaze_kernels), the runs of samples of the same state.
+    time_stamps: system_time_stamp of the samples.
+    """
+    states = np.asarray(states)
+    changes = np.flatnonzero(states[1:] != states[:-1]) + 1
+    starts = np.concatenate(([0], changes)) if len(states) else changes
+    ends = np.concatenate((changes, [len(states)])) if len(states) else changes
+    events = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        state = states[start]
+        centroid = (float(centroid_x[start]), float(centroid_y[start])) if state == FIXATION else (None, None)
+        events.append(GazeEvent(STATE_LABELS[state], start, end, time_stamps[start], time_stamps[end - 1], *centroid))
+    return events
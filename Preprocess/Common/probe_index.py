@@ -0,0 +1,153 @@
+"""
+Probe-segment index of the preprocessed SART sessions, saved as .{session}.probes.json next to the session csv in
+Preprocess/SART/Data (a dotfile, so the scripts listing the sessions skip it).
+
+Every probe is (session, probe, start, end, label, eye_to_use):
+    probe       number of the probe in the experiment, offset * 5 + number in the session (the "Stimuli" of the summary)
+    start, end  rows of the probe in the session, end exclusive
+    label       "Focus" when the answer to the probe is num_4, else "MW"
+The byte offsets of the rows are kept too, so read_probe reads a single probe without parsing the rest of the csv.
+
+The index is written by main_sart.py after the preprocessing. read_probe_index rebuilds it when it is missing or when
+the size or modification time of the csv changed since.
+"""
+
+import io
+import os
+import json
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+PROBE_INDEX_SUFFIX = ".probes.json"
+VERSION = 1
+PROBES_PER_SESSION = 5
+
+Probe = namedtuple('Probe', ['session', 'probe', 'start', 'end', 'label', 'eye_to_use'])
+
+
+def probe_segments(state):
+    """
+    (start, end) rows of every SART probe, end exclusive: a run of rows with a state that follows a row without one.
+    The row after a probe is not checked, so a probe that follows the previous one after a single row without state
+    is skipped, as it always was.
+    """
+    has_state = pd.notna(np.asarray(state, dtype=object))
+    starts = np.flatnonzero(~has_state[:-1] & has_state[1:]) + 1
+    no_state = np.flatnonzero(~has_state)
+    ends = np.append(no_state, len(has_state))[np.searchsorted(no_state, starts)]
+    segments = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if segments and start == segments[-1][1] + 1:
+            continue
+        segments.append((start, end))
+    return segments
+
+
+def session_name(session_path):
+    return os.path.splitext(os.path.basename(session_path))[0]
+
+
+def probe_index_path(session_path):
+    return os.path.join(os.path.dirname(session_path), f".{session_name(session_path)}{PROBE_INDEX_SUFFIX}")
+
+
+def session_offset(session_path):
+    # {participant}_SART_{1..3}.csv, the probes of session n are numbered from (n - 1) * 5 + 1
+    return int(session_name(session_path).split("_")[-1]) - 1
+
+
+def find_probes(session_path, df=None):
+    # Probes of the session csv, or of its DataFrame df (the state and eye_to_use columns are enough)
+    if df is None:
+        df = pd.read_csv(session_path, low_memory=False, usecols=["state", "eye_to_use"])
+    state = df["state"].to_numpy(dtype=object)
+    eye_to_use = df["eye_to_use"].to_numpy(dtype=object)
+    name, offset = session_name(session_path), session_offset(session_path)
+    return [Probe(name, offset * PROBES_PER_SESSION + number, start, end, "Focus" if state[start] == 'num_4' else "MW",
+                  eye_to_use[start])
+            for number, (start, end) in enumerate(probe_segments(state), 1)]
+
+
+def row_offsets(session_path, n_rows):
+    # Byte offset of every row of the csv and of its end, None when the lines are not the rows (quoted line breaks)
+    with open(session_path, "rb") as f:
+        content = np.frombuffer(f.read(), dtype=np.uint8)
+    line_ends = np.flatnonzero(content == ord("\n")) + 1
+    if len(line_ends) and line_ends[-1] != len(content):
+        line_ends = np.append(line_ends, len(content))
+    # The first line is the header, row r starts where line r ends
+    return line_ends if len(line_ends) == n_rows + 1 else None
+
+
+def write_probe_index(session_path, df=None):
+    # Find the probes of the session and save them next to it, return them
+    if df is None:
+        df = pd.read_csv(session_path, low_memory=False, usecols=["state", "eye_to_use"])
+    stat = os.stat(session_path)
+    probes = find_probes(session_path, df)
+    offsets = row_offsets(session_path, len(df))
+    index = {
+        "version": VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "rows": len(df),
+        "header_bytes": int(offsets[0]) if offsets is not None else None,
+        "probes": [dict(probe._asdict(),
+                        start_byte=int(offsets[probe.start]) if offsets is not None else None,
+                        end_byte=int(offsets[probe.end]) if offsets is not None else None)
+                   for probe in probes],
+    }
+    index_path = probe_index_path(session_path)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+    return probes
+
+
+def load_probe_index(session_path):
+    # Saved index of the session, None when it is missing or older than the csv
+    index_path = probe_index_path(session_path)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    stat = os.stat(session_path)
+    if index.get("version") != VERSION or index["size"] != stat.st_size or index["mtime_ns"] != stat.st_mtime_ns:
+        return None
+    return index
+
+
+def read_probe_index(session_path, df=None):
+    # Probes of the session from the saved index, rebuilt (from df when given) when it is missing or stale
+    index = load_probe_index(session_path)
+    if index is None:
+        return write_probe_index(session_path, df)
+    return [Probe(*(probe[field] for field in Probe._fields)) for probe in index["probes"]]
+
+
+def read_probe(session_path, probe, usecols=None):
+    """
+    Rows of a single probe (number in the experiment) as a DataFrame indexed by their row in the session.
+    Reads the header and the bytes of the probe only, KeyError if the session has no such probe.
+    """
+    index = load_probe_index(session_path)
+    if index is None:
+        write_probe_index(session_path)
+        index = load_probe_index(session_path)
+    entry = next((entry for entry in index["probes"] if entry["probe"] == probe), None)
+    if entry is None:
+        raise KeyError(f"{session_name(session_path)} has no probe {probe}")
+    if entry["start_byte"] is None:
+        # Lines and rows differ, the csv has to be parsed up to the probe
+        data = pd.read_csv(session_path, low_memory=False, usecols=usecols, skiprows=range(1, entry["start"] + 1),
+                           nrows=entry["end"] - entry["start"])
+    else:
+        with open(session_path, "rb") as f:
+            header = f.read(index["header_bytes"])
+            f.seek(entry["start_byte"])
+            rows = f.read(entry["end_byte"] - entry["start_byte"])
+        data = pd.read_csv(io.BytesIO(header + rows), low_memory=False, usecols=usecols)
+    data.index = pd.RangeIndex(entry["start"], entry["end"])
+    return data
@@ -0,0 +1,75 @@
+"""
+Fixation centroids -> scanpath in the MultiMatch format, shared by the scanpath scripts of SART and FreeViewing.
+
+The {FIXATION_INDENTIFIER}_x / _y columns of a preprocessed session repeat the centroid of a fixation on every one of
+its samples. A scanpath has one row per run of equal consecutive centroids:
+    start_x, start_y    centroid in pixels
+    duration            length of the run in seconds
+Samples without a centroid (NaN, or None) belong to no run.
+
+The runs are found once with a change-point mask and clipped to each window, so a session is converted in a few NumPy
+operations whatever the number of windows.
+"""
+
+import numpy as np
+import pandas as pd
+
+SCANPATH_COLUMNS = ["start_x", "start_y", "duration"]
+
+
+def centroid_arrays(centroid_x, centroid_y):
+    # float64 arrays of the centroid columns, None -> NaN
+    return np.asarray(centroid_x, dtype=np.float64), np.asarray(centroid_y, dtype=np.float64)
+
+
+def centroid_runs(centroid_x, centroid_y):
+    """
+    (starts, ends) of the runs of equal consecutive centroids, end exclusive.
+    A run starts at every valid centroid that differs from the previous sample; it ends at the next start or missing
+    centroid.
+    """
+    x, y = centroid_arrays(centroid_x, centroid_y)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    new_run = valid.copy()
+    new_run[1:] &= ~(valid[:-1] & (x[1:] == x[:-1]) & (y[1:] == y[:-1]))
+    starts = np.flatnonzero(new_run)
+    # The end of a run is the next break, found by the cumulative count of the breaks at its start
+    is_break = new_run | ~valid
+    ends = np.append(np.flatnonzero(is_break), len(x))[np.cumsum(is_break)[starts]]
+    return starts, ends
+
+
+def window_runs(starts, ends, first, last, drop_last=False):
+    """
+    Runs clipped to the samples [first, last): a run that began before first starts at first.
+    drop_last: the last sample of the window never starts a run, the off-by-one of the original SART loops
+    (`while k < len(fixation_centroid) - 1`), to write the same scanpaths as they did.
+    """
+    starts, ends = np.maximum(starts, first), np.minimum(ends, last)
+    keep = starts < ends
+    if drop_last:
+        keep &= starts < last - 1
+    return starts[keep], ends[keep]
+
+
+def scanpath(centroid_x, centroid_y, sample_rate, screen_width, screen_height, first=0, last=None, runs=None,
+             drop_last=False):
+    """
+    {"start_x", "start_y", "duration"} DataFrame of the samples [first, last) of the centroid arrays.
+    runs: centroid_runs of the same arrays, to share them between windows.
+    """
+    x, y = centroid_arrays(centroid_x, centroid_y)
+    last = len(x) if last is None else last
+    starts, ends = runs if runs is not None else centroid_runs(x, y)
+    starts, ends = window_runs(starts, ends, first, last, drop_last)
+    return pd.DataFrame({
+        "start_x": x[starts] * screen_width,
+        "start_y": y[starts] * screen_height,
+        # duration in seconds
+        "duration": (ends - starts) / sample_rate,
+    }, columns=SCANPATH_COLUMNS)
+
+
+def last_window(n, trunc_frames):
+    # (first, last) of rows[-trunc_frames:], all of them when trunc_frames is 0
+    return (max(n - trunc_frames, 0) if trunc_frames else 0), n
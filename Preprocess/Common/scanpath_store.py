@@ -0,0 +1,205 @@
+"""
+Scanpath store: every scanpath of a Scanpath tree in one file (.scanpaths) instead of one TSV per
+participant x probe x state x window.
+
+A .scanpaths file is a 4096-byte header, the fixations of all the scanpaths concatenated (SCANPATH_DTYPE records,
+the start_x, start_y, duration columns of the TSVs) and the index of the scanpaths (INDEX_DTYPE): the key
+(participant, probe, state, window) and the [start, end) of its fixations. window is the directory of the legacy layout,
+"4" ... "60" for scanpath_for_all, "MultiMatch" or "Reversed" for scanpath_MM / DIFF_scanpath_MM.
+
+ScanpathStore maps the file and returns the scanpaths as read-only recarray views of the map, the records
+np.recfromcsv made of the TSVs, without reading or parsing anything else. export_tsv writes the legacy TSV layout:
+    {output_dir}/{window}/{participant}/{participant}_{probe}_{state}.tsv
+
+Usage:
+    python Preprocess/Common/scanpath_store.py ./Preprocess/SART/Scanpath/windows.scanpaths --tsv ./Preprocess/SART/Scanpath
+"""
+
+import os
+import mmap
+import argparse
+import numpy as np
+import pandas as pd
+
+SCANPATH_DTYPE = np.dtype([("start_x", "<f8"), ("start_y", "<f8"), ("duration", "<f8")])
+INDEX_DTYPE = np.dtype([("participant", "S32"), ("probe", "S64"), ("state", "S8"), ("window", "S16"),
+                        ("start", "<u8"), ("end", "<u8")])
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("record_size", "<u4"), ("n_records", "<u8"),
+                         ("index_size", "<u4"), ("n_scanpaths", "<u8")])
+HEADER_SIZE = 4096
+MAGIC = b"MWSCAN01"
+VERSION = 1
+STORE_SUFFIX = ".scanpaths"
+
+
+def scanpath_key(participant, probe, state, window):
+    # Keys are strings, probe 12 and window 32 are "12" and "32"
+    return str(participant), str(probe), str(state), str(window)
+
+
+class ScanpathWriter:
+    """
+    Collects the scanpaths of a tree and writes the store on close(), to a temporary file renamed over path,
+    so a reader never sees a partial store.
+    windows: the windows written by this run, the scanpaths of the other windows of an existing store at path are
+    kept. None: the store is written anew.
+    """
+    def __init__(self, path, windows=None):
+        self.path = path
+        self.windows = None if windows is None else {str(window) for window in windows}
+        self.keys = []
+        self.added = set()
+        self.scanpaths = []
+
+    def add(self, participant, probe, state, window, data):
+        # data: DataFrame or records with the start_x, start_y, duration columns (scanpath.scanpath)
+        key = scanpath_key(participant, probe, state, window)
+        if key in self.added:
+            raise ValueError(f"scanpath {key} added twice")
+        records = np.empty(len(data), dtype=SCANPATH_DTYPE)
+        for column in SCANPATH_DTYPE.names:
+            records[column] = data[column]
+        self.added.add(key)
+        self.keys.append(key)
+        self.scanpaths.append(records)
+
+    def carry_over(self):
+        # Copy the scanpaths of the windows not written by this run from the existing store
+        if self.windows is None or not os.path.exists(self.path):
+            return
+        with ScanpathStore(self.path) as store:
+            for key in store.keys():
+                if key[3] not in self.windows and key not in self.added:
+                    self.added.add(key)
+                    self.keys.append(key)
+                    self.scanpaths.append(np.array(store.get(*key)))
+
+    def close(self):
+        self.carry_over()
+        records = np.concatenate(self.scanpaths) if self.scanpaths else np.empty(0, dtype=SCANPATH_DTYPE)
+        ends = np.cumsum([len(scanpath) for scanpath in self.scanpaths], dtype=np.uint64)
+        index = np.empty(len(self.keys), dtype=INDEX_DTYPE)
+        for column, values in zip(("participant", "probe", "state", "window"), zip(*self.keys)):
+            encoded = [value.encode() for value in values]
+            too_long = [value for value in encoded if len(value) > INDEX_DTYPE[column].itemsize]
+            if too_long:
+                raise ValueError(f"{column} {too_long[0]!r} longer than {INDEX_DTYPE[column].itemsize} bytes")
+            index[column] = encoded
+        index["start"] = ends - [len(scanpath) for scanpath in self.scanpaths]
+        index["end"] = ends
+        header = np.zeros((), dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["record_size"] = SCANPATH_DTYPE.itemsize
+        header["n_records"] = len(records)
+        header["index_size"] = INDEX_DTYPE.itemsize
+        header["n_scanpaths"] = len(index)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(header.tobytes().ljust(HEADER_SIZE, b"\0"))
+            file.write(records.tobytes())
+            file.write(index.tobytes())
+        os.replace(temporary_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        # Nothing is written when the extraction failed
+        if exc_type is None:
+            self.close()
+
+
+class ScanpathStore:
+    """
+    Read-only map of a .scanpaths file.
+    get(participant, probe, state, window): recarray view of the fixations of a scanpath, KeyError if there is none.
+    keys(...): keys of the scanpaths, in the order they were written, filtered by the fields given.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self.mmap, dtype=HEADER_DTYPE, count=1)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a scanpath store")
+        if header["version"] != VERSION:
+            raise ValueError(f"{path}: version {header['version']} of the store, expected {VERSION}")
+        n_records = int(header["n_records"])
+        self.records = np.frombuffer(self.mmap, dtype=SCANPATH_DTYPE, count=n_records, offset=HEADER_SIZE).view(np.recarray)
+        index = np.frombuffer(self.mmap, dtype=INDEX_DTYPE, count=int(header["n_scanpaths"]),
+                              offset=HEADER_SIZE + n_records * SCANPATH_DTYPE.itemsize)
+        self.index = {}
+        for participant, probe, state, window, start, end in index.tolist():
+            key = (participant.decode(), probe.decode(), state.decode(), window.decode())
+            self.index[key] = (start, end)
+
+    def get(self, participant, probe, state, window):
+        start, end = self.index[scanpath_key(participant, probe, state, window)]
+        return self.records[start:end]
+
+    def keys(self, participant=None, probe=None, state=None, window=None):
+        wanted = [(field, str(value)) for field, value in enumerate((participant, probe, state, window)) if value is not None]
+        return [key for key in self.index if all(key[field] == value for field, value in wanted)]
+
+    def participants(self, window=None):
+        return sorted({key[0] for key in self.keys(window=window)})
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return scanpath_key(*key) in self.index
+
+    def close(self):
+        self.records = None
+        self.index = {}
+        try:
+            self.mmap.close()
+        except BufferError:
+            # Views returned by get() are still alive, the map is released with the last of them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_tsv(path):
+    # Records of a legacy scanpath TSV, what np.recfromcsv returned before NumPy 2.0
+    df = pd.read_csv(path, delimiter="\t", float_precision="round_trip")
+    records = np.empty(len(df), dtype=SCANPATH_DTYPE)
+    for column in SCANPATH_DTYPE.names:
+        records[column] = df[column]
+    return records.view(np.recarray)
+
+
+def read_scanpath(source):
+    # A scanpath given as the path of a TSV or as records (ScanpathStore.get)
+    return read_tsv(source) if isinstance(source, (str, os.PathLike)) else source
+
+
+def export_tsv(store, output_dir):
+    # Write every scanpath of the store in the legacy layout, return the number of files
+    for participant, probe, state, window in store.keys():
+        participant_dir = os.path.join(output_dir, window, participant)
+        os.makedirs(participant_dir, exist_ok=True)
+        data = pd.DataFrame(store.get(participant, probe, state, window), columns=list(SCANPATH_DTYPE.names))
+        data.to_csv(os.path.join(participant_dir, f"{participant}_{probe}_{state}.tsv"), sep="\t", index=False)
+    return len(store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", help=".scanpaths file")
+    parser.add_argument("--tsv", default=None, help="directory to export the legacy TSV layout to")
+    args = parser.parse_args()
+    with ScanpathStore(args.store) as store:
+        if args.tsv:
+            print(f"Exported {export_tsv(store, args.tsv)} scanpaths to {args.tsv}")
+        else:
+            windows = sorted({key[3] for key in store.keys()}, key=lambda window: (not window.isdigit(), window.zfill(16)))
+            print(f"{len(store)} scanpaths, {len(store.records)} fixations, windows {' '.join(windows)}")
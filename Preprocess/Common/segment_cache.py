@@ -0,0 +1,241 @@
+"""
+Classification of a session recorded in segments (segments.py) while it is being recorded.
+
+Sync needs the psychopy csv, written at the end of the session, but the classification of the gaze (gaps,
+interpolation, fixations) needs no psychopy data. SegmentCache.update classifies the segments the recorder has marked
+complete since the last update and saves the result next to the recording, in {stem}.segments/classified/.
+At the end of the session EyeMovement(chunks=ds.synced_segments, cache=SegmentCache(...)) adds the cached columns to
+the synced segments instead of classifying them.
+
+What depends on the whole session is left to the end:
+- the eye in use, the eye with more valid samples: both eyes are classified,
+- the classifiers of classifiers.SESSION_CLASSIFIERS (AIVT, thresholds from the displacement histogram of the session):
+  run at the end on the cached gaze points,
+- the sampling rate, inferred from the timestamps of the index: the cache is started again when it changes, and not
+  used when the rate of the whole session differs from it.
+The session is cut at long missing stretches like EyeMovement.run_streaming, so the output is the same.
+
+Usage, next to TobiiRecorder.py:
+    python Preprocess/SART/Code/main_sart.py --watch 30   (FreeViewing: Preprocess/FreeViewing/Code/main_img.py)
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+import gaze_kernels
+from classifiers import CLASSIFIERS, SESSION_CLASSIFIERS
+from session_format import infer_sampling_rate, split_point_columns, xy_columns, recording_stem
+from segments import read_index, read_segment, segment_paths
+
+CACHE_DIRECTORY = "classified"
+VERSION = 1
+EYES = ('left', 'right')
+
+
+def eye_columns(eye):
+    # Columns of the em data classifying eye needs
+    return [f'{eye}_gaze_point_validity', f'{eye}_gaze_point_on_display_area',
+            *xy_columns(f'{eye}_gaze_point_on_display_area')]
+
+
+class SegmentCache:
+    """
+    Classified columns of a recording in segments. eye_movement_class: the EyeMovement of the task, whose parameters
+    and classification steps are used.
+    """
+    def __init__(self, index_path, eye_movement_class):
+        self.index_path = index_path
+        self.EyeMovement = eye_movement_class
+        self.directory = os.path.join(recording_stem(index_path) + ".segments", CACHE_DIRECTORY)
+        self.state_path = os.path.join(self.directory, "state.json")
+        self.params = eye_movement_class.parameters()
+
+    def exists(self):
+        return os.path.exists(self.state_path)
+
+    def load_state(self):
+        if not self.exists():
+            return None
+        with open(self.state_path) as file:
+            state = json.load(file)
+        return state if state.get("version") == VERSION else None
+
+    def save_state(self, state):
+        temporary_path = self.state_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(state, file, indent=2)
+        os.replace(temporary_path, self.state_path)
+
+    def new_state(self, sampling_rate):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        return {"version": VERSION, "params": self.params, "sampling_rate": sampling_rate, "segments": 0, "rows": 0,
+                "complete": False, "eyes": {eye: {"offset": 0, "context": 0, "files": []} for eye in EYES}}
+
+    def eye_movement(self, eye, sampling_rate):
+        # EyeMovement classifying eye at sampling_rate, the data is handed over piece by piece
+        em = self.EyeMovement(self.index_path, sampling_rate=sampling_rate, chunks=lambda: iter(()))
+        em.set_thresholds()
+        em.decide_eye_to_use(*((1, 0) if eye == 'left' else (0, 1)))
+        return em
+
+    def read_eye(self, path, eye):
+        data = read_segment(path, eye_columns(eye))
+        split_point_columns(data)
+        for column in xy_columns(f'{eye}_gaze_point_on_display_area'):
+            data[column] = data[column].astype(np.float64)
+        return data[[f'{eye}_gaze_point_validity', *xy_columns(f'{eye}_gaze_point_on_display_area')]]
+
+    def read_rows(self, paths, lengths, eye, start, end):
+        # Rows [start, end) of the session, for eye
+        parts = []
+        first = 0
+        for path, length in zip(paths, lengths):
+            if first < end and first + length > start:
+                parts.append(self.read_eye(path, eye).iloc[max(start - first, 0):end - first])
+            first += length
+        return pd.concat(parts, ignore_index=True) if parts else None
+
+    def update(self):
+        """
+        Classify the segments completed since the last update, and the end of the session once the recorder has
+        stopped. Return the number of segments classified.
+        """
+        index = read_index(self.index_path)
+        complete = [segment for segment in index["segments"] if segment["complete"]]
+        if not complete:
+            return 0
+        paths = segment_paths(self.index_path, complete_only=True)
+        lengths = [segment["n_samples"] for segment in complete]
+        sampling_rate = infer_sampling_rate(complete[0]["first_system_time_stamp"],
+                                            complete[-1]["last_system_time_stamp"], sum(lengths))
+        state = self.load_state()
+        if state is None or state["params"] != self.params or state["sampling_rate"] != sampling_rate:
+            state = self.new_state(sampling_rate)
+        if state["complete"]:
+            return 0
+        new = range(state["segments"], len(complete))
+        finished = index["complete"] and len(complete) == len(index["segments"])
+        if not len(new) and not finished:
+            return 0
+        classifiers = [name for name in self.EyeMovement.FIXATION_CLASSIFIERS if name not in SESSION_CLASSIFIERS]
+        for eye in EYES:
+            eye_state = state["eyes"][eye]
+            em = self.eye_movement(eye, sampling_rate)
+            min_cut = em.min_cut()
+            # Rows from offset on are not written yet, buffer[:context] is the stretch the last piece ended with
+            buffer = self.read_rows(paths, lengths, eye, eye_state["offset"], state["rows"])
+            offset, context = eye_state["offset"], eye_state["context"]
+            pieces = []
+            for k in new:
+                segment = self.read_eye(paths[k], eye)
+                buffer = segment if buffer is None else pd.concat([buffer, segment], ignore_index=True)
+                starts, ends = gaze_kernels.cut_gaps(
+                    buffer[em.validity_col].to_numpy()[context:],
+                    buffer[em.col_x].to_numpy()[context:],
+                    buffer[em.col_y].to_numpy()[context:],
+                    min_cut,
+                )
+                if len(starts) == 0:
+                    continue
+                # Cut at the last stretch, as EyeMovement.run_streaming does
+                start, end = int(starts[-1]) + context, int(ends[-1]) + context
+                pieces.append(self.classify_piece(em, buffer.iloc[:end], offset, context, classifiers))
+                buffer = buffer.iloc[start:].reset_index(drop=True)
+                offset += start
+                context = end - start
+            if finished and buffer is not None and len(buffer) > context:
+                pieces.append(self.classify_piece(em, buffer, offset, context, classifiers))
+            if pieces:
+                file_name = f"{len(eye_state['files']):04d}.{eye}.npz"
+                self.save_pieces(os.path.join(self.directory, file_name), pieces)
+                eye_state["files"].append(file_name)
+            eye_state["offset"], eye_state["context"] = offset, context
+        state["segments"] = len(complete)
+        state["rows"] = sum(lengths)
+        state["complete"] = finished
+        self.save_state(state)
+        return len(new)
+
+    def classify_piece(self, em, piece, start, context, classifiers):
+        # Arrays of the rows [start, start + len(piece)) of the session, the first context rows were written before
+        em.data = piece.reset_index(drop=True)
+        em.classify(classifiers)
+        x, y = em.gaze_arrays()
+        arrays = {"x": x, "y": y, "validity": em.data[em.validity_col].to_numpy(), "blink": np.asarray(em.blink)}
+        for name, (states, x_center, y_center) in em.fixations.items():
+            arrays[f"{name}_state"] = states
+            arrays[f"{name}_x"] = x_center
+            arrays[f"{name}_y"] = y_center
+        em.data = None
+        return start, context, arrays
+
+    def save_pieces(self, path, pieces):
+        data = {"start": [start for start, _, _ in pieces], "context": [context for _, context, _ in pieces],
+                "length": [len(arrays["x"]) for _, _, arrays in pieces]}
+        for column in pieces[0][2]:
+            data[column] = np.concatenate([arrays[column] for _, _, arrays in pieces])
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, **data)
+        os.replace(temporary_path, path)
+
+    def is_usable(self, em):
+        # The whole session is classified, with the parameters and the sampling rate of em
+        state = self.load_state()
+        return (state is not None and state["complete"] and state["params"] == self.params
+                and state["sampling_rate"] == em.sampling_rate)
+
+    def columns(self, em):
+        return CachedColumns(self, em)
+
+
+class CachedColumns:
+    """
+    Cached columns of the eye em uses, read in order by take(start, end), with the classifiers of SESSION_CLASSIFIERS
+    run on each piece with the parameters of em (its displacement histogram).
+    """
+    def __init__(self, cache, em):
+        self.cache = cache
+        self.em = em
+        state = cache.load_state()
+        self.files = iter(state["eyes"][em.eye_to_use]["files"])
+        self.pieces = iter(())
+        # Rows [first, first + len) of the session not taken yet
+        self.first = 0
+        self.pending = None
+
+    def next_piece(self):
+        for piece in self.pieces:
+            return piece
+        self.pieces = self.read_file(next(self.files))
+        return next(self.pieces)
+
+    def read_file(self, file_name):
+        with np.load(os.path.join(self.cache.directory, file_name)) as data:
+            data = dict(data)
+        position = 0
+        for start, context, length in zip(data.pop("start"), data.pop("context"), data.pop("length")):
+            arrays = {column: values[position:position + length] for column, values in data.items()}
+            position += length
+            session = self.em.gaze_session(arrays["x"], arrays["y"], arrays["blink"])
+            for name in self.em.FIXATION_CLASSIFIERS:
+                if name in SESSION_CLASSIFIERS:
+                    states, x_center, y_center, _ = CLASSIFIERS[name](session, **self.em.classifier_params[name])
+                    arrays[f"{name}_state"], arrays[f"{name}_x"], arrays[f"{name}_y"] = states, x_center, y_center
+            yield {column: values[context:] for column, values in arrays.items()}
+
+    def take(self, start, end):
+        # {column: values} of the rows [start, end), called with consecutive ranges
+        while self.pending is None or self.first + len(self.pending["x"]) < end:
+            piece = self.next_piece()
+            self.pending = piece if self.pending is None else {
+                column: np.concatenate((self.pending[column], piece[column])) for column in piece}
+        rows = slice(start - self.first, end - self.first)
+        columns = {column: values[rows] for column, values in self.pending.items()}
+        self.pending = {column: values[end - self.first:] for column, values in self.pending.items()}
+        self.first = end
+        return columns
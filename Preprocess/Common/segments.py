@@ -0,0 +1,142 @@
+"""
+Sessions recorded in segments by TobiiRecorder.py.
+
+With rotation on, the recorder starts a new segment every SEGMENT_SECONDS of recording or SEGMENT_SAMPLES samples,
+written to {stem}.segments/000.gaze, 001.gaze, ... (or .csv), and keeps the index {stem}.segments.json up to date:
+    {"complete": false,
+     "segments": [{"path": "S001_202401011000.segments/000.gaze", "n_samples": 36000,
+                   "first_system_time_stamp": ..., "last_system_time_stamp": ..., "complete": true}, ...]}
+with the paths relative to the index. A segment is complete once the next one has started, the session once the
+recorder has stopped, so the complete segments can be read while the recording continues.
+
+The index stands for the em csv of the session in the pipeline: DataSynchronization.synced_segments syncs the session
+one segment at a time and EyeMovement(chunks=...) preprocesses it that way. The complete segments need no psychopy
+data to be classified: segment_cache.SegmentCache classifies them while the session is recorded (main_sart.py --watch),
+and at the end of the session the sync only adds the stimulus columns to the cached ones.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from session_format import SEGMENT_INDEX_SUFFIX, recording_stem
+from gaze_recording import read_recording, recording_frame
+
+
+class SegmentIndex:
+    """
+    Index written by the recorder. extension: "gaze" or "csv", the format of the segment files.
+    """
+    def __init__(self, index_path, extension, segment_seconds=None, segment_samples=None):
+        self.index_path = index_path
+        self.extension = extension
+        self.segment_seconds = segment_seconds
+        self.segment_samples = segment_samples
+        self.segments = []
+        self.complete = False
+
+    def segment_path(self, segment):
+        return os.path.join(os.path.dirname(self.index_path), segment["path"])
+
+    def _start_segment(self, first_time_stamp):
+        if self.segments:
+            self.segments[-1]["complete"] = True
+        directory = os.path.basename(recording_stem(self.index_path)) + ".segments"
+        os.makedirs(os.path.join(os.path.dirname(self.index_path), directory), exist_ok=True)
+        self.segments.append({
+            "path": f"{directory}/{len(self.segments):03d}.{self.extension}",
+            "n_samples": 0,
+            "first_system_time_stamp": int(first_time_stamp),
+            "last_system_time_stamp": None,
+            "complete": False,
+        })
+        return self.segments[-1]
+
+    def _segment_end(self, segment, system_time_stamps, start):
+        # End of the part of the batch from start that still fits in the segment
+        end = len(system_time_stamps)
+        if self.segment_samples:
+            end = min(end, start + max(self.segment_samples - segment["n_samples"], 0))
+        if self.segment_seconds:
+            limit = segment["first_system_time_stamp"] + self.segment_seconds * 1e6
+            end = start + int(np.searchsorted(system_time_stamps[start:end], limit, side='left'))
+        return end
+
+    def split(self, system_time_stamps):
+        """
+        Cut a batch of samples at the segment boundaries, starting new segments as needed.
+        Return [(segment file path, start, end)] of the parts of the batch, in order.
+        """
+        parts = []
+        start = 0
+        while start < len(system_time_stamps):
+            segment = self.segments[-1] if self.segments else self._start_segment(system_time_stamps[start])
+            end = self._segment_end(segment, system_time_stamps, start)
+            if end == start:
+                segment = self._start_segment(system_time_stamps[start])
+                end = self._segment_end(segment, system_time_stamps, start)
+            segment["n_samples"] += end - start
+            segment["last_system_time_stamp"] = int(system_time_stamps[end - 1])
+            parts.append((self.segment_path(segment), start, end))
+            start = end
+        return parts
+
+    def save(self):
+        # Written to a temporary file and renamed, readers never see a partial index
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"complete": self.complete, "segment_seconds": self.segment_seconds,
+                       "segment_samples": self.segment_samples, "segments": self.segments}, file, indent=2)
+        os.replace(temporary_path, self.index_path)
+
+    def close(self):
+        if self.segments:
+            self.segments[-1]["complete"] = True
+        self.complete = True
+        self.save()
+
+
+def is_segment_index(path):
+    return path.endswith(SEGMENT_INDEX_SUFFIX)
+
+
+def read_index(index_path):
+    with open(index_path) as file:
+        return json.load(file)
+
+
+def segment_paths(index_path, complete_only=False):
+    index = read_index(index_path)
+    directory = os.path.dirname(index_path)
+    return [os.path.join(directory, segment["path"]) for segment in index["segments"]
+            if segment["complete"] or not complete_only]
+
+
+def read_segment(path, columns=None):
+    # em dataframe of one segment file, only the columns of columns it has when given
+    if path.endswith(".gaze"):
+        return recording_frame(read_recording(path), columns)
+    return pd.read_csv(path, usecols=None if columns is None else lambda column: column in columns)
+
+
+def segment_frames(index_path, columns=None):
+    # em dataframes of the segments of a session, in order
+    for path in segment_paths(index_path):
+        yield read_segment(path, columns)
+
+
+def recording_files(path):
+    # Files holding the samples of an em csv, .gaze recording or segment index
+    return segment_paths(path) if is_segment_index(path) else [path]
+
+
+def session_recordings(em_dir):
+    """
+    File names of the em recordings of em_dir: the em csv files, and the segment indexes of the sessions
+    that have no em csv.
+    """
+    file_names = os.listdir(em_dir)
+    csv_stems = {file_name[:-len(".csv")] for file_name in file_names if file_name.endswith(".csv")}
+    return [file_name for file_name in file_names
+            if file_name.endswith(".csv") or (is_segment_index(file_name) and recording_stem(file_name) not in csv_stems)]
@@ -0,0 +1,113 @@
+"""
+Column layout of the synced and preprocessed session csv files.
+
+Gaze points and fixation centroids are stored as two float32 columns, {name}_x and {name}_y, with NaN (empty cell)
+for a missing point, instead of tuple strings such as "(0.41, 0.52)".
+Tobii reports the coordinates as float32, so the float32 columns are lossless for the recorded gaze points.
+Read them back with dtype=point_dtypes(...) to get the exact recorded values.
+
+The sampling rate is not stored, it is inferred from the timestamps of the first and last samples:
+Tobii's system_time_stamp (int64 microseconds) when the recording has it, else the "timestamp" datetime strings.
+"""
+
+import os
+import math
+import numpy as np
+import pandas as pd
+
+GAZE_POINT_COLUMNS = ['left_gaze_point_on_display_area', 'right_gaze_point_on_display_area']
+POINT_DTYPE = np.float32
+# Gaze output frequencies of the Tobii trackers, Hz
+TOBII_SAMPLING_RATES = (30, 60, 90, 120, 150, 250, 300, 600, 1200)
+# Timestamp column of the sessions, in order of preference
+TIME_COLUMNS = ('system_time_stamp', 'timestamp')
+# Index of a session recorded in segments (segments.py), in place of the em csv
+SEGMENT_INDEX_SUFFIX = '.segments.json'
+
+
+def xy_columns(name):
+    return f'{name}_x', f'{name}_y'
+
+
+def recording_stem(path):
+    # Path of a recording without its extension, the sidecar files (.clock.json, .telemetry.json) share it
+    if path.endswith(SEGMENT_INDEX_SUFFIX):
+        return path[:-len(SEGMENT_INDEX_SUFFIX)]
+    return os.path.splitext(path)[0]
+
+
+def point_dtypes(names=GAZE_POINT_COLUMNS):
+    # dtype argument of pd.read_csv for the *_x / *_y columns
+    dtypes = {}
+    for name in names:
+        for column in xy_columns(name):
+            dtypes[column] = POINT_DTYPE
+    return dtypes
+
+
+def split_point_column(df, name):
+    """
+    Replace the tuple-string column "(x, y)" by {name}_x / {name}_y float32 columns at the same position.
+    "(nan, nan)" and unparsable cells become NaN.
+    """
+    parts = df[name].astype(str).str.slice(1, -1).str.partition(', ')
+    x = pd.to_numeric(parts[0], errors='coerce').astype(POINT_DTYPE)
+    y = pd.to_numeric(parts[2], errors='coerce').astype(POINT_DTYPE)
+    position = df.columns.get_loc(name)
+    x_column, y_column = xy_columns(name)
+    df.drop(columns=name, inplace=True)
+    df.insert(position, x_column, x)
+    df.insert(position + 1, y_column, y)
+
+
+def split_point_columns(df, names=GAZE_POINT_COLUMNS):
+    # Only the columns still stored as tuple strings are converted
+    for name in names:
+        if name in df.columns:
+            split_point_column(df, name)
+
+
+def cast_point_columns(df, names=GAZE_POINT_COLUMNS):
+    for name in names:
+        for column in xy_columns(name):
+            if column in df.columns:
+                df[column] = df[column].astype(POINT_DTYPE)
+
+
+def infer_sampling_rate(first_timestamp, last_timestamp, n_samples):
+    """
+    Samples per second over the whole recording, snapped to the nearest Tobii frequency when it is within 10%.
+    Integer timestamps are system_time_stamp microseconds, other timestamps are datetime strings taken on the
+    recording computer when the samples arrive: single intervals are jittery but the average over the session is stable.
+    """
+    if isinstance(first_timestamp, (int, np.integer)):
+        elapsed = (int(last_timestamp) - int(first_timestamp)) / 1e6
+    else:
+        elapsed = (pd.Timestamp(last_timestamp) - pd.Timestamp(first_timestamp)).total_seconds()
+    if n_samples < 2 or elapsed <= 0:
+        raise ValueError(f"Cannot infer the sampling rate from {n_samples} samples over {elapsed} s")
+    rate = (n_samples - 1) / elapsed
+    nearest = min(TOBII_SAMPLING_RATES, key=lambda tobii_rate: abs(tobii_rate - rate))
+    return nearest if abs(nearest - rate) <= 0.1 * nearest else rate
+
+
+def time_column(columns):
+    for column in TIME_COLUMNS:
+        if column in columns:
+            return column
+    raise ValueError(f"No timestamp column, expected one of {TIME_COLUMNS}")
+
+
+def session_sampling_rate(df):
+    column = time_column(df.columns)
+    return infer_sampling_rate(df[column].iloc[0], df[column].iloc[-1], len(df))
+
+
+def ms_to_frames(ms, sampling_rate, at_least=True):
+    """
+    Number of frames of a duration threshold in ms.
+    at_least=True: the fewest frames lasting at least ms, at_least=False: the most frames lasting at most ms.
+    """
+    frames = ms * sampling_rate / 1000
+    # tolerance for the float error of ms * sampling_rate / 1000 when the result is a whole number
+    return math.ceil(frames - 1e-9) if at_least else math.floor(frames + 1e-9)
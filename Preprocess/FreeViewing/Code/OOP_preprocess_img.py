@@ -8,11 +8,15 @@ The result will be saved in the Data_Collection/Data/Processed folder.
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
-from math import tan, pi, sqrt
-from functools import cache
-import ast
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Common"))
+import gaze_kernels
+from classifiers import CLASSIFIERS, GazeSession
+from session_format import POINT_DTYPE, xy_columns, point_dtypes, split_point_columns, cast_point_columns, \
+    infer_sampling_rate, session_sampling_rate, time_column, ms_to_frames
     
 # def get_matched_files():
 #     files_input = os.listdir(EyeMovement.INPUT_DIR)
@@ -24,274 +28,381 @@ class EyeMovement:
     SCREEN_SIZE_W = 596.7  # mm
     SCREEN_SIZE_H = 335.7  # mm
     SCREEN_TO_EYE_DIST = 650  # mm
-    BLINK_THRESHOLD = 5  # 5 consecutive missing frames
-    SAMPLING_RATE = 60  # Hz
+    # Durations are in ms and converted to frames with the sampling rate of each session
+    BLINK_THRESHOLD_MS = 80  # Blink is at least 80 ms of missing frames (5 frames at 60 Hz)
+    MAX_INTERPOLATED_GAP_MS = 75  # gaps of at most 75 ms are interpolated (4 frames at 60 Hz)
+    # Classifiers of classifiers.CLASSIFIERS run on every session, each writes {name}_state and {name}_fixation_centroid_x/_y
+    FIXATION_CLASSIFIERS = ('IVT', 'IDT', 'IVVT', 'AIVT')
     
     # IVT parameters
     IVT_SACCADE_THRESHOLD = 30  # 30 degree per second
-    IVT_FIXATION_THRESHOLD = 6 # Fixation is at least 100ms
+    IVT_FIXATION_THRESHOLD_MS = 100  # Fixation is at least 100ms
     
     #IDT parameters
     IDT_DISPERSION_THRESHOLD = 0.5  # 0.5 degree in radians
-    IDT_WINDOW_SIZE = 6  # 100 ms window size
-    IDT_FIXATION_THRESHOLD = 6  # Fixation is at least 100ms
+    IDT_WINDOW_SIZE_MS = 100  # 100 ms window size
+    IDT_FIXATION_THRESHOLD_MS = 100  # Fixation is at least 100ms
+
+    #IVVT parameters
+    IVVT_SACCADE_THRESHOLD = 30  # 30 degree per second
+    IVVT_PURSUIT_THRESHOLD = 10  # Smooth pursuit from 10 degree per second up to the saccade threshold
+    IVVT_FIXATION_THRESHOLD_MS = 100  # Fixation is at least 100ms
+
+    #AIVT parameters (adaptive I-VT, thresholds from the velocity noise of each session)
+    AIVT_INITIAL_THRESHOLD = 100  # degree per second
+    AIVT_PEAK_SD = 6  # peak threshold = mean + 6 sd of the velocities below it
+    AIVT_ONSET_SD = 3  # onset threshold = mean + 3 sd
+    AIVT_CONVERGENCE = 1  # degree per second
+    AIVT_FIXATION_THRESHOLD_MS = 100  # Fixation is at least 100ms
     
-    def __init__(self, filepath):
+    def __init__(self, filepath, chunk_size=None, sampling_rate=None, data=None, chunks=None, cache=None):
         self.filepath = filepath
-        self.data = self._load_data()
+        # Hz, inferred from the timestamps when None
+        self.sampling_rate = sampling_rate
+        # Number of rows read at a time by run_streaming, None loads the whole session
+        self.chunk_size = chunk_size
+        # chunks: callable returning the synced session as dataframes in order, e.g. DataSynchronization.synced_segments,
+        # read by run_streaming (twice) instead of filepath
+        self.chunks = chunks
+        # cache: segment_cache.SegmentCache of the recording, the columns classified while recording are used when it is complete
+        self.cache = cache
+        # data: synced dataframe handed over by DataSynchronization instead of reading filepath, the output is still written to filepath
+        if data is not None:
+            self.data = self._prepare(data)
+        else:
+            self.data = self._load_data() if chunk_size is None and chunks is None else None
         self.eye_to_use = None
         self.col = None
+        self.col_x = None
+        self.col_y = None
         self.validity_col = None
         self.states = []
         self.blink = []
+        self.gaps = None
+        self.gap_codes = None
+        self.blink_threshold = None
+        self.max_interpolated_gap = None
+        # {classifier name: parameters}, durations in frames
+        self.classifier_params = None
+        # Histogram of the recorded displacements of the eye in use, for the adaptive classifier
+        self.displacement_histogram = None
+        # {classifier name: (states, x_center, y_center)} of the last classify_fixations
+        self.fixations = {}
 
-    def _convert_to_tuple(self, value):
-        try:
-            return ast.literal_eval(value)
-        except (ValueError, SyntaxError):
-            # Handle the exception or return a default value
-            return (None, None)
+    @classmethod
+    def parameters(cls):
+        # Processing parameters (the upper-case class constants), recorded in the manifest of the output files
+        return {name: list(value) if isinstance(value, tuple) else value
+                for name, value in vars(cls).items() if name.isupper() and isinstance(value, (int, float, tuple))}
 
     def _load_data(self) -> pd.DataFrame:
-        converters = {
-            'left_gaze_point_on_display_area': self._convert_to_tuple,
-            'right_gaze_point_on_display_area': self._convert_to_tuple
-        }
-        return pd.read_csv(self.filepath, converters=converters)
+        return self._prepare(pd.read_csv(self.filepath, dtype=point_dtypes()))
+
+    def _prepare(self, data):
+        # Gaze points are read as the recorded float32 values and processed as float64
+        # Files synced before the float columns existed still hold "(x, y)" strings
+        split_point_columns(data)
+        for column in point_dtypes():
+            data[column] = data[column].astype(np.float64)
+        return data
+
+    def _scan(self):
+        """
+        First pass of the streaming mode over the whole file, one chunk at a time.
+        Return the dtype read_csv infers for each column of the whole file, the validity counts
+        and the displacement histograms of both eyes, and infer the sampling rate.
+        read_csv also parses a large file block by block and then promotes the dtypes of the blocks,
+        e.g. an integer column with a missing value in one block becomes float64.
+        """
+        dtypes = {}
+        left_valid, right_valid = 0, 0
+        n_samples, first_timestamp, last_timestamp = 0, None, None
+        histograms = {'left': 0, 'right': 0}
+        # Last gaze point of the previous chunk, for the displacement across the chunk boundary
+        last_points = {'left': (np.array([]), np.array([])), 'right': (np.array([]), np.array([]))}
+        for chunk in self._source_chunks():
+            for column, dtype in chunk.dtypes.items():
+                dtypes.setdefault(column, set()).add(dtype)
+            self._prepare(chunk)
+            for eye, (last_x, last_y) in last_points.items():
+                x_column, y_column = xy_columns(f'{eye}_gaze_point_on_display_area')
+                x = np.concatenate((last_x, chunk[x_column].to_numpy()))
+                y = np.concatenate((last_y, chunk[y_column].to_numpy()))
+                histograms[eye] = histograms[eye] + gaze_kernels.displacement_histogram(self.displacements(x, y))
+                last_points[eye] = (x[-1:], y[-1:])
+            left_valid += chunk['left_gaze_point_validity'].sum()
+            right_valid += chunk['right_gaze_point_validity'].sum()
+            column = time_column(chunk.columns)
+            if first_timestamp is None:
+                first_timestamp = chunk[column].iloc[0]
+            last_timestamp = chunk[column].iloc[-1]
+            n_samples += len(chunk)
+        if self.sampling_rate is None:
+            self.sampling_rate = infer_sampling_rate(first_timestamp, last_timestamp, n_samples)
+        for column, found in dtypes.items():
+            if len(found) == 1:
+                dtypes[column] = found.pop()
+            elif all(dtype.kind in "iuf" for dtype in found):
+                dtypes[column] = np.result_type(*found)
+            else:
+                dtypes[column] = np.dtype(object)
+        return dtypes, left_valid, right_valid, histograms
+
+    def _source_chunks(self):
+        if self.chunks is not None:
+            return self.chunks()
+        return pd.read_csv(self.filepath, dtype=point_dtypes(), chunksize=self.chunk_size)
+
+    def _read_chunks(self, dtypes):
+        for chunk in self._source_chunks():
+            for column, dtype in chunk.dtypes.items():
+                if dtype != dtypes[column]:
+                    chunk[column] = chunk[column].astype(dtypes[column])
+            yield self._prepare(chunk)
     
     
-    # Given two points, calculate the visual angle of two points, return degrees
-    def visual_angle_calculation(self, p1, p2):
-        # Convert to actual coordinates on monitor
-        x1, y1 = p1[0] * EyeMovement.SCREEN_SIZE_W, p1[1] * EyeMovement.SCREEN_SIZE_H
-        x2, y2 = p2[0] * EyeMovement.SCREEN_SIZE_W, p2[1] * EyeMovement.SCREEN_SIZE_H
-        d = sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
-        theta = np.arctan(d / EyeMovement.SCREEN_TO_EYE_DIST)
-        theta = np.rad2deg(theta)
-        return theta
-        
-            
-    def decide_eye_to_use(self):
-        left_valid = self.data['left_gaze_point_validity'].sum()
-        right_valid = self.data['right_gaze_point_validity'].sum()
+    def set_thresholds(self):
+        # Frame counts of the ms thresholds at the sampling rate of the session
+        if self.sampling_rate is None:
+            self.sampling_rate = session_sampling_rate(self.data)
+        self.blink_threshold = ms_to_frames(EyeMovement.BLINK_THRESHOLD_MS, self.sampling_rate)
+        self.max_interpolated_gap = ms_to_frames(EyeMovement.MAX_INTERPOLATED_GAP_MS, self.sampling_rate, at_least=False)
+        self.classifier_params = {name: self.classifier_parameters(name) for name in EyeMovement.FIXATION_CLASSIFIERS}
+
+
+    def classifier_parameters(self, name):
+        # {name}_* class constants as keyword arguments of the classifier, e.g. IDT_WINDOW_SIZE_MS -> window_size in frames
+        params = {}
+        for constant, value in EyeMovement.parameters().items():
+            if not constant.startswith(name + '_'):
+                continue
+            key = constant[len(name) + 1:].lower()
+            if key.endswith('_ms'):
+                key, value = key[:-len('_ms')], ms_to_frames(value, self.sampling_rate)
+            params[key] = value
+        return params
+
+
+    def displacements(self, x, y):
+        return gaze_kernels.displacements(x, y, EyeMovement.SCREEN_SIZE_W, EyeMovement.SCREEN_SIZE_H, EyeMovement.SCREEN_TO_EYE_DIST)
+
+
+    def gaze_arrays(self):
+        # (x, y) float arrays of the gaze points of the eye in use, NaN where the point is missing
+        return self.data[self.col_x].to_numpy(), self.data[self.col_y].to_numpy()
+
+
+    def decide_eye_to_use(self, left_valid=None, right_valid=None):
+        # run_streaming passes the validity counts of the whole session
+        if left_valid is None:
+            left_valid = self.data['left_gaze_point_validity'].sum()
+            right_valid = self.data['right_gaze_point_validity'].sum()
         self.eye_to_use = 'left' if left_valid > right_valid else 'right'
         self.col = f'{self.eye_to_use}_gaze_point_on_display_area'
+        self.col_x, self.col_y = xy_columns(self.col)
         self.validity_col = f'{self.eye_to_use}_gaze_point_validity'
-        self.data['eye_to_use'] = self.eye_to_use
+        if self.data is not None:
+            self.data['eye_to_use'] = self.eye_to_use
+
+
+    def find_gaps(self):
+        """
+        Run-length table of the missing samples of the eye in use, one row per gap
+        state is None for the gaps filled by interpolation, Blink or Error otherwise
+        """
+        starts, ends, codes = gaze_kernels.gap_table(
+            self.data[self.validity_col].to_numpy(),
+            max_interpolated_gap=self.max_interpolated_gap,
+            blink_threshold=self.blink_threshold,
+        )
+        self.gaps = pd.DataFrame({
+            'start': starts,
+            'end': ends,
+            'length': ends - starts,
+            'state': gaze_kernels.decode_states(codes),
+        })
+        self.gap_codes = codes
 
 
     def interpolate_coordinates(self):
-        idx = 0
-        while idx < len(self.data):
-            # If the current point is missing
-            if self.data.at[idx, self.validity_col] == 0:
-                start_idx = idx
-                while idx < len(self.data) and self.data.at[idx, self.validity_col] == 0:
-                    idx += 1
-                end_idx = idx
-                
-                # Check if the count of missing points is 4 or fewer
-                if 1 <= (end_idx - start_idx) <= 4:
-                    # Ensure that both bounding points are valid for interpolation
-                    if start_idx > 0 and end_idx < len(self.data):
-                        x1, y1 = self.data.at[start_idx - 1, self.col]
-                        x2, y2 = self.data.at[end_idx, self.col]
-                        
-                        # Linear interpolation for each missing point
-                        for j in range(start_idx, end_idx):
-                            alpha = (j - start_idx + 1) / (end_idx - start_idx + 1)
-                            x = x1 + alpha * (x2 - x1)
-                            y = y1 + alpha * (y2 - y1)
-                            self.data.at[j, self.col] = (x, y)
-                            # set validity to 2 to indicate that the point is interpolated
-                            self.data.at[j, self.validity_col] = 2
-            else:
-                idx += 1
+        # Linear interpolation of the gaps of at most MAX_INTERPOLATED_GAP_MS with valid points on both sides
+        interpolated = self.gap_codes == gaze_kernels.UNLABELLED
+        starts = self.gaps['start'].to_numpy()[interpolated]
+        ends = self.gaps['end'].to_numpy()[interpolated]
+        x, y = self.gaze_arrays()
+        x, y = x.copy(), y.copy()
+        gaze_kernels.interpolate_gaps(x, starts, ends)
+        gaze_kernels.interpolate_gaps(y, starts, ends)
+        self.data[self.col_x] = x
+        self.data[self.col_y] = y
+        # set validity to 2 to indicate that the point is interpolated
+        validity = self.data[self.validity_col].to_numpy().copy()
+        validity[gaze_kernels.run_rows(starts, ends)] = 2
+        self.data[self.validity_col] = validity
 
 
     def identify_blink(self):
-        idx = 0
-        total_rows = len(self.data)
-
-        while idx < total_rows:
-            # Check if both eyes' data is missing at the current index
-            if self.data.at[idx, self.validity_col] == 0:
-                blink_start_idx = idx
-                while (idx < total_rows and self.data.at[idx, self.validity_col] == 0):
-                    idx += 1
-                blink_end_idx = idx
-
-                # Check if the consecutive missing frames count as a blink or just error states
-                if blink_end_idx - blink_start_idx >= EyeMovement.BLINK_THRESHOLD:
-                    self.blink.extend(['Blink'] * (blink_end_idx - blink_start_idx))
-                else:
-                    self.blink.extend(['Error'] * (blink_end_idx - blink_start_idx))
-            else:
-                self.blink.append(None)
-                idx += 1
-                
-                
-    def IVT(self):
-        """
-        Calculate the distance between each consecutive point, 
-        if the distance is greater than the threshold, then it is a saccade
-        The rest of the points are fixations, however, if the fixation is less than 6 frames, it should be considered as an error
-        identify saccade -> identify fixation -> compute center point -> add error state
-        """
-        self.IVT = self.blink[:]
-        
-        # identify saccade
-        col = f'{self.eye_to_use}_gaze_point_on_display_area'
-        for i in range(len(self.data) - 1):
-            if self.IVT[i]:  # Skip already identified states
-                continue
-            
-            p1 = self.data.at[i, col]
-            p2 = self.data.at[i+1, col]
-            # Ignore the point where value is missing
-            if p1[0] is None or p2[0] is None or p1[1] is None or p2[1] is None: continue
-        
-            # Calculate the velocity, 
-            v = self.visual_angle_calculation(p1, p2) * EyeMovement.SAMPLING_RATE # 60 Hz sampling rate
-            if v >= EyeMovement.IVT_SACCADE_THRESHOLD:
-                self.IVT[i] = 'Saccade'
-        
-        # identify fixation
-        for i, state in enumerate(self.IVT):
-            if not state:
-                self.IVT[i] = 'Fixation'
-
-        # add state to the dataframe
-        self.data['IVT_state'] = self.IVT
-        
-        # compute fixation centroid
-        fixation_start = None
-        self.data['IVT_fixation_centroid'] = [(None, None)] * len(self.data)
-        IVT_states = self.IVT + ['End']
-        
-        for i, state in enumerate(IVT_states):
-            if state == 'Fixation':
-                if fixation_start is None:
-                    fixation_start = i
-            # Fixation has ended, check if it was longer or equal to 6 frames
-            elif fixation_start is not None:
-                if i - fixation_start >= EyeMovement.IVT_FIXATION_THRESHOLD:
-                    fixation_points = self.data[col][fixation_start:i]
-                    x_center = fixation_points.apply(lambda p: p[0]).mean()
-                    y_center = fixation_points.apply(lambda p: p[1]).mean()
-                    center_point = (x_center, y_center)
-                    for j in range(fixation_start, i):
-                        self.data.at[j, 'IVT_fixation_centroid'] = center_point
-                fixation_start = None
-        
-        # add error state
-        for i in range(len(self.data)):
-            if self.data.at[i, 'IVT_state'] == 'Fixation' and self.data.at[i, 'IVT_fixation_centroid'] == (None, None):
-                self.data.at[i, 'IVT_state'] = 'Error'
-                
-        # For 3 cosecutive eye states, change [Saccade, Error, Saccade] to [Saccade, Saccade, Saccade]
-        for i in range(len(self.data)-2):
-            first_state = self.data.at[i, 'IVT_state']
-            second_state = self.data.at[i+1, 'IVT_state']
-            third_state = self.data.at[i+2, 'IVT_state']
-            if first_state == 'Saccade' and second_state == 'Error' and third_state == 'Saccade':
-                self.data.at[i+1, 'IVT_state'] = 'Saccade'
-                
-        
-    def IDT(self):
+        # Gaps that are not interpolated are Blink if they last BLINK_THRESHOLD_MS or more, Error otherwise
+        self.blink = gaze_kernels.gap_states(
+            len(self.data), self.gaps['start'].to_numpy(), self.gaps['end'].to_numpy(), self.gap_codes)
+
+
+    def gaze_session(self, x, y, blink):
+        return GazeSession(
+            x, y, blink, self.sampling_rate,
+            screen_size_w=EyeMovement.SCREEN_SIZE_W,
+            screen_size_h=EyeMovement.SCREEN_SIZE_H,
+            screen_to_eye_dist=EyeMovement.SCREEN_TO_EYE_DIST,
+            displacement_histogram=self.displacement_histogram,
+        )
+
+
+    def classify_fixations(self, classifiers=None):
         """
-        Calculate the dispersion of the eye gaze points within a window size
-        if the dispersion is greater than the threshold, then it is a saccade
-        Dispersion = x_max - x_min + y_max - y_min
-        identify fixation -> identify saccade -> compute center point -> add error state
+        Run every classifier of FIXATION_CLASSIFIERS (or of classifiers) on the interpolated gaze points and the blink codes.
+        The velocities and dispersions are computed once by GazeSession and shared by the classifiers.
         """
-        @cache
-        def _dis_to_rad(d):
-            return np.arctan(d / EyeMovement.SCREEN_TO_EYE_DIST)
-        
-        self.IDT = self.blink[:]
-        col = f'{self.eye_to_use}_gaze_point_on_display_area'
-        
-        # identify fixation using two pointers
-        l = 0
-        r = l + EyeMovement.IDT_WINDOW_SIZE
-        while r < len(self.data):
-            points = self.data[col][l:r]
-            x_min = np.min(points.apply(lambda p: p[0]))
-            x_max = np.max(points.apply(lambda p: p[0]))
-            y_min = np.min(points.apply(lambda p: p[1]))
-            y_max = np.max(points.apply(lambda p: p[1]))
-            dispersion = (x_max - x_min) + (y_max - y_min)
-        
-            if _dis_to_rad(dispersion) <= EyeMovement.IDT_DISPERSION_THRESHOLD:
-                while r + 1 < len(self.data) and _dis_to_rad(dispersion) <= EyeMovement.IDT_DISPERSION_THRESHOLD:
-                    r += 1
-                    new_point = self.data.at[r, col]
-                    if new_point[0] is None or new_point[1] is None: break
-                    x_min = min(x_min, new_point[0]); x_max = max(x_max, new_point[0])
-                    y_max = max(y_max, new_point[1]); y_min = min(y_min, new_point[1])
-                    dispersion = (x_max - x_min) + (y_max - y_min)
-                
-                for i in range(l, r):
-                    # DO NOT overwrite the state if it is already identified as Blink
-                    if not self.IDT[i]:
-                        self.IDT[i] = 'Fixation'
-                
-                l = r
-                r = l + EyeMovement.IDT_WINDOW_SIZE
-            
-            else:
-                l += 1
-                r += 1
-        
-        
-        # identify saccade
-        for i, state in enumerate(self.IDT):
-            if not state:
-                self.IDT[i] = 'Saccade'
-                
-        # add state to the dataframe
-        self.data['IDT_state'] = self.IDT
-        
-        # compute fixation centroid
-        fixation_start = None
-        self.data['IDT_fixation_centroid'] = [(None, None)] * len(self.data)
-        IDT_states = self.IDT + ['End']
-        
-        for i, state in enumerate(IDT_states):
-            if state == 'Fixation':
-                if fixation_start is None:
-                    fixation_start = i
-            # Fixation has ended, check if it was longer or equal to 6 frames
-            elif fixation_start is not None:
-                if i - fixation_start >= EyeMovement.IDT_FIXATION_THRESHOLD:
-                    fixation_points = self.data[col][fixation_start:i]
-                    x_center = fixation_points.apply(lambda p: p[0]).mean()
-                    y_center = fixation_points.apply(lambda p: p[1]).mean()
-                    center_point = (x_center, y_center)
-                    for j in range(fixation_start, i):
-                        self.data.at[j, 'IDT_fixation_centroid'] = center_point
-                fixation_start = None
-        
-        # add error state
-        for i in range(len(self.data)):
-            if self.data.at[i, 'IDT_state'] == 'Fixation' and self.data.at[i, 'IDT_fixation_centroid'] == (None, None):
-                self.data.at[i, 'IDT_state'] = 'Error'
+        session = self.gaze_session(*self.gaze_arrays(), self.blink)
+        self.fixations = {}
+        for name in classifiers or EyeMovement.FIXATION_CLASSIFIERS:
+            states, x_center, y_center, has_centroid = CLASSIFIERS[name](session, **self.classifier_params[name])
+            self.fixations[name] = (states, x_center, y_center)
+            self.data[f'{name}_state'] = gaze_kernels.decode_states(states)
+            self.add_centroid_columns(f'{name}_fixation_centroid', x_center, y_center)
+
+
+    def add_centroid_columns(self, name, x_center, y_center):
+        # NaN where the sample has no fixation centroid
+        x_column, y_column = xy_columns(name)
+        self.data[x_column] = x_center.astype(POINT_DTYPE)
+        self.data[y_column] = y_center.astype(POINT_DTYPE)
 
 
     def add_state_to_csv(self):
+        cast_point_columns(self.data)
         self.data.to_csv(self.filepath, index=False)
 
 
-    def run(self):
-        self.decide_eye_to_use()
+    def classify(self, classifiers=None):
+        self.find_gaps()
         self.interpolate_coordinates()
         self.identify_blink()
-        self.IVT()
-        # self.IDT()
+        self.classify_fixations(classifiers)
+
+
+    def run(self):
+        if self.chunk_size is not None or self.chunks is not None:
+            self.run_streaming()
+            return
+        self.set_thresholds()
+        self.decide_eye_to_use()
+        # Recorded displacements, before the interpolation
+        self.displacement_histogram = gaze_kernels.displacement_histogram(self.displacements(*self.gaze_arrays()))
+        self.classify()
         self.add_state_to_csv()
 
 
+    def min_cut(self):
+        # Shortest missing stretch a session can be cut at without changing the classification of either side
+        window_size = max([params.get('window_size', 1) for params in self.classifier_params.values()], default=1)
+        return max(2 * window_size - 1, self.blink_threshold, self.max_interpolated_gap + 1)
+
+
+    def classify_segment(self, segment):
+        self.data = segment.reset_index(drop=True)
+        self.data['eye_to_use'] = self.eye_to_use
+        self.classify()
+        cast_point_columns(self.data)
+        return self.data
+
+
+    def _collect_gaps(self, gaps, gap_codes, context, offset):
+        # Gaps of the segment in session indices, the leading stretch was already counted by the previous segment
+        new = (self.gaps['start'] >= context).to_numpy()
+        segment_gaps = self.gaps[new].copy()
+        segment_gaps[['start', 'end']] += offset
+        gaps.append(segment_gaps)
+        gap_codes.append(self.gap_codes[new])
+
+
+    def run_streaming(self):
+        """
+        Read the session chunk_size rows at a time (or the chunks of self.chunks, e.g. the segments of a recording),
+        classify it segment by segment and append each segment to the output.
+        A segment ends inside a long missing stretch (gaze_kernels.cut_gaps), and the next segment starts with that
+        stretch again as context, so the output is the same as run() byte for byte.
+        Memory is bounded by the chunk size plus the longest part of the session without such a stretch.
+        """
+        dtypes, left_valid, right_valid, histograms = self._scan()
+        self.set_thresholds()
+        self.decide_eye_to_use(left_valid, right_valid)
+        self.displacement_histogram = histograms[self.eye_to_use]
+        if self.cache is not None and self.cache.is_usable(self):
+            self.write_cached(dtypes)
+            return
+        min_cut = self.min_cut()
+
+        tmp_path = self.filepath + '.tmp'
+        buffer = None
+        # buffer[:context] is the stretch the previous segment ended with, already written
+        context = 0
+        # Session index of buffer[0]
+        offset = 0
+        gaps, gap_codes = [], []
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in self._read_chunks(dtypes):
+                buffer = chunk if buffer is None else pd.concat([buffer, chunk], ignore_index=True)
+                starts, ends = gaze_kernels.cut_gaps(
+                    buffer[self.validity_col].to_numpy()[context:],
+                    buffer[self.col_x].to_numpy()[context:],
+                    buffer[self.col_y].to_numpy()[context:],
+                    min_cut,
+                )
+                if len(starts) == 0:
+                    continue
+                # Cut at the last stretch: this segment ends with it, the next one starts with it
+                start, end = starts[-1] + context, ends[-1] + context
+                self.classify_segment(buffer.iloc[:end]).iloc[context:].to_csv(f, header=offset == 0 and context == 0, index=False)
+                self._collect_gaps(gaps, gap_codes, context, offset)
+                buffer = buffer.iloc[start:].reset_index(drop=True)
+                offset += start
+                context = end - start
+            if buffer is not None:
+                self.classify_segment(buffer).iloc[context:].to_csv(f, header=offset == 0 and context == 0, index=False)
+                self._collect_gaps(gaps, gap_codes, context, offset)
+        if gaps:
+            self.gaps = pd.concat(gaps, ignore_index=True)
+            self.gap_codes = np.concatenate(gap_codes)
+        self.data = None
+        os.replace(tmp_path, self.filepath)
+
+
+    def write_cached(self, dtypes):
+        """
+        Output of run_streaming from the columns SegmentCache classified while the session was recorded:
+        the synced segments only get the cached columns of the eye in use (and of the classifiers run on the whole session).
+        """
+        cached = self.cache.columns(self)
+        tmp_path = self.filepath + '.tmp'
+        start = 0
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in self._read_chunks(dtypes):
+                self.data = chunk.reset_index(drop=True)
+                self.data['eye_to_use'] = self.eye_to_use
+                columns = cached.take(start, start + len(chunk))
+                self.data[self.col_x] = columns['x']
+                self.data[self.col_y] = columns['y']
+                self.data[self.validity_col] = columns['validity'].astype(self.data[self.validity_col].dtype)
+                for name in EyeMovement.FIXATION_CLASSIFIERS:
+                    self.data[f'{name}_state'] = gaze_kernels.decode_states(columns[f'{name}_state'])
+                    self.add_centroid_columns(f'{name}_fixation_centroid', columns[f'{name}_x'], columns[f'{name}_y'])
+                cast_point_columns(self.data)
+                self.data.to_csv(f, header=start == 0, index=False)
+                start += len(chunk)
+        self.data = None
+        os.replace(tmp_path, self.filepath)
+
+
 if __name__ == "__main__":
     # ds.em_data が同期したdataframe
     filepath = None
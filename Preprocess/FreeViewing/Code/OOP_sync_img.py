@@ -1,12 +1,14 @@
 import os
+import sys
 import pandas as pd
 import re
-from datetime import datetime, timedelta    
+from functools import partial
 
-psychopy_to_datetime = lambda s: datetime.strptime(s, '%Y-%m-%d_%Hh%M.%S.%f')
-def str_to_datetime(s):
-    try: return datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')
-    except ValueError: return datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Common"))
+from session_format import split_point_columns
+from alignment import FREEVIEWING_TRIALS, align, align_segments, load_clock_offset, str_to_datetime, psychopy_to_datetime
+from gaze_recording import convert_recordings
+from segments import is_segment_index, segment_frames, session_recordings
 
 class DataSynchronization:
     def __init__(self, psychopy_data_path, em_data_path, target_file_path):
@@ -14,64 +16,32 @@ class DataSynchronization:
         self.em_data_path = em_data_path
         self.target_file_path = target_file_path
         self.psychopy_data = pd.read_csv(self.psychopy_data_path)
-        self.em_data = pd.read_csv(self.em_data_path)
+        if is_segment_index(self.em_data_path):
+            # Recorded in segments (segments.py): synced one segment at a time by synced_segments, joined by sync_data
+            self.em_data = None
+        else:
+            self.em_data = pd.read_csv(self.em_data_path)
+            # "(x, y)" gaze points -> float32 *_x / *_y columns
+            split_point_columns(self.em_data)
         self.ExpTime = self.psychopy_data["date"].iloc[0]
         self.ExpTime = str_to_datetime(self.ExpTime)
+        # system_time_stamp -> psychopy's clock, None for the recordings with "timestamp" strings
+        self.clock_offset = load_clock_offset(self.em_data_path)
 
     def sync_data(self):
-        self.pending_data = []
-        # This will iterate over the psychopy data once
-        for idx, row in self.psychopy_data.iterrows():
-            if pd.isna(row["imagepath"]): continue
-            image_path = row["imagepath"]
-            image_name = image_path.split("\\")[-1].split(".")[0]
-            image_started_time = self.ExpTime + timedelta(seconds=row["image.started"])
-            image_duration = row["image.rt"]
-            image_stopped_time = image_started_time + timedelta(seconds=image_duration)
-            state = row["probe_resp.keys"]
-            self.pending_data.append((image_name, state, image_started_time, image_stopped_time))
-        
-        # Then iterate over the eye-tracking data once
-        self.started_time = []
-        self.stopped_time = []
-        self.stimuli_data = []
-        self.state = []
-        img_idx = 0
-        for _, row in self.em_data.iterrows():
-            timestamp = str_to_datetime(row["timestamp"])
-            image_name, state, image_started_time, image_stopped_time = self.pending_data[img_idx]
-            if timestamp < image_started_time:
-                self.stimuli_data.append(None)
-                self.state.append(None)
-                self.started_time.append(None)
-                self.stopped_time.append(None)
-            elif image_started_time <= timestamp <= image_stopped_time:
-                self.stimuli_data.append(image_name)
-                self.state.append(state)
-                self.started_time.append(image_started_time)
-                self.stopped_time.append(image_stopped_time)
-            else:
-                img_idx += 1
-                if img_idx >= len(self.pending_data):
-                    break
-                self.stimuli_data.append(None)
-                self.state.append(None)
-                self.started_time.append(None)
-                self.stopped_time.append(None)             
-                
-                
-        # 残りをNoneで埋める
-        for _ in range(max(0, self.em_data.shape[0] - len(self.stimuli_data))):
-            self.stimuli_data.append(None)
-            self.state.append(None)
-            self.started_time.append(None)
-            self.stopped_time.append(None)
-        
-        self.em_data["stimuli"] = self.stimuli_data
-        self.em_data["state"] = self.state
-        self.em_data["started_time"] = self.started_time
-        self.em_data["stopped_time"] = self.stopped_time
-        
+        if self.em_data is None:
+            self.em_data = pd.concat(list(self.synced_segments()), ignore_index=True)
+            return
+        # Trials, probes and sync columns are described by alignment.FREEVIEWING_TRIALS
+        align(self.em_data, self.psychopy_data, FREEVIEWING_TRIALS, self.ExpTime, self.clock_offset)
+
+    def synced_segments(self):
+        # Synced em data of a session recorded in segments, one dataframe per segment
+        read_segments = partial(segment_frames, self.em_data_path)
+        for segment in align_segments(read_segments, self.psychopy_data, FREEVIEWING_TRIALS, self.ExpTime, self.clock_offset):
+            split_point_columns(segment)
+            yield segment
+
     def save_data(self):
         self.em_data.to_csv(self.target_file_path, index=False)
     
@@ -86,8 +56,10 @@ if __name__ == "__main__":
     for name in name_list:
         psychopy_folder_path = os.path.join(freeviewing_raw_dir, name, "data")
         em_folder_path = os.path.join(freeviewing_raw_dir, name, "em")
+        # .gaze binary recordings -> em csv
+        convert_recordings(em_folder_path)
         data_list = [file_name for file_name in os.listdir(psychopy_folder_path) if file_name.endswith(".csv")]
-        em_list = [file_name for file_name in os.listdir(em_folder_path) if file_name.endswith(".csv")]
+        em_list = session_recordings(em_folder_path)  # em csv files and segment indexes
         sorted_data_list = sorted(data_list, key=lambda x: int(re.search(r'(\d+)\.csv$', x).group(1)))
         sorted_em_list = sorted(em_list, key=lambda x: re.search(r'(\d{12})', x).group())
 
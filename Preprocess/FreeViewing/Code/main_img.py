@@ -1,39 +1,132 @@
 import os
-import pandas as pd
-from math import tan, pi, sqrt
-import ast
+import sys
+import time
+import argparse
 import re
-from datetime import datetime, timedelta    
+from functools import partial
 from OOP_sync_img import DataSynchronization, psychopy_to_datetime, str_to_datetime
 from OOP_preprocess_img import EyeMovement
-from tqdm import tqdm
 
-if __name__ == "__main__":
-    freeviewing_raw_dir = "./Data_Collection/FreeViewing/Raw"
-    target_file_dir = "./Preprocess/FreeViewing/Data"
-    if not os.path.exists(target_file_dir):
-        os.makedirs(target_file_dir)
-    name_list = sorted(list(os.listdir(freeviewing_raw_dir)))
-    for name in tqdm(name_list):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Common"))
+from batch import run_sessions, print_report
+from manifest import Manifest
+from gaze_recording import convert_recordings
+from segments import is_segment_index, read_index, session_recordings
+from segment_cache import SegmentCache
+from capture_telemetry import check_capture
+from alignment import clock_file_path
+
+
+def list_sessions(raw_dir, target_file_dir):
+    # (psychopy csv, em csv, target csv) of every session, in participant and session order
+    sessions = []
+    name_list = sorted(list(os.listdir(raw_dir)))
+    for name in name_list:
         if name.startswith("."): continue
-        psychopy_folder_path = os.path.join(freeviewing_raw_dir, name, "data")
-        em_folder_path = os.path.join(freeviewing_raw_dir, name, "em")
+        psychopy_folder_path = os.path.join(raw_dir, name, "data")
+        em_folder_path = os.path.join(raw_dir, name, "em")
+        # .gaze binary recordings -> em csv
+        convert_recordings(em_folder_path)
         data_list = [file_name for file_name in os.listdir(psychopy_folder_path) if file_name.endswith(".csv")]
-        em_list = [file_name for file_name in os.listdir(em_folder_path) if file_name.endswith(".csv")]
+        em_list = session_recordings(em_folder_path)  # em csv files and segment indexes
         sorted_data_list = sorted(data_list, key=lambda x: int(re.search(r'(\d+)\.csv$', x).group(1)))
         sorted_em_list = sorted(em_list, key=lambda x: re.search(r'(\d{12})', x).group())
 
         for psychopy_data_name, em_data_name in zip(sorted_data_list, sorted_em_list):
-            print(f"Synchronizing {psychopy_data_name} and {em_data_name}")
             psychopy_data_path = os.path.join(psychopy_folder_path, psychopy_data_name)
             em_data_path = os.path.join(em_folder_path, em_data_name)
             target_file_path = os.path.join(target_file_dir, psychopy_data_name)
-            ds = DataSynchronization(psychopy_data_path=psychopy_data_path, em_data_path=em_data_path, target_file_path=target_file_path)
-            ds.run()
-            # ds.em_dataの中身がsyncされたデータ
-            em = EyeMovement(target_file_path)
-            em.run()
-            print(f"Finished Synchronizing {psychopy_data_name} and {em_data_name}")
-            print("==========================================================")
-    print("All files have been synchronized!")
-    print("==========================================================")
\ No newline at end of file
+            sessions.append((psychopy_data_path, em_data_path, target_file_path))
+    return sessions
+
+
+def session_inputs(session):
+    # Files the output of a session depends on: psychopy csv, em csv or segment index, and the clock file of the recording
+    psychopy_data_path, em_data_path = session[:2]
+    clock_path = clock_file_path(em_data_path)
+    return [psychopy_data_path, em_data_path] + ([clock_path] if os.path.exists(clock_path) else [])
+
+
+def preprocess_session(psychopy_data_path, em_data_path, target_file_path, chunk_size=None):
+    print(f"Synchronizing {os.path.basename(psychopy_data_path)} and {os.path.basename(em_data_path)}")
+    ds = DataSynchronization(psychopy_data_path=psychopy_data_path, em_data_path=em_data_path, target_file_path=target_file_path)
+    # Dropped / late samples and a rate off the nominal one, from the recorder telemetry
+    for warning in check_capture(em_data_path, ds.em_data):
+        print(f"WARNING {os.path.basename(em_data_path)}: degraded capture, {warning}")
+    if is_segment_index(em_data_path):
+        # Recorded in segments: synced and classified one segment at a time, the synced csv is not written.
+        # Segments classified while recording (--watch) are only synced, the cache classifies the rest first
+        cache = SegmentCache(em_data_path, EyeMovement)
+        if cache.exists():
+            cache.update()
+        em = EyeMovement(target_file_path, chunks=ds.synced_segments, cache=cache)
+    elif chunk_size is None:
+        # ds.em_dataの中身がsyncされたデータ, classified in memory and written once
+        ds.sync_data()
+        em = EyeMovement(target_file_path, data=ds.em_data)
+    else:
+        # The streaming mode reads the synced csv back chunk by chunk
+        ds.run()
+        em = EyeMovement(target_file_path, chunk_size=chunk_size)
+    em.run()
+    print(f"Finished Synchronizing {os.path.basename(psychopy_data_path)} and {os.path.basename(em_data_path)}")
+
+
+def update_segment_caches(raw_dir):
+    # Classify the segments completed since the last pass, of every session recorded in segments (segment_cache.py)
+    for name in sorted(os.listdir(raw_dir)):
+        em_folder_path = os.path.join(raw_dir, name, "em")
+        if name.startswith(".") or not os.path.isdir(em_folder_path): continue
+        for em_data_name in session_recordings(em_folder_path):
+            if is_segment_index(em_data_name):
+                SegmentCache(os.path.join(em_folder_path, em_data_name), EyeMovement).update()
+
+
+def preprocess_pending(raw_dir, target_file_dir, args):
+    sessions = list_sessions(raw_dir, target_file_dir)
+    # A session recorded in segments is preprocessed once the recorder has stopped
+    sessions = [session for session in sessions if not is_segment_index(session[1]) or read_index(session[1])["complete"]]
+    n_sessions = len(sessions)
+    # Only new sessions, sessions whose inputs changed and sessions processed with other parameters
+    manifest = Manifest(target_file_dir)
+    params = EyeMovement.parameters()
+    if not args.force:
+        sessions = [session for session in sessions if not manifest.is_current(session[2], session_inputs(session), params)]
+    print(f"{len(sessions)} sessions to preprocess, {n_sessions - len(sessions)} up to date")
+    results = run_sessions(partial(preprocess_session, chunk_size=args.chunk_size), sessions, workers=args.workers)
+    for session, error, _ in results:
+        if error is None:
+            manifest.record(session[2], session_inputs(session), params)
+        else:
+            manifest.forget(session[2])
+    manifest.save()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, default: all cores, 1: no pool")
+    parser.add_argument("--chunk-size", type=int, default=None, help="classify the sessions in chunks of this many rows to bound memory (the synced csv is written and read back), default: whole session in memory. Sessions recorded in segments are always classified segment by segment")
+    parser.add_argument("--force", action="store_true", help="preprocess every session, even the ones that are up to date")
+    parser.add_argument("--watch", type=float, default=None, help="every this many seconds, classify the completed segments of the sessions being recorded and preprocess the finished sessions, until interrupted")
+    args = parser.parse_args()
+
+    freeviewing_raw_dir = "./Data_Collection/FreeViewing/Raw"
+    target_file_dir = "./Preprocess/FreeViewing/Data"
+    if not os.path.exists(target_file_dir):
+        os.makedirs(target_file_dir)
+    if args.watch is not None:
+        try:
+            while True:
+                update_segment_caches(freeviewing_raw_dir)
+                print_report(preprocess_pending(freeviewing_raw_dir, target_file_dir, args))
+                time.sleep(args.watch)
+        except KeyboardInterrupt:
+            sys.exit(0)
+    results = preprocess_pending(freeviewing_raw_dir, target_file_dir, args)
+    all_done = print_report(results)
+    if all_done:
+        print("All files have been synchronized!")
+        print("==========================================================")
+    else:
+        sys.exit(1)
@@ -3,63 +3,56 @@
 import numpy as np
 import pandas as pd
 import os
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Common"))
+from session_format import session_sampling_rate
+from scanpath import last_window, scanpath
+from scanpath_store import ScanpathWriter
 
 SCREEN_WIDTH = 1920
 SCREEN_HEIGHT = 1080
-SAMPLE_RATE = 60
 FIXATION_INDENTIFIER = "IVT_fixation_centroid"
-TRUNC_FRAMES = 30 * 60
-
-def to_pixel(x, y):
-    return x * SCREEN_WIDTH, y * SCREEN_HEIGHT
+TRUNC_SECONDS = 30
+STORE_PATH = "./Preprocess/FreeViewing/Scanpath/MultiMatch.scanpaths"
 
-def extract_scanpath(file_path):
+def extract_scanpath(file_path, store=None):
+    # store: ScanpathWriter, the TSVs are written without one
     name = os.path.splitext(os.path.basename(file_path))[0].split("_")[0]
-    if not os.path.exists(f"./Preprocess/FreeViewing/Scanpath/MultiMatch/{name}"):
+    if store is None and not os.path.exists(f"./Preprocess/FreeViewing/Scanpath/MultiMatch/{name}"):
         os.makedirs(f"./Preprocess/FreeViewing/Scanpath/MultiMatch/{name}")
     df = pd.read_csv(file_path, low_memory=False)
-    stimuli_list = df["stimuli"].dropna().unique()
-    for stimuli in stimuli_list:
-        stimuli_df = df[df["stimuli"] == stimuli]
-        
+    sample_rate = session_sampling_rate(df)
+    trunc_frames = round(TRUNC_SECONDS * sample_rate)
+    centroid_x = df[f"{FIXATION_INDENTIFIER}_x"].to_numpy(dtype=np.float64)
+    centroid_y = df[f"{FIXATION_INDENTIFIER}_y"].to_numpy(dtype=np.float64)
+    states = df["state"].to_numpy()
+    for stimuli, rows in df.groupby("stimuli", sort=False).indices.items():
         # Change this if you want to truncate the scanpath data
-        stimuli_df = stimuli_df[-TRUNC_FRAMES:]
-        
-        state = "Focus" if stimuli_df["state"].values[0] == 'num_4' else "MW"
+        first, last = last_window(len(rows), trunc_frames)
+
+        state = "Focus" if states[rows[first]] == 'num_4' else "MW"
         output_file_path = f"./Preprocess/FreeViewing/Scanpath/MultiMatch/{name}/{name}_{stimuli}_{state}.tsv"
-        data = pd.DataFrame(columns=["start_x", "start_y", "duration"])
-        x_list = []
-        y_list = []
-        duration_list = []
-        i = 0
-        rows = stimuli_df.shape[0]
-        while i < rows:
-            cur_x, cur_y = eval(stimuli_df[FIXATION_INDENTIFIER].values[i])
-            if cur_x is None or cur_y is None:
-                i += 1
-                continue
-            cur_x, cur_y = to_pixel(cur_x, cur_y)
-            j = i + 1
-            while j < rows and stimuli_df[FIXATION_INDENTIFIER].values[j] == stimuli_df[FIXATION_INDENTIFIER].values[i]:
-                j += 1
-            duration = (j - i) / SAMPLE_RATE
-            x_list.append(cur_x)
-            y_list.append(cur_y)
-            duration_list.append(duration)
-            i = j
-        data["start_x"] = x_list
-        data["start_y"] = y_list
-        data["duration"] = duration_list
-        data.to_csv(output_file_path, sep="\t", index=False)
+        data = scanpath(centroid_x[rows], centroid_y[rows], sample_rate, SCREEN_WIDTH, SCREEN_HEIGHT, first, last)
+        if store is not None:
+            store.add(name, stimuli, state, "MultiMatch", data)
+        else:
+            data.to_csv(output_file_path, sep="\t", index=False)
 
 if __name__ == '__main__':
-    if not os.path.exists("./Preprocess/FreeViewing/Scanpath"):
-        os.makedirs("./Preprocess/FreeViewing/Scanpath")
-    if not os.path.exists("./Preprocess/FreeViewing/Scanpath/MultiMatch"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tsv", action="store_true", help="write the legacy TSVs of Scanpath/MultiMatch instead of the store")
+    args = parser.parse_args()
+    if args.tsv and not os.path.exists("./Preprocess/FreeViewing/Scanpath/MultiMatch"):
         os.makedirs("./Preprocess/FreeViewing/Scanpath/MultiMatch")
     input_dir = "./Preprocess/FreeViewing/Data"
-    
-    for file_name in os.listdir(input_dir):
-        if file_name.startswith("."):
-            continue
-        extract_scanpath(os.path.join(input_dir, file_name))
\ No newline at end of file
+    file_names = [file_name for file_name in os.listdir(input_dir) if not file_name.startswith(".")]
+
+    if args.tsv:
+        for file_name in file_names:
+            extract_scanpath(os.path.join(input_dir, file_name))
+    else:
+        with ScanpathWriter(STORE_PATH) as store:
+            for file_name in file_names:
+                extract_scanpath(os.path.join(input_dir, file_name), store)
@@ -1,72 +1,75 @@
 """
-This code will truncate the scanpath for all window sizes range(4, 45, 4)
-target folder: Preprocess/FreeViewing/Scanpath/{window_size}/{subject_id}.csv
+This code will truncate the scanpath for all window sizes (--windows, default range(4, 45, 4))
+Rerunning with --windows rewrites those windows only, the other windows of the store are kept
+target file: Preprocess/FreeViewing/Scanpath/windows.scanpaths (Preprocess/Common/scanpath_store.py), window = window size
+with --tsv: Preprocess/FreeViewing/Scanpath/{window_size}/{subject_id}/{subject_id}_{stimuli}_{state}.tsv
 """
 # Truncate the scanpath data to the MultiMatch format
 
 import numpy as np
 import pandas as pd
 import os
+import sys
+import argparse
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Common"))
+from session_format import TIME_COLUMNS, session_sampling_rate
+from scanpath import centroid_runs, last_window, scanpath
+from scanpath_store import ScanpathWriter
+
 SCREEN_WIDTH = 1920
 SCREEN_HEIGHT = 1080
-SAMPLE_RATE = 60
 FIXATION_INDENTIFIER = "IVT_fixation_centroid"
-TRUNC_FRAMES = None
-
-def to_pixel(x, y):
-    return x * SCREEN_WIDTH, y * SCREEN_HEIGHT
+WINDOW_SIZES = range(4, 45, 4)  # s
+STORE_PATH = "./Preprocess/FreeViewing/Scanpath/windows.scanpaths"
 
-def extract_scanpath(file_path, win_size):
-    TRUNC_FRAMES = win_size * SAMPLE_RATE
+def extract_scanpath(file_path, win_sizes=WINDOW_SIZES, store=None):
+    """
+    Write the scanpath of every stimulus of the session for every window size (s), to the ScanpathWriter store,
+    or to the TSVs without one.
+    The session is read and split by stimulus once, and the runs of fixation centroids of each stimulus are found once.
+    """
     name = os.path.splitext(os.path.basename(file_path))[0].split("_")[0]
-    if not os.path.exists(f"./Preprocess/FreeViewing/Scanpath/{win_size}/{name}"):
-        os.makedirs(f"./Preprocess/FreeViewing/Scanpath/{win_size}/{name}")
-    df = pd.read_csv(file_path, low_memory=False)
-    stimuli_list = df["stimuli"].dropna().unique()
-    for stimuli in stimuli_list:
-        stimuli_df = df[df["stimuli"] == stimuli]
-        
-        # Change this if you want to truncate the scanpath data
-        stimuli_df = stimuli_df[-TRUNC_FRAMES:]
-        
-        state = "Focus" if stimuli_df["state"].values[0] == 'num_4' else "MW"
-        output_file_path = f"./Preprocess/FreeViewing/Scanpath/{win_size}/{name}/{name}_{stimuli}_{state}.tsv"
-        data = pd.DataFrame(columns=["start_x", "start_y", "duration"])
-        x_list = []
-        y_list = []
-        duration_list = []
-        i = 0
-        rows = stimuli_df.shape[0]
-        while i < rows:
-            cur_x, cur_y = eval(stimuli_df[FIXATION_INDENTIFIER].values[i])
-            if cur_x is None or cur_y is None:
-                i += 1
-                continue
-            cur_x, cur_y = to_pixel(cur_x, cur_y)
-            j = i + 1
-            while j < rows and stimuli_df[FIXATION_INDENTIFIER].values[j] == stimuli_df[FIXATION_INDENTIFIER].values[i]:
-                j += 1
-            duration = (j - i) / SAMPLE_RATE
-            x_list.append(cur_x)
-            y_list.append(cur_y)
-            duration_list.append(duration)
-            i = j
-        data["start_x"] = x_list
-        data["start_y"] = y_list
-        data["duration"] = duration_list
-        data.to_csv(output_file_path, sep="\t", index=False)
+    columns = {"stimuli", "state", f"{FIXATION_INDENTIFIER}_x", f"{FIXATION_INDENTIFIER}_y", *TIME_COLUMNS}
+    df = pd.read_csv(file_path, low_memory=False, usecols=lambda column: column in columns)
+    sample_rate = session_sampling_rate(df)
+    centroid_x = df[f"{FIXATION_INDENTIFIER}_x"].to_numpy(dtype=np.float64)
+    centroid_y = df[f"{FIXATION_INDENTIFIER}_y"].to_numpy(dtype=np.float64)
+    states = df["state"].to_numpy()
+    stimuli_rows = []
+    # Rows of every stimulus, in order of appearance
+    for stimuli, rows in df.groupby("stimuli", sort=False).indices.items():
+        x, y = centroid_x[rows], centroid_y[rows]
+        stimuli_rows.append((stimuli, rows, x, y, centroid_runs(x, y)))
+
+    for win_size in win_sizes:
+        output_dir = f"./Preprocess/FreeViewing/Scanpath/{win_size}/{name}"
+        if store is None:
+            os.makedirs(output_dir, exist_ok=True)
+        trunc_frames = round(win_size * sample_rate)
+        for stimuli, rows, x, y, runs in stimuli_rows:
+            first, last = last_window(len(rows), trunc_frames)
+            # The state of the first row of the window
+            state = "Focus" if states[rows[first]] == 'num_4' else "MW"
+            data = scanpath(x, y, sample_rate, SCREEN_WIDTH, SCREEN_HEIGHT, first, last, runs)
+            if store is not None:
+                store.add(name, stimuli, state, win_size, data)
+            else:
+                data.to_csv(f"{output_dir}/{name}_{stimuli}_{state}.tsv", sep="\t", index=False)
 
 if __name__ == '__main__':
-    if not os.path.exists("./Preprocess/FreeViewing/Scanpath"):
-        os.makedirs("./Preprocess/FreeViewing/Scanpath")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", type=int, nargs="+", default=list(WINDOW_SIZES), help="window sizes in seconds, default: 4 8 ... 44")
+    parser.add_argument("--tsv", action="store_true", help="write the legacy TSVs instead of the store")
+    args = parser.parse_args()
     input_dir = "./Preprocess/FreeViewing/Data"
-    
-    for win_size in tqdm(range(4, 45, 4)):
-        if not os.path.exists(f"./Preprocess/FreeViewing/Scanpath/{win_size}"):
-            os.makedirs(f"./Preprocess/FreeViewing/Scanpath/{win_size}")
-        for file_name in os.listdir(input_dir):
-            if file_name.startswith("."): continue
-            file_path = os.path.join(input_dir, file_name)
-            extract_scanpath(file_path, win_size)
\ No newline at end of file
+    file_names = [file_name for file_name in sorted(os.listdir(input_dir)) if not file_name.startswith(".")]
+
+    if args.tsv:
+        for file_name in tqdm(file_names):
+            extract_scanpath(os.path.join(input_dir, file_name), args.windows)
+    else:
+        with ScanpathWriter(STORE_PATH, args.windows) as store:
+            for file_name in tqdm(file_names):
+                extract_scanpath(os.path.join(input_dir, file_name), args.windows, store)
\ No newline at end of file
@@ -1,6 +1,8 @@
 """
-This code will truncate the scanpath for all window sizes range(4, 61, 4)
-target folder: Preprocess/FreeViewing/Scanpath/{window_size}/{subject_id}.csv
+This code will truncate the scanpath for all window sizes (--windows, default range(4, 61, 4))
+Rerunning with --windows rewrites those windows only, the other windows of the store are kept
+target file: Preprocess/SART/Scanpath/windows.scanpaths (Preprocess/Common/scanpath_store.py), window = window size
+with --tsv: Preprocess/SART/Scanpath/{window_size}/{subject_id}/{subject_id}_{probe}_{state}.tsv
 
 # Scanpath for SART
 # Truncate the scanpath data to the MultiMatch format
@@ -11,86 +13,66 @@ target folder: Preprocess/FreeViewing/Scanpath/{window_size}/{subject_id}.csv
 import numpy as np
 import pandas as pd
 import os
+import sys
+import argparse
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Common"))
+from session_format import TIME_COLUMNS, session_sampling_rate
+from scanpath import centroid_runs, last_window, scanpath
+from probe_index import read_probe_index
+from scanpath_store import ScanpathWriter
+
 SCREEN_WIDTH = 1920
 SCREEN_HEIGHT = 1080
-SAMPLE_RATE = 60
 FIXATION_INDENTIFIER = "IVT_fixation_centroid"
-TRUNC_FRAMES = None
-
-def to_pixel(x, y):
-    return x * SCREEN_WIDTH, y * SCREEN_HEIGHT
+WINDOW_SIZES = range(4, 61, 4)  # s
+STORE_PATH = "./Preprocess/SART/Scanpath/windows.scanpaths"
 
-def extract_scanpath(file_path, win_size):
-    TRUNC_FRAMES = win_size * SAMPLE_RATE
+def extract_scanpath(file_path, win_sizes=WINDOW_SIZES, store=None):
+    """
+    Write the scanpath of every probe of the session for every window size (s), to the ScanpathWriter store,
+    or to the TSVs without one.
+    The probes are sliced from the probe index of the session, and the runs of fixation centroids of each probe are found once.
+    """
     name = os.path.splitext(os.path.basename(file_path))[0].split("_")[0]
-    if not os.path.exists(f"./Preprocess/SART/Scanpath/{win_size}/{name}"):
-        os.makedirs(f"./Preprocess/SART/Scanpath/{win_size}/{name}")
-    df = pd.read_csv(file_path, low_memory=False)
-    offset = int(file_path.split("_")[-1].split(".")[0]) - 1
-    n = df.shape[0]
-    cur_probe = 0
-    probe_number = None
-    state = None
-    idx = 0
-    # First crop the raw data for each probe
-    while idx < n-1:
-        prev = df.iloc[idx]
-        next = df.iloc[idx+1]
-        if pd.isna(prev["state"]) and not pd.isna(next["state"]):
-            cur_probe += 1
-            state = "Focus" if next["state"] == 'num_4' else "MW"
-            probe_number = offset * 5 + cur_probe
-            j = idx + 1
-            fixation_centroid = []
-            while j < n and not pd.isna(df.iloc[j]["state"]):
-                fixation_centroid.append(eval(df.iloc[j][FIXATION_INDENTIFIER]))
-                j += 1
-            idx = j
-            
-            fixation_centroid = fixation_centroid[-TRUNC_FRAMES:]
-            
-            # Then convert the fixation centroid to {"start_x", "start_y", "duration"}
-            output_file_path = f"./Preprocess/SART/Scanpath/{win_size}/{name}/{name}_{probe_number}_{state}.tsv"
-            data = pd.DataFrame(columns=["start_x", "start_y", "duration"])
-            x_list = []
-            y_list = []
-            duration_list = []
-            k = 0
-            
-            while k < len(fixation_centroid) - 1:
-                if fixation_centroid[k][0] is None or fixation_centroid[k][1] is None:
-                    k += 1
-                    continue
-                x, y = to_pixel(fixation_centroid[k][0], fixation_centroid[k][1])
-                x_list.append(x)
-                y_list.append(y)
-                l = k + 1
-                while l < len(fixation_centroid) and fixation_centroid[l] == fixation_centroid[k]:
-                    l += 1
-                # duration in seconds
-                duration = (l - k) / SAMPLE_RATE
-                duration_list.append(duration)
-                k = l        
+    columns = {f"{FIXATION_INDENTIFIER}_x", f"{FIXATION_INDENTIFIER}_y", *TIME_COLUMNS}
+    df = pd.read_csv(file_path, low_memory=False, usecols=lambda column: column in columns)
+    sample_rate = session_sampling_rate(df)
+    centroid_x = df[f"{FIXATION_INDENTIFIER}_x"].to_numpy(dtype=np.float64)
+    centroid_y = df[f"{FIXATION_INDENTIFIER}_y"].to_numpy(dtype=np.float64)
+    probes = []
+    for probe in read_probe_index(file_path):
+        x, y = centroid_x[probe.start:probe.end], centroid_y[probe.start:probe.end]
+        probes.append((probe.probe, probe.label, x, y, centroid_runs(x, y)))
+
+    for win_size in win_sizes:
+        output_dir = f"./Preprocess/SART/Scanpath/{win_size}/{name}"
+        if store is None:
+            os.makedirs(output_dir, exist_ok=True)
+        trunc_frames = round(win_size * sample_rate)
+        for probe_number, state, x, y, runs in probes:
+            first, last = last_window(len(x), trunc_frames)
+            # A fixation starting at the last sample of the probe was never written
+            data = scanpath(x, y, sample_rate, SCREEN_WIDTH, SCREEN_HEIGHT, first, last, runs, drop_last=True)
+            if store is not None:
+                store.add(name, probe_number, state, win_size, data)
+            else:
+                data.to_csv(f"{output_dir}/{name}_{probe_number}_{state}.tsv", sep="\t", index=False)
 
-            data["start_x"] = x_list
-            data["start_y"] = y_list
-            data["duration"] = duration_list
-            data.to_csv(output_file_path, sep="\t", index=False)
-            
-        idx += 1
-        
 
 if __name__ == '__main__':
-    if not os.path.exists("./Preprocess/SART/Scanpath"):
-        os.makedirs("./Preprocess/SART/Scanpath")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", type=int, nargs="+", default=list(WINDOW_SIZES), help="window sizes in seconds, default: 4 8 ... 60")
+    parser.add_argument("--tsv", action="store_true", help="write the legacy TSVs instead of the store")
+    args = parser.parse_args()
     input_dir = "./Preprocess/SART/Data"
-    
-    for win_size in tqdm(range(4, 61, 4)):
-        if not os.path.exists(f"./Preprocess/SART/Scanpath/{win_size}"):
-            os.makedirs(f"./Preprocess/SART/Scanpath/{win_size}")
-        for file_name in os.listdir(input_dir):
-            if file_name.startswith("."): continue
-            file_path = os.path.join(input_dir, file_name)
-            extract_scanpath(file_path, win_size)
\ No newline at end of file
+    file_names = [file_name for file_name in sorted(os.listdir(input_dir)) if not file_name.startswith(".")]
+
+    if args.tsv:
+        for file_name in tqdm(file_names):
+            extract_scanpath(os.path.join(input_dir, file_name), args.windows)
+    else:
+        with ScanpathWriter(STORE_PATH, args.windows) as store:
+            for file_name in tqdm(file_names):
+                extract_scanpath(os.path.join(input_dir, file_name), args.windows, store)
\ No newline at end of file